@@ -0,0 +1,90 @@
+"""
+Benchmarks for the ShopCarts service
+
+Each benchmark is a script that can be run with:
+  python -m benchmarks.<name>
+
+They use DATABASE_URI like the tests do, so point it at a scratch database.
+"""
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from service.models import db, ShopCart, CartItem
+
+
+@contextmanager
+def count_queries():
+    """ Counts the SQL statements issued inside the block """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def db_timer():
+    """ Measures the time spent executing SQL statements inside the block """
+    elapsed = [0.0]
+    started = []
+
+    def before_cursor_execute(*args):
+        started.append(time.perf_counter())
+
+    def after_cursor_execute(*args):
+        elapsed[0] += time.perf_counter() - started.pop()
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(db.engine, "after_cursor_execute", after_cursor_execute)
+    try:
+        yield elapsed
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(db.engine, "after_cursor_execute", after_cursor_execute)
+
+
+@contextmanager
+def timer():
+    """ Measures the wall clock time of the block in seconds """
+    elapsed = [0.0]
+    start = time.perf_counter()
+    try:
+        yield elapsed
+    finally:
+        elapsed[0] = time.perf_counter() - start
+
+
+def reset_db():
+    """ Drops and recreates all of the tables """
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def seed(carts, items_per_cart=0, batch_size=10000):
+    """ Inserts carts and items with multi-row INSERTs and returns the cart ids """
+    cart_rows = [{"id": n + 1, "customer_id": n} for n in range(carts)]
+    for start in range(0, len(cart_rows), batch_size):
+        db.session.execute(ShopCart.__table__.insert(), cart_rows[start:start + batch_size])
+    item_rows = []
+    for cart in cart_rows:
+        for n in range(items_per_cart):
+            item_rows.append({
+                "shopcart_id": cart["id"],
+                "item_name": "item %d" % n,
+                "sku": "%d-%d" % (cart["id"], n),
+                "quantity": 1,
+                "price": 9.99,
+            })
+            if len(item_rows) == batch_size:
+                db.session.execute(CartItem.__table__.insert(), item_rows)
+                item_rows = []
+    if item_rows:
+        db.session.execute(CartItem.__table__.insert(), item_rows)
+    db.session.commit()
+    return [cart["id"] for cart in cart_rows]
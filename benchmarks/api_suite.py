@@ -0,0 +1,247 @@
+"""
+REST API benchmark suite
+
+Seeds CARTS carts with ITEMS items each through tests/factories.py, then
+sends REQUESTS requests to each endpoint below, after WARMUP untimed ones,
+and reports requests/sec with p50/p95/p99 latency per endpoint:
+  python -m benchmarks.api_suite inprocess gunicorn
+
+Drivers:
+  inprocess - the Flask test client, one request at a time, no HTTP
+  gunicorn  - gunicorn.conf.py on LOAD_TEST_PORT (GUNICORN_WORKER_CLASS
+              picks the workers) driven from CONCURRENCY client threads
+
+It runs against DATABASE_URI, so a file SQLite database
+(sqlite:////tmp/bench.db) or a local Postgres. Every run is saved as JSON
+in RESULTS_DIR, named after the commit, the driver and the database, and
+two runs can be compared with benchmarks/compare.py.
+
+SEED makes the data and the request order the same on every run.
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime
+from urllib.error import HTTPError, URLError
+
+# the suite measures the service, not the writes of a log line per request
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import factory.random
+from service import app
+from service.models import db, ShopCart, CartItem
+from tests.factories import ShopCartFactory, CartItemFactory
+from benchmarks import timer, reset_db
+from benchmarks.load_test import percentile, start_server
+
+CARTS = int(os.getenv("CARTS", "1000"))
+ITEMS = int(os.getenv("ITEMS", "10"))
+REQUESTS = int(os.getenv("REQUESTS", "1000"))
+WARMUP = int(os.getenv("WARMUP", "50"))
+CONCURRENCY = int(os.getenv("CONCURRENCY", "8"))
+SEED = int(os.getenv("SEED", "1"))
+RESULTS_DIR = os.getenv("RESULTS_DIR", os.path.join(os.path.dirname(__file__), "results"))
+
+# name -> (method, path, body), formatted with a seeded cart, item and sku
+ENDPOINTS = {
+    "get_cart": ("GET", "/shopcarts/{cart}", None),
+    "cart_summary": ("GET", "/shopcarts/{cart}/summary", None),
+    "list_carts": ("GET", "/shopcarts?limit=50&after_id={cart}", None),
+    "list_items": ("GET", "/shopcarts/{cart}/items", None),
+    "get_item": ("GET", "/shopcarts/{cart}/items/{item}", None),
+    "find_by_sku": ("GET", "/shopcarts?sku={sku}", None),
+    "increment": ("POST", "/shopcarts/{cart}/items/BENCH-1:increment", {"quantity": 1}),
+    "create_cart": ("POST", "/shopcarts", {"customer_id": 1, "items": [
+        {"shopcart_id": 0, "item_name": "hat", "sku": "HAT-1", "quantity": 1, "price": 9.99},
+        {"shopcart_id": 0, "item_name": "sock", "sku": "SOCK-1", "quantity": 2, "price": 4.5},
+    ]}),
+}
+
+
+def seed_factories(carts=CARTS, items_per_cart=ITEMS, batch_size=500):
+    """ Inserts factory made carts and items and returns (cart, item, sku) targets """
+    factory.random.reseed_random(SEED)
+    for start in range(0, carts, batch_size):
+        shopcarts = []
+        for _ in range(min(batch_size, carts - start)):
+            shopcart = ShopCartFactory(id=None)
+            shopcart.items = CartItemFactory.build_batch(items_per_cart, id=None, shopcart_id=None)
+            shopcarts.append(shopcart)
+        ShopCart.bulk_create(shopcarts)
+        db.session.remove()
+    # one item of every cart to aim the item endpoints at
+    rows = db.session.query(
+        CartItem.shopcart_id, db.func.min(CartItem.id), db.func.min(CartItem.sku)
+    ).group_by(CartItem.shopcart_id).all()
+    db.session.remove()
+    return [{"cart": cart, "item": item, "sku": sku} for cart, item, sku in rows]
+
+
+def plan(targets, count):
+    """ Returns the same sequence of targets for the same SEED """
+    rng = random.Random(SEED)
+    return [rng.choice(targets) for _ in range(count)]
+
+
+def summarize(latencies, errors, seconds):
+    """ Returns the request rate and latency percentiles of an endpoint """
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+def run_inprocess(targets):
+    """ Drives every endpoint through the Flask test client """
+    client = app.test_client()
+    results = {}
+    for name, (method, path, body) in ENDPOINTS.items():
+        requests = plan(targets, WARMUP + REQUESTS)
+        for target in requests[:WARMUP]:
+            client.open(path.format(**target), method=method, json=body)
+        latencies = []
+        errors = 0
+        with timer() as elapsed:
+            for target in requests[WARMUP:]:
+                start = time.perf_counter()
+                resp = client.open(path.format(**target), method=method, json=body)
+                latencies.append(time.perf_counter() - start)
+                if resp.status_code >= 400:
+                    errors += 1
+        results[name] = summarize(latencies, errors, elapsed[0])
+    return results
+
+
+def send(base_url, method, path, body):
+    """ Sends one HTTP request and returns its status code """
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    req = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except HTTPError as error:
+        return error.code
+
+
+def run_gunicorn(targets):
+    """ Drives every endpoint over HTTP from CONCURRENCY threads """
+    server, base_url = start_server(os.getenv("GUNICORN_WORKER_CLASS", "sync"))
+    results = {}
+    try:
+        for name, (method, path, body) in ENDPOINTS.items():
+            requests = plan(targets, WARMUP + REQUESTS)
+            for target in requests[:WARMUP]:
+                send(base_url, method, path.format(**target), body)
+            latencies = []
+            errors = [0]
+            lock = threading.Lock()
+
+            def client(mine):
+                times = []
+                failed = 0
+                for target in mine:
+                    start = time.perf_counter()
+                    try:
+                        status = send(base_url, method, path.format(**target), body)
+                    except (URLError, OSError):
+                        status = 599
+                    times.append(time.perf_counter() - start)
+                    if status >= 400:
+                        failed += 1
+                with lock:
+                    latencies.extend(times)
+                    errors[0] += failed
+
+            timed = requests[WARMUP:]
+            threads = [
+                threading.Thread(target=client, args=(timed[n::CONCURRENCY],))
+                for n in range(CONCURRENCY)
+            ]
+            with timer() as elapsed:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            results[name] = summarize(latencies, errors[0], elapsed[0])
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+DRIVERS = {"inprocess": run_inprocess, "gunicorn": run_gunicorn}
+
+
+def git_commit():
+    """ Returns the commit being measured, marked when the tree has changes """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).decode().strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"])
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty.strip() else "")
+
+
+def save(driver, results, seed_seconds):
+    """ Writes a run to RESULTS_DIR and returns the path """
+    commit = git_commit()
+    database = db.engine.dialect.name
+    run = {
+        "commit": commit,
+        "driver": driver,
+        "database": database,
+        "date": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "settings": {
+            "carts": CARTS, "items": ITEMS, "requests": REQUESTS, "warmup": WARMUP,
+            "concurrency": CONCURRENCY if driver == "gunicorn" else 1, "seed": SEED,
+            "worker_class": os.getenv("GUNICORN_WORKER_CLASS", "sync"),
+        },
+        "seed_seconds": round(seed_seconds, 3),
+        "endpoints": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "%s-%s-%s.json" % (commit, driver, database))
+    with open(path, "w") as results_file:
+        json.dump(run, results_file, indent=2)
+    return path
+
+
+def print_results(driver, results):
+    print("%-10s %-14s %10s %10s %10s %10s %8s" % (
+        "driver", "endpoint", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors"
+    ))
+    for name, result in results.items():
+        print("%-10s %-14s %10.1f %10.2f %10.2f %10.2f %8d" % (
+            driver, name, result["rps"], result["p50_ms"], result["p95_ms"],
+            result["p99_ms"], result["errors"]
+        ))
+
+
+def main(drivers):
+    for driver in drivers:
+        reset_db()
+        with timer() as elapsed:
+            targets = seed_factories()
+        print("seeded %d carts x %d items in %.1fs" % (CARTS, ITEMS, elapsed[0]))
+        results = DRIVERS[driver](targets)
+        print_results(driver, results)
+        print("saved %s" % save(driver, results, elapsed[0]))
+    reset_db()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["inprocess"])
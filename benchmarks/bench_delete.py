@@ -0,0 +1,37 @@
+"""
+Bulk delete benchmark
+
+Shows that /shopcarts/clear and /shopcarts/<id>/clear issue the same number
+of statements no matter how many rows they remove:
+  python -m benchmarks.bench_delete
+"""
+from service import app
+from benchmarks import count_queries, timer, reset_db, seed
+
+SIZES = [10000, 100000]
+
+
+def main():
+    client = app.test_client()
+    print("%-24s %10s %10s %10s" % ("endpoint", "rows", "queries", "seconds"))
+    for size in SIZES:
+        reset_db()
+        seed(size, items_per_cart=1)
+        with count_queries() as statements, timer() as elapsed:
+            resp = client.get("/shopcarts/clear")
+        print("%-24s %10s %10d %10.3f" % (
+            "GET /shopcarts/clear", resp.headers["X-Deleted-Count"], len(statements), elapsed[0]
+        ))
+
+        reset_db()
+        shopcart_id = seed(1, items_per_cart=size)[0]
+        with count_queries() as statements, timer() as elapsed:
+            resp = client.put("/shopcarts/{}/clear".format(shopcart_id))
+        print("%-24s %10s %10d %10.3f" % (
+            "PUT /shopcarts/<id>/clear", resp.headers["X-Deleted-Count"], len(statements), elapsed[0]
+        ))
+    reset_db()
+
+
+if __name__ == "__main__":
+    main()
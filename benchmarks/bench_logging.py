@@ -0,0 +1,86 @@
+"""
+Logging overhead benchmark
+
+Drives GET /shopcarts/<id> and a POST /shopcarts every tenth request
+in-process REQUESTS times with the logs written to a file, once per
+logging setup, and prints the requests/sec of each:
+  REQUESTS=2000 python -m benchmarks.bench_logging
+
+SINK_DELAY_MS adds a wait to every write, to stand in for a log sink that
+blocks (a full pipe to the process manager, a remote syslog).
+
+  before  - every body and model log, written from the request thread
+  sync    - default levels and payload sampling, written from the request thread
+  queue   - default levels and payload sampling, written by the listener thread
+"""
+import os
+import logging
+import time
+import statistics
+import tempfile
+from service import app
+from service.logs import init_logging, stop_logging
+from benchmarks import timer, reset_db
+
+REQUESTS = int(os.getenv("REQUESTS", "2000"))
+ROUNDS = int(os.getenv("ROUNDS", "5"))
+SINK_DELAY_MS = float(os.getenv("SINK_DELAY_MS", "0"))
+
+SETUPS = [
+    ("before", {"LOG_QUEUE": False, "LOG_LEVELS": "", "LOG_PAYLOAD_SAMPLE_RATE": 1.0}),
+    ("sync", {"LOG_QUEUE": False, "LOG_LEVELS": "service.models=WARNING",
+              "LOG_PAYLOAD_SAMPLE_RATE": 0.01}),
+    ("queue", {"LOG_QUEUE": True, "LOG_LEVELS": "service.models=WARNING",
+               "LOG_PAYLOAD_SAMPLE_RATE": 0.01}),
+]
+
+
+class SlowFileHandler(logging.FileHandler):
+    """ A file handler that waits SINK_DELAY_MS on every record """
+
+    def emit(self, record):
+        super().emit(record)
+        if SINK_DELAY_MS:
+            time.sleep(SINK_DELAY_MS / 1000)
+
+
+def run(client):
+    """ Returns requests/sec for a mix of reads and creates """
+    body = {"customer_id": 1, "items": [
+        {"shopcart_id": 0, "item_name": "hat", "sku": "H1", "quantity": 1, "price": 9.99}
+    ]}
+    shopcart = client.post("/shopcarts", json=body).get_json()
+    with timer() as elapsed:
+        for count in range(REQUESTS):
+            if count % 10:
+                client.get("/shopcarts/{}".format(shopcart["id"]))
+            else:
+                client.post("/shopcarts", json=body)
+    return REQUESTS / elapsed[0]
+
+
+def main():
+    config = dict(app.config)
+    client = app.test_client()
+    print("%-8s %10s %12s" % ("setup", "req/s", "log lines"))
+    rates = {name: [] for name, _ in SETUPS}
+    lines = {}
+    # the setups take turns so drift in the machine hits them all alike
+    for _ in range(ROUNDS):
+        for name, settings in SETUPS:
+            reset_db()
+            with tempfile.NamedTemporaryFile("r", suffix=".log") as log_file:
+                app.config.update(settings, LOG_LEVEL="INFO")
+                init_logging(app, [SlowFileHandler(log_file.name)])
+                rates[name].append(run(client))
+                stop_logging()
+                lines[name] = sum(1 for _ in log_file)
+    for name, _ in SETUPS:
+        print("%-8s %10.1f %12d" % (name, statistics.median(rates[name]), lines[name]))
+    app.config.update(config)
+    init_logging(app)
+    reset_db()
+
+
+if __name__ == "__main__":
+    main()
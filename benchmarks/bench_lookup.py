@@ -0,0 +1,58 @@
+"""
+Indexed lookup benchmark
+
+Seeds CARTS carts with one item each (1,000,000 by default) and times the
+lookups behind GET /shopcarts?customer_id=, ?sku= and ?item_name=:
+  CARTS=1000000 python -m benchmarks.bench_lookup
+"""
+import os
+import random
+import statistics
+from service import app
+from service.models import db, ShopCart
+from benchmarks import timer, db_timer, reset_db, seed
+
+CARTS = int(os.getenv("CARTS", "1000000"))
+LOOKUPS = int(os.getenv("LOOKUPS", "1000"))
+
+
+def time_lookups(name, finder, values):
+    """ Times each lookup and prints the distribution in milliseconds """
+    times = []
+    db_times = []
+    for value in values:
+        with timer() as elapsed, db_timer() as db_elapsed:
+            finder(value, ShopCart.read_query("lazy")).all()
+        times.append(elapsed[0] * 1000)
+        db_times.append(db_elapsed[0] * 1000)
+        db.session.remove()
+    times.sort()
+    db_times.sort()
+    print("%-12s %10.3f %10.3f %10.3f %10.3f %10.3f" % (
+        name,
+        statistics.mean(times),
+        times[len(times) // 2],
+        times[int(len(times) * 0.99)],
+        db_times[len(db_times) // 2],
+        db_times[int(len(db_times) * 0.99)],
+    ))
+
+
+def main():
+    reset_db()
+    with timer() as elapsed:
+        seed(CARTS, items_per_cart=1)
+    print("seeded %d carts in %.1fs" % (CARTS, elapsed[0]))
+    cart_ids = [random.randint(1, CARTS) for _ in range(LOOKUPS)]
+    print("%-12s %10s %10s %10s %10s %10s" % (
+        "lookup", "mean ms", "p50 ms", "p99 ms", "sql p50", "sql p99"
+    ))
+    # seed() makes customer_id = id - 1, sku = "<id>-0" and item_name = "item 0"
+    time_lookups("customer_id", ShopCart.find_by_customer, [i - 1 for i in cart_ids])
+    time_lookups("sku", ShopCart.find_by_sku, ["%d-0" % i for i in cart_ids])
+    time_lookups("item_name", ShopCart.find_by_item_name, ["missing"] * LOOKUPS)
+    reset_db()
+
+
+if __name__ == "__main__":
+    main()
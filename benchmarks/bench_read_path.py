@@ -0,0 +1,62 @@
+"""
+Read path benchmark
+
+Seeds one cart with ITEMS items (100,000 by default) and reads them all
+through the ORM (instances in the identity map), ORM column tuples and
+Core rows, then serializes them. Prints rows/sec and the peak memory the
+read allocated, as traced by tracemalloc:
+  ITEMS=100000 python -m benchmarks.bench_read_path
+"""
+import os
+import statistics
+import tracemalloc
+from service import app
+from service.models import db, CartItem
+from benchmarks import timer, reset_db, seed
+
+ITEMS = int(os.getenv("ITEMS", "100000"))
+ROUNDS = int(os.getenv("ROUNDS", "5"))
+
+
+def read_orm(shopcart_id):
+    """ Loads ORM instances and serializes each one """
+    return [item.serialize() for item in CartItem.find_by_shopcart(shopcart_id)]
+
+
+def read_tuples(shopcart_id):
+    """ Loads column tuples through the ORM Query """
+    return CartItem.serialize_rows(CartItem.row_query(CartItem.find_by_shopcart(shopcart_id)))
+
+
+def read_core(shopcart_id):
+    """ Reads Core rows straight from the cursor """
+    return CartItem.serialize_rows(CartItem.read_rows(CartItem.find_by_shopcart(shopcart_id)))
+
+
+def run(read, shopcart_id):
+    """ Returns the median rows/sec and peak MB of reading every item """
+    rates = []
+    peaks = []
+    for _ in range(ROUNDS):
+        db.session.remove()
+        tracemalloc.start()
+        with timer() as elapsed:
+            items = read(shopcart_id)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+        tracemalloc.stop()
+        rates.append(len(items) / elapsed[0])
+    return statistics.median(rates), statistics.median(peaks)
+
+
+def main():
+    reset_db()
+    shopcart_id = seed(1, items_per_cart=ITEMS)[0]
+    print("%-8s %12s %12s" % ("path", "rows/sec", "peak MB"))
+    for path, read in [("orm", read_orm), ("tuples", read_tuples), ("core", read_core)]:
+        rate, peak = run(read, shopcart_id)
+        print("%-8s %12.0f %12.1f" % (path, rate, peak))
+    reset_db()
+
+
+if __name__ == "__main__":
+    main()
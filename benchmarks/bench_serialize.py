@@ -0,0 +1,61 @@
+"""
+Serialization benchmark
+
+Seeds one cart with ITEMS items (10,000 by default) and times reading,
+serializing and encoding them as JSON, through ORM objects and through
+plain column tuples, with each JSON encoder. Times are per 1,000 items:
+  ITEMS=10000 python -m benchmarks.bench_serialize
+"""
+import os
+import statistics
+from flask import json
+from service import app
+from service.models import db, CartItem
+from service.encoders import JSONEncoder, OrjsonEncoder
+from benchmarks import timer, reset_db, seed
+
+ITEMS = int(os.getenv("ITEMS", "10000"))
+ROUNDS = int(os.getenv("ROUNDS", "20"))
+
+
+def read_objects(shopcart_id):
+    """ Loads the items as ORM objects and serializes each one """
+    return [item.serialize() for item in CartItem.find_by_shopcart(shopcart_id)]
+
+
+def read_rows(shopcart_id):
+    """ Reads the items as column tuples and serializes them directly """
+    return CartItem.serialize_rows(CartItem.row_query(CartItem.find_by_shopcart(shopcart_id)))
+
+
+def run(read, shopcart_id):
+    """ Returns the median read+serialize and encode times in ms per 1k items """
+    read_times = []
+    encode_times = []
+    for _ in range(ROUNDS):
+        db.session.remove()
+        with timer() as read_elapsed:
+            items = read(shopcart_id)
+        with timer() as encode_elapsed:
+            json.dumps(items)
+        read_times.append(read_elapsed[0] * 1000 * 1000 / ITEMS)
+        encode_times.append(encode_elapsed[0] * 1000 * 1000 / ITEMS)
+    return statistics.median(read_times), statistics.median(encode_times)
+
+
+def main():
+    reset_db()
+    shopcart_id = seed(1, items_per_cart=ITEMS)[0]
+    print("%-10s %-8s %12s %12s %12s" % ("path", "encoder", "read ms", "encode ms", "total ms"))
+    for path, read in [("objects", read_objects), ("rows", read_rows)]:
+        for encoder in [JSONEncoder, OrjsonEncoder]:
+            app.json_encoder = encoder
+            read_ms, encode_ms = run(read, shopcart_id)
+            print("%-10s %-8s %12.3f %12.3f %12.3f" % (
+                path, encoder.name, read_ms, encode_ms, read_ms + encode_ms
+            ))
+    reset_db()
+
+
+if __name__ == "__main__":
+    main()
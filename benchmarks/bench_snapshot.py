@@ -0,0 +1,51 @@
+"""
+Snapshot benchmark
+
+Seeds CARTS carts with ITEMS items each, then exports every row as NDJSON
+and as CSV, loads each file back into empty tables, and reports rows/sec
+for every step at SNAPSHOT_BATCH_SIZE rows per batch:
+  CARTS=100000 ITEMS=5 python -m benchmarks.bench_snapshot
+"""
+import os
+import tempfile
+from service.models import db
+from service.snapshot import snapshot, TABLES
+from benchmarks import timer, reset_db, seed
+
+CARTS = int(os.getenv("CARTS", "20000"))
+ITEMS = int(os.getenv("ITEMS", "5"))
+
+
+def report(step, counts, seconds):
+    rows = sum(counts.values())
+    print("%-22s %10d %10.2f %12.0f" % (step, rows, seconds, rows / seconds if seconds else 0))
+
+
+def files(fmt, directory):
+    """ Returns the (table, path) pairs of a snapshot, one file per table for CSV """
+    if fmt == "ndjson":
+        return [(None, os.path.join(directory, "carts.ndjson"))]
+    return [(table.name, os.path.join(directory, table.name + ".csv")) for table in TABLES]
+
+
+def main():
+    print("%-22s %10s %10s %12s" % ("step", "rows", "seconds", "rows/s"))
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in ["ndjson", "csv"]:
+            reset_db()
+            seed(CARTS, items_per_cart=ITEMS)
+            for table, path in files(fmt, directory):
+                with open(path, "w") as out, timer() as elapsed:
+                    counts = snapshot.export(out, fmt, table)
+                    db.session.commit()
+                report("export %s %s" % (fmt, table or "all"), counts, elapsed[0])
+            reset_db()
+            for table, path in files(fmt, directory):
+                with open(path, "rb") as source, timer() as elapsed:
+                    counts = snapshot.load(source, fmt, table)
+                report("import %s %s" % (fmt, table or "all"), counts, elapsed[0])
+    reset_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Wire format benchmark
+
+Seeds CARTS carts with ITEMS items each (100 by default) and compares JSON,
+with each encoder, to MessagePack: the payload size of a cart, raw and
+gzipped, the median time to encode and decode it, and the median latency
+of GET /shopcarts/<id> through the test client with each Accept header:
+  ITEMS=100 python -m benchmarks.bench_wire_format
+"""
+import os
+import gzip
+import json as stdlib_json
+import statistics
+from flask import json
+from service import app
+from service.models import ShopCart
+from service.encoders import JSONEncoder, OrjsonEncoder, MSGPACK, orjson, msgpack
+from service.encoders import pack_msgpack, unpack_msgpack
+from benchmarks import timer, reset_db, seed
+
+CARTS = int(os.getenv("CARTS", "20"))
+ITEMS = int(os.getenv("ITEMS", "100"))
+ROUNDS = int(os.getenv("ROUNDS", "200"))
+
+
+def json_codec(encoder, loads):
+    """ Returns (encode, decode) functions for JSON with an encoder class """
+    def encode(document):
+        return json.dumps(document, cls=encoder).encode("utf-8")
+    return encode, loads
+
+
+def codecs():
+    """ Returns the installed formats as name -> (encode, decode, Accept) """
+    formats = {"json-stdlib": json_codec(JSONEncoder, stdlib_json.loads) + ("application/json",)}
+    if orjson is not None:
+        formats["json-orjson"] = json_codec(OrjsonEncoder, orjson.loads) + ("application/json",)
+    if msgpack is not None:
+        formats["msgpack"] = (pack_msgpack, unpack_msgpack, MSGPACK)
+    return formats
+
+
+def median_ms(function, documents):
+    """ Returns the median time in ms of calling function on every document """
+    times = []
+    for _ in range(ROUNDS):
+        with timer() as elapsed:
+            for document in documents:
+                function(document)
+        times.append(elapsed[0] * 1000 / len(documents))
+    return statistics.median(times)
+
+
+def get_ms(client, shopcart_ids, accept):
+    """ Returns the median latency in ms of reading the carts over the API """
+    times = []
+    for _ in range(max(ROUNDS // 10, 1)):
+        with timer() as elapsed:
+            for shopcart_id in shopcart_ids:
+                client.get("/shopcarts/%d" % shopcart_id, headers={"Accept": accept})
+        times.append(elapsed[0] * 1000 / len(shopcart_ids))
+    return statistics.median(times)
+
+
+def main():
+    reset_db()
+    shopcart_ids = seed(CARTS, items_per_cart=ITEMS)
+    documents = [ShopCart.find(shopcart_id).serialize() for shopcart_id in shopcart_ids]
+    client = app.test_client()
+    print("%d carts x %d items, per cart:" % (CARTS, ITEMS))
+    print("%-12s %10s %10s %12s %12s %10s" % (
+        "format", "bytes", "gzip", "encode ms", "decode ms", "GET ms"
+    ))
+    for name, (encode, decode, accept) in codecs().items():
+        payloads = [encode(document) for document in documents]
+        size = statistics.mean(len(payload) for payload in payloads)
+        gzipped = statistics.mean(len(gzip.compress(payload)) for payload in payloads)
+        app.json_encoder = OrjsonEncoder if name == "json-orjson" else JSONEncoder
+        print("%-12s %10.0f %10.0f %12.4f %12.4f %10.3f" % (
+            name, size, gzipped, median_ms(encode, documents), median_ms(decode, payloads),
+            get_ms(client, shopcart_ids, accept)
+        ))
+    reset_db()
+
+
+if __name__ == "__main__":
+    main()
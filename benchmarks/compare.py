@@ -0,0 +1,33 @@
+"""
+Compares two runs saved by benchmarks.api_suite
+
+Prints requests/sec and p95 latency of every endpoint in both runs with
+the change between them. It is run as a plain script, so it needs neither
+the service nor a database:
+  python benchmarks/compare.py benchmarks/results/abc1234-inprocess-sqlite.json \
+      benchmarks/results/def5678-inprocess-sqlite.json
+"""
+import sys
+import json
+
+
+def compare(before_path, after_path):
+    """ Prints the change of every endpoint between two saved runs """
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print("%s -> %s (%s, %s)" % (before["commit"], after["commit"], after["driver"], after["database"]))
+    print("%-14s %10s %10s %8s %10s %10s %8s" % (
+        "endpoint", "req/s", "req/s", "change", "p95 ms", "p95 ms", "change"
+    ))
+    for name, new in after["endpoints"].items():
+        old = before["endpoints"].get(name)
+        if old is None:
+            continue
+        print("%-14s %10.1f %10.1f %+7.1f%% %10.2f %10.2f %+7.1f%%" % (
+            name, old["rps"], new["rps"], (new["rps"] / old["rps"] - 1) * 100,
+            old["p95_ms"], new["p95_ms"], (new["p95_ms"] / old["p95_ms"] - 1) * 100,
+        ))
+
+
+if __name__ == "__main__":
+    compare(*sys.argv[1:3])
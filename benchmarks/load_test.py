@@ -0,0 +1,132 @@
+"""
+Load test of the gunicorn worker profiles
+
+Starts gunicorn once per worker class, seeds a few carts, drives GET
+requests at it from CONCURRENCY client threads for DURATION seconds and
+prints requests/sec with p50/p99 latency for each profile:
+  python -m benchmarks.load_test sync gthread gevent
+
+Point DATABASE_URI at Postgres to see the effect of blocking DB calls.
+"""
+import os
+import sys
+import time
+import json
+import threading
+import subprocess
+import urllib.request
+from urllib.error import URLError
+
+PORT = int(os.getenv("LOAD_TEST_PORT", "5055"))
+CONCURRENCY = int(os.getenv("CONCURRENCY", "32"))
+DURATION = float(os.getenv("DURATION", "10"))
+CARTS = int(os.getenv("CARTS", "50"))
+ITEMS = int(os.getenv("ITEMS", "10"))
+
+
+def percentile(times, fraction):
+    """ Returns a percentile of a sorted list """
+    return times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def request(url, data=None):
+    """ Sends a request and returns the decoded JSON body """
+    headers = {"Content-Type": "application/json"} if data is not None else {}
+    body = json.dumps(data).encode("utf-8") if data is not None else None
+    req = urllib.request.Request(url, data=body, headers=headers)
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read() or "null")
+
+
+def seed(base_url):
+    """ Creates the carts to read back through the API """
+    carts = []
+    for n in range(CARTS):
+        items = [
+            {"shopcart_id": 0, "item_name": "item %d" % i, "sku": "%d-%d" % (n, i),
+             "quantity": 1, "price": 9.99}
+            for i in range(ITEMS)
+        ]
+        carts.append({"customer_id": n, "items": items})
+    return [cart["id"] for cart in request(base_url + "/shopcarts:batch", carts)]
+
+
+def run_load(urls, concurrency=CONCURRENCY, duration=DURATION):
+    """ Requests the urls round robin from many threads and collects latencies """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        mine = []
+        count = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urls[count % len(urls)], timeout=30) as resp:
+                    resp.read()
+                mine.append(time.perf_counter() - start)
+            except (URLError, OSError):
+                with lock:
+                    errors[0] += 1
+            count += 1
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+
+def start_server(worker_class):
+    """ Starts gunicorn with a worker profile and waits until it answers """
+    env = dict(os.environ, PORT=str(PORT), GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_LOG_LEVEL="warning")
+    server = subprocess.Popen(
+        ["gunicorn", "--config", "gunicorn.conf.py", "service:app"],
+        env=env,
+    )
+    base_url = "http://127.0.0.1:%d" % PORT
+    for _ in range(100):
+        try:
+            request(base_url + "/shopcarts?limit=1")
+            return server, base_url
+        except (URLError, OSError):
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start with %s workers" % worker_class)
+
+
+def main(worker_classes):
+    results = {}
+    print("%-10s %10s %10s %10s %10s" % ("workers", "req/s", "p50 ms", "p99 ms", "errors"))
+    for worker_class in worker_classes:
+        server, base_url = start_server(worker_class)
+        try:
+            request(base_url + "/shopcarts/clear")
+            cart_ids = seed(base_url)
+            urls = [base_url + "/shopcarts/%d" % cart_id for cart_id in cart_ids]
+            result = run_load(urls)
+        finally:
+            server.terminate()
+            server.wait()
+        results[worker_class] = result
+        print("%-10s %10.1f %10.2f %10.2f %10d" % (
+            worker_class, result["rps"], result["p50_ms"], result["p99_ms"], result["errors"]
+        ))
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["sync", "gthread", "gevent"])
@@ -12,5 +12,70 @@ if 'VCAP_SERVICES' in os.environ:
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Connection pool of each gunicorn worker, only used with Postgres. The
+# defaults suit a small ElephantSQL plan where every worker of every
+# instance shares a handful of connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "2"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "0"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Milliseconds before Postgres cancels a statement, 0 to disable
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "5000"))
+# Set when PgBouncer (or another external pooler) sits in front of Postgres:
+# connections are not pooled here and no session state is set on them
+DB_EXTERNAL_POOLER = os.getenv("DB_EXTERNAL_POOLER", "false").lower() == "true"
+# How ShopCart.items are loaded on reads: selectin, joined or lazy
+SHOPCART_ITEMS_LOADING = os.getenv("SHOPCART_ITEMS_LOADING", "selectin")
+# Rows fetched per round trip when streaming a listing from a server-side cursor
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+# Largest array accepted by the :batch create endpoints
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+# How POST /shopcarts/<id>/merge combines the quantities of a SKU in both
+# carts when the request has no ?policy=: sum, max, target or source
+MERGE_QUANTITY_POLICY = os.getenv("MERGE_QUANTITY_POLICY", "sum")
+# Carts unchanged for CART_TTL_HOURS are deleted by `flask reap-carts`, or by a
+# thread in every worker each REAPER_INTERVAL seconds (0 leaves that off), in
+# batches of REAPER_BATCH_SIZE carts with REAPER_PAUSE seconds between them
+CART_TTL_HOURS = float(os.getenv("CART_TTL_HOURS", "168"))
+REAPER_INTERVAL = int(os.getenv("REAPER_INTERVAL", "0"))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "500"))
+REAPER_PAUSE = float(os.getenv("REAPER_PAUSE", "0.05"))
+# Rows read or written per batch by `flask export-carts`/`import-carts` and
+# /admin/snapshot, which bounds the memory they use
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "5000"))
+# Cache of serialized ShopCarts: none, memory or redis
+# (memory is per process, so use redis when running several workers)
+CART_CACHE = os.getenv("CART_CACHE", "none")
+CART_CACHE_SIZE = int(os.getenv("CART_CACHE_SIZE", "1024"))
+CART_CACHE_TTL = int(os.getenv("CART_CACHE_TTL", "30"))
+CART_CACHE_REDIS_URL = os.getenv("CART_CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Responses of COMPRESS_MIN_SIZE bytes or more are compressed with brotli (when
+# installed) or gzip, as the client's Accept-Encoding allows
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+# JSON encoder of every response: auto (orjson when installed), orjson or stdlib
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto")
+# Requests slower than this are logged with their SQL statements, 0 turns it off
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "500"))
+# Directory where each worker process writes its request metrics for /metrics to
+# add up, gunicorn.conf.py makes one when it is not set
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+# Per-request profiling, for requests sending PROFILE_HEADER or a sampled share of
+# them, with the last PROFILE_BUFFER_SIZE profiles served from /admin/profiles
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "20"))
+# Logging, see service/logs.py. The per-record model logs are DEBUG noise at
+# production request rates, so service.models starts at WARNING
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "service.models=WARNING")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() == "true"
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
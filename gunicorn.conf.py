@@ -0,0 +1,85 @@
+"""
+Gunicorn settings for the ShopCarts service
+
+Worker profiles, chosen with GUNICORN_WORKER_CLASS:
+  sync    - one request at a time per worker (the default)
+  gthread - GUNICORN_THREADS requests at a time per worker
+  gevent  - GUNICORN_WORKER_CONNECTIONS requests at a time per worker, with
+            psycopg2 made cooperative by psycogreen so a DB call yields
+
+Unless DB_POOL_SIZE is set, each worker pools one database connection per
+request it serves at once, up to its share of DB_CONNECTION_LIMIT. At
+startup gunicorn logs how many connections all workers may open, and warns
+when that is over the limit or a pool is smaller than the concurrency.
+
+Every worker writes its request metrics to METRICS_MULTIPROC_DIR, which is
+emptied when gunicorn starts, so /metrics covers all of them.
+"""
+import os
+import glob
+import tempfile
+
+bind = "0.0.0.0:" + os.getenv("PORT", "5000")
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+# gunicorn turns sync workers into gthread ones when threads > 1
+threads = int(os.getenv("GUNICORN_THREADS", "8")) if worker_class == "gthread" else 1
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+# requests a worker serves at once, each of them may hold a DB connection
+concurrency = {"gthread": threads, "gevent": worker_connections}.get(worker_class, 1)
+# connections all the workers of this instance may hold together, the
+# default fits the small ElephantSQL plan config.py sizes the pools for
+connection_limit = int(os.getenv("DB_CONNECTION_LIMIT", "5"))
+if "DB_POOL_SIZE" not in os.environ and concurrency > 2:
+    # a connection per concurrent request, up to the worker's share of the
+    # limit; read by config.py in every worker, which imports the app after the fork
+    os.environ["DB_POOL_SIZE"] = str(max(1, min(concurrency, connection_limit // workers)))
+
+
+def on_starting(server):
+    """ Gives the workers an empty directory to share their metrics through """
+    directory = os.getenv("METRICS_MULTIPROC_DIR")
+    if not directory:
+        directory = tempfile.mkdtemp(prefix="shopcarts-metrics-")
+        os.environ["METRICS_MULTIPROC_DIR"] = directory
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "requests-*.json")):
+        os.remove(path)
+    server.log.info("Sharing worker metrics through %s", directory)
+    pool = int(os.getenv("DB_POOL_SIZE", "2")) + int(os.getenv("DB_MAX_OVERFLOW", "0"))
+    external = os.getenv("DB_EXTERNAL_POOLER", "false").lower() == "true"
+    if external:
+        return
+    server.log.info(
+        "%d workers x %d pooled connections = %d database connections at most",
+        workers, pool, workers * pool
+    )
+    if workers * pool > connection_limit:
+        server.log.warning(
+            "The workers may open %d database connections but DB_CONNECTION_LIMIT is %d; "
+            "lower DB_POOL_SIZE, DB_MAX_OVERFLOW or WEB_CONCURRENCY",
+            workers * pool, connection_limit
+        )
+    if concurrency > pool:
+        server.log.warning(
+            "%s workers serve %d requests at a time but pool %d database connections, "
+            "the rest wait up to DB_POOL_TIMEOUT seconds for one; raise DB_CONNECTION_LIMIT "
+            "with a bigger plan, or set DB_EXTERNAL_POOLER behind PgBouncer",
+            worker_class, concurrency, pool
+        )
+
+
+def post_fork(server, worker):
+    """ Makes psycopg2 wait on gevent instead of blocking the whole worker """
+    if worker_class != "gevent":
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+        server.log.info("psycopg2 patched for gevent in worker %s", worker.pid)
+    except ImportError as error:
+        # only Postgres needs a cooperative driver
+        server.log.warning("psycopg2 not patched for gevent: %s", error)
@@ -6,7 +6,6 @@ and SQL database
 """
 import os
 import sys
-import logging
 from flask import Flask
 
 # Create Flask application
@@ -15,17 +14,15 @@ app.config.from_object('config')
 
 # Import the rutes After the Flask app is created
 from service import service, models
+from service.profiling import profiler
+from service.reaper import reaper
+from service.snapshot import snapshot
+from service.logs import init_logging
 
 # Set up logging for production
 if __name__ != '__main__':
-    gunicorn_logger = logging.getLogger('gunicorn.error')
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
-    app.logger.propagate = False
-    # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
-        handler.setFormatter(formatter)
+    # queue-backed, through gunicorn's handlers when running under it
+    init_logging(app)
     app.logger.info('Logging handler established')
 
 app.logger.info(70 * "*")
@@ -39,4 +36,11 @@ except Exception as error:
     # gunicorn requires exit code 4 to stop spawning workers when they die
     sys.exit(4)
 
+# Profile the requests asked for, when PROFILING_ENABLED is set
+profiler.init_app(app)
+# Delete abandoned carts, from `flask reap-carts` or every REAPER_INTERVAL seconds
+reaper.init_app(app)
+# Export and import every cart with `flask export-carts` and `flask import-carts`
+snapshot.init_app(app)
+
 app.logger.info("Service inititalized!")
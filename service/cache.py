@@ -0,0 +1,168 @@
+"""
+Cache of serialized ShopCarts
+
+Backends
+--------
+NullCache - caches nothing
+LRUCache - in-process least recently used cache with a time to live
+RedisCache - shared cache on any client that speaks the Redis protocol
+
+Every backend keeps hit, miss and eviction counters for stats().
+Cached values must be treated as read-only by callers.
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class NullCache():
+    """ A cache that never stores anything """
+
+    name = "none"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ Returns the cached value for key or None """
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """ Stores value under key """
+
+    def delete(self, *keys):
+        """ Removes the keys from the cache """
+
+    def clear(self):
+        """ Removes everything from the cache """
+
+    def stats(self):
+        """ Returns the cache counters as a dictionary """
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class LRUCache(NullCache):
+    """ In-process cache that evicts the least recently used entries """
+
+    name = "memory"
+
+    def __init__(self, size=1024, ttl=30, clock=time.monotonic):
+        super().__init__()
+        self.size = size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self._clock():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        stats = super().stats()
+        stats["entries"] = len(self._entries)
+        return stats
+
+
+class RedisCache(NullCache):
+    """
+    Cache stored in Redis (or anything that speaks its protocol)
+
+    Entries expire after ttl seconds. Redis does its own evictions, so the
+    evictions counter stays at zero for this backend.
+    """
+
+    name = "redis"
+
+    def __init__(self, client, ttl=30, prefix="shopcarts:cart:"):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + str(key))
+        except Exception as error:  # the cache must never break a read
+            logger.warning("Cart cache get failed: %s", error)
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + str(key), json.dumps(value), ex=self.ttl)
+        except Exception as error:
+            logger.warning("Cart cache set failed: %s", error)
+
+    def delete(self, *keys):
+        if not keys:
+            return
+        try:
+            self.client.delete(*[self.prefix + str(key) for key in keys])
+        except Exception as error:
+            logger.error("Cart cache delete failed, entries expire in %ss: %s", self.ttl, error)
+
+    def clear(self):
+        try:
+            keys = list(self.client.scan_iter(match=self.prefix + "*"))
+            if keys:
+                self.client.delete(*keys)
+        except Exception as error:
+            logger.error("Cart cache clear failed, entries expire in %ss: %s", self.ttl, error)
+
+
+def make_cache(config):
+    """ Creates the cache backend chosen by the CART_CACHE setting """
+    backend = config.get("CART_CACHE", "none")
+    ttl = config.get("CART_CACHE_TTL", 30)
+    if backend == "memory":
+        return LRUCache(size=config.get("CART_CACHE_SIZE", 1024), ttl=ttl)
+    if backend == "redis":
+        import redis  # optional dependency, only needed for this backend
+        client = redis.Redis.from_url(config["CART_CACHE_REDIS_URL"])
+        return RedisCache(client, ttl=ttl)
+    if backend == "none":
+        return NullCache()
+    raise ValueError("Unknown cart cache backend: %s" % backend)
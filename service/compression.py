@@ -0,0 +1,88 @@
+"""
+Response compression for the ShopCarts service
+
+Responses of at least COMPRESS_MIN_SIZE bytes are compressed with brotli
+or gzip, whichever the client's Accept-Encoding prefers, brotli winning a
+tie. Brotli is optional, without it only gzip is offered.
+
+A compressed body is a different representation, so its strong ETag gets
+the encoding appended ("3-7-gzip"). strip_encoding() takes it off again
+for the If-Match and If-None-Match checks.
+
+Streamed responses are sent as they are.
+"""
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency, gzip only without it
+    brotli = None
+
+# the codings this service writes, best first
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def strip_encoding(etag):
+    """ Returns an entity tag without the content coding compress() added """
+    for encoding in ("br", "gzip"):
+        if etag.endswith("-" + encoding):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+
+class Compressor():
+    """ Compresses the responses of a Flask app as configured """
+
+    def __init__(self):
+        self.enabled = True
+        self.min_size = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 4
+
+    def init_app(self, app):
+        """ Compresses the responses of a Flask app, see COMPRESS_* """
+        self.enabled = app.config.get("COMPRESS_ENABLED", True)
+        self.min_size = app.config.get("COMPRESS_MIN_SIZE", 1024)
+        self.gzip_level = app.config.get("COMPRESS_GZIP_LEVEL", 6)
+        self.brotli_quality = app.config.get("COMPRESS_BROTLI_QUALITY", 4)
+        if not getattr(app, "_compressor", False):
+            app._compressor = True
+            app.after_request(self.after_request)
+
+    def choose(self):
+        """ Returns the coding the request accepts most, or None """
+        best, best_quality = None, 0
+        for encoding in ENCODINGS:
+            quality = request.accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level)
+
+    def after_request(self, response):
+        if not self.enabled or response.direct_passthrough or response.is_streamed:
+            return response
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        if "Content-Encoding" in response.headers:
+            return response
+        response.vary.add("Accept-Encoding")
+        if response.content_length is None or response.content_length < self.min_size:
+            return response
+        encoding = self.choose()
+        if encoding is None:
+            return response
+        response.set_data(self.compress(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag("{}-{}".format(etag, encoding))
+        return response
+
+
+compressor = Compressor()
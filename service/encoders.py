@@ -0,0 +1,96 @@
+"""
+Encoders for the ShopCarts service
+
+Encoders
+--------
+JSONEncoder - Flask's standard library encoder that also takes Decimals
+OrjsonEncoder - the same encoder with the C-backed orjson doing the work
+pack_msgpack / unpack_msgpack - the MessagePack wire format (MSGPACK)
+
+Flask's jsonify() and json.dumps() call encode() on app.json_encoder, so
+setting it swaps the encoder of every response. make_json_encoder() picks
+one with the JSON_ENCODER setting.
+
+MessagePack is offered to clients that ask for it only when msgpack is
+installed, see the MSGPACK_TYPES tuple.
+"""
+from datetime import date
+from decimal import Decimal
+from flask.json import JSONEncoder as FlaskJSONEncoder
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # optional dependency, fall back to the standard library
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional dependency, JSON only without it
+    msgpack = None
+
+MSGPACK = "application/msgpack"
+# the MessagePack media types this service reads and writes, none without msgpack
+MSGPACK_TYPES = (MSGPACK,) if msgpack is not None else ()
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """ Flask's encoder, extended to write Decimals as numbers """
+
+    name = "stdlib"
+
+    def default(self, o):  # pylint: disable=method-hidden
+        if isinstance(o, Decimal):
+            return float(o)
+        return super().default(o)
+
+
+class OrjsonEncoder(JSONEncoder):
+    """ Encodes with orjson, using the stdlib default() for types it lacks """
+
+    name = "orjson"
+
+    def encode(self, o):
+        # dates go through default() to keep Flask's HTTP date format
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(o, default=self.default, option=option).decode("utf-8")
+
+
+def make_json_encoder(config):
+    """ Returns the encoder class chosen by the JSON_ENCODER setting
+
+    "auto" uses orjson when it is installed and the standard library otherwise
+    """
+    name = config.get("JSON_ENCODER", "auto")
+    if name == "auto":
+        return OrjsonEncoder if orjson is not None else JSONEncoder
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("JSON_ENCODER is orjson but orjson is not installed")
+        return OrjsonEncoder
+    if name == "stdlib":
+        return JSONEncoder
+    raise ValueError("Unknown JSON encoder: %s" % name)
+
+
+def _msgpack_default(o):
+    """ Converts the types MessagePack lacks the way the JSON encoders do """
+    if isinstance(o, Decimal):
+        return float(o)
+    if isinstance(o, date):
+        return http_date(o.timetuple())
+    raise TypeError("Object of type %s is not MessagePack serializable" % type(o).__name__)
+
+
+def pack_msgpack(o):
+    """ Encodes a document as MessagePack bytes """
+    return msgpack.packb(o, default=_msgpack_default)
+
+
+def unpack_msgpack(data):
+    """ Decodes MessagePack bytes, every msgpack error on bad input is a ValueError """
+    return msgpack.unpackb(data)
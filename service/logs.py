@@ -0,0 +1,141 @@
+"""
+Logging for the ShopCarts service
+
+Records from the Flask app logger and the service.* module loggers go
+through a queue to a listener thread, which does the formatting and the
+writes. A request only pays for putting a record on the queue.
+
+Settings
+--------
+LOG_LEVEL - level of every logger, gunicorn's level when running under it
+LOG_LEVELS - per logger levels, e.g. "service.models=WARNING,flask.app=INFO"
+LOG_FORMAT - text or json (one object per line)
+LOG_QUEUE - set to false to write from the request thread
+LOG_PAYLOAD_SAMPLE_RATE - share of request bodies logged by log_payload()
+"""
+import json
+import atexit
+import random
+import logging
+from queue import Queue
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+# the loggers that get the service handlers
+LOGGERS = ("flask.app", "service")
+
+_listener = None
+_payload_sample_rate = 0.0
+_module_levels = {}
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats a record as one JSON object per line """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Puts records on a queue with their message merged, but leaves the
+    formatting to the handlers of the listener thread
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def parse_levels(text):
+    """ Parses "name=LEVEL,name=LEVEL" into a dictionary """
+    levels = {}
+    for entry in filter(None, (part.strip() for part in text.split(","))):
+        name, _, level = entry.partition("=")
+        if not level:
+            raise ValueError("Invalid LOG_LEVELS entry: %s" % entry)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def init_logging(app, handlers=None):
+    """ Sets up the service loggers from the app configuration
+
+    Args:
+        app (Flask): the app with the LOG_* settings
+        handlers (list): where the records end up, defaults to gunicorn's
+            error log handlers or stderr
+    """
+    global _listener, _payload_sample_rate, _module_levels
+    config = app.config
+    gunicorn_logger = logging.getLogger("gunicorn.error")
+    level = config.get("LOG_LEVEL", "INFO")
+    if handlers is None:
+        handlers = list(gunicorn_logger.handlers)
+        if handlers:
+            level = gunicorn_logger.level
+        else:
+            handlers = [logging.StreamHandler()]
+    if config.get("LOG_FORMAT", "text") == "json":
+        formatter = JsonFormatter(datefmt=DATE_FORMAT)
+    else:
+        # Make all log formats consistent
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if config.get("LOG_QUEUE", True):
+        queue = Queue(-1)
+        _listener = QueueListener(queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        handlers = [AsyncHandler(queue)]
+
+    for name in LOGGERS:
+        logger = logging.getLogger(name)
+        logger.handlers = list(handlers)
+        logger.setLevel(level)
+        logger.propagate = False
+    for name in _module_levels:
+        logging.getLogger(name).setLevel(logging.NOTSET)
+    _module_levels = parse_levels(config.get("LOG_LEVELS", ""))
+    for name, module_level in _module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+    _payload_sample_rate = config.get("LOG_PAYLOAD_SAMPLE_RATE", 0.0)
+
+
+def stop_logging():
+    """ Writes out the queued records and stops the listener thread """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_payload(logger, message, payload):
+    """ Logs a request body for a sampled share of the requests only """
+    if _payload_sample_rate <= 0 or not logger.isEnabledFor(logging.INFO):
+        return
+    if random.random() < _payload_sample_rate:
+        # a MessagePack body may hold bytes or non-string keys, logging must never fail
+        try:
+            text = json.dumps(payload, default=repr)
+        except (TypeError, ValueError):
+            text = repr(payload)
+        logger.info("%s: %s", message, text)
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,358 @@
+"""
+Metrics for the ShopCarts service
+
+PoolMetrics - database connection pool activity from SQLAlchemy pool events
+RequestMetrics - latency, DB queries and DB time of every request, from
+                 Flask request hooks and SQLAlchemy engine events
+
+Both render in the Prometheus text exposition format for /metrics. With
+METRICS_MULTIPROC_DIR set, every worker process writes its request
+metrics to a file there and /metrics adds up the files of all workers.
+"""
+import os
+import glob
+import json
+import time
+import uuid
+import logging
+import threading
+import weakref
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class PoolMetrics():
+    """ Counts what the connection pools of the watched engines are doing """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines = weakref.WeakSet()
+        self._engine = lambda: None
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def watch(self, engine):
+        """
+        Starts counting the pool events of an engine, once per engine
+        The gauges are read from the engine watched last
+        """
+        self._engine = weakref.ref(engine)
+        if engine in self._engines:
+            return
+        self._engines.add(engine)
+        event.listen(engine, "connect", self.on_connect)
+        event.listen(engine, "checkout", self.on_checkout)
+        event.listen(engine, "checkin", self.on_checkin)
+        event.listen(engine, "invalidate", self.on_invalidate)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_wait(self, seconds):
+        """ Records how long a checkout waited for a free connection """
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def render(self):
+        """ Returns the pool metrics in the Prometheus text format """
+        lines = []
+        counters = [
+            ("connects", self.connects, "New database connections opened"),
+            ("checkouts", self.checkouts, "Connections checked out of the pool"),
+            ("checkins", self.checkins, "Connections returned to the pool"),
+            ("invalidations", self.invalidations, "Connections discarded as broken or stale"),
+            ("waits", self.waits, "Checkouts that waited for a connection to be returned"),
+            ("wait_seconds", self.wait_seconds, "Time spent waiting for a connection"),
+        ]
+        for name, value, help_text in counters:
+            lines.extend(metric("shopcarts_db_pool_%s_total" % name, "counter", help_text, value))
+        lines.extend(metric(
+            "shopcarts_db_pool_max_wait_seconds", "gauge",
+            "Longest wait for a connection", self.max_wait_seconds
+        ))
+        engine = self._engine()
+        if engine is not None and isinstance(engine.pool, QueuePool):
+            gauges = [
+                ("size", engine.pool.size(), "Connections kept in the pool"),
+                ("checked_out", engine.pool.checkedout(), "Connections currently in use"),
+                ("overflow", engine.pool.overflow(), "Connections open beyond the pool size"),
+            ]
+            for name, value, help_text in gauges:
+                lines.extend(metric("shopcarts_db_pool_%s" % name, "gauge", help_text, value))
+        return "\n".join(lines) + "\n"
+
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool that records how long checkouts wait in its queue
+
+    Only a checkout that finds no idle connection and no overflow left to
+    open one waits, the others are neither counted nor timed
+    """
+
+    def _do_get(self):
+        if self.checkedin() or self._max_overflow == -1 or self.overflow() < self._max_overflow:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start)
+
+
+class Histogram():
+    """ A Prometheus histogram with one series per set of label values """
+
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [count per bucket..., count over the last bucket, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        """ Records one value for a tuple of label values """
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self):
+        """ Returns the series as a list that survives a round trip through JSON """
+        return [[list(labels), list(series)] for labels, series in self.series.items()]
+
+    def render(self, snapshots):
+        """ Returns the lines of the histogram with the snapshots added up """
+        totals = {}
+        for snapshot in snapshots:
+            for labels, series in snapshot:
+                total = totals.setdefault(tuple(labels), [0] * len(series))
+                for index, value in enumerate(series):
+                    total[index] += value
+        lines = [
+            "# HELP %s %s" % (self.name, self.help_text),
+            "# TYPE %s histogram" % self.name,
+        ]
+        for labels in sorted(totals):
+            series = totals[labels]
+            label_text = ",".join(
+                '%s="%s"' % (name, escape_label(value))
+                for name, value in zip(self.labelnames, labels)
+            )
+            count = 0
+            for bound, value in zip(self.buckets + ("+Inf",), series):
+                count += value
+                lines.append('%s_bucket{%s,le="%s"} %s' % (self.name, label_text, bound, count))
+            lines.append("%s_sum{%s} %s" % (self.name, label_text, series[-1]))
+            lines.append("%s_count{%s} %s" % (self.name, label_text, count))
+        return lines
+
+
+class RequestMetrics():
+    """
+    Times every request and the SQL it runs
+
+    Requests slower than SLOW_REQUEST_MS are logged with their SQL statements
+    """
+
+    SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    QUERIES = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+    # most statements kept per request for the slow request log
+    MAX_STATEMENTS = 50
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines = weakref.WeakSet()
+        self.histograms = [
+            Histogram(
+                "shopcarts_http_request_duration_seconds",
+                "Time to handle a request, up to the first byte of the body",
+                ("method", "route", "status"), self.SECONDS
+            ),
+            Histogram(
+                "shopcarts_db_queries_per_request",
+                "SQL statements executed by a request",
+                ("method", "route"), self.QUERIES
+            ),
+            Histogram(
+                "shopcarts_db_seconds_per_request",
+                "Time a request spent executing SQL statements",
+                ("method", "route"), self.SECONDS
+            ),
+        ]
+        self.slow_request_seconds = 0.5
+        self.directory = None
+        self.flush_interval = 1.0
+        self._path = None
+        self._dirty = False
+        self._flusher = None
+
+    def init_app(self, app, engine):
+        """ Times the requests of a Flask app and the statements of its engine """
+        self.slow_request_seconds = app.config.get("SLOW_REQUEST_MS", 500) / 1000
+        self.directory = app.config.get("METRICS_MULTIPROC_DIR") or None
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", 1.0)
+        self._path = None
+        if not getattr(app, "_request_metrics", False):
+            app._request_metrics = True
+            app.before_request(self.before_request)
+            app.after_request(self.after_request)
+        if engine not in self._engines:
+            self._engines.add(engine)
+            event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_request(self):
+        g.request_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+        g.db_statements = []
+        g.db_started = []
+
+    def before_cursor_execute(self, conn, cursor, statement, *args):
+        if has_request_context() and "db_started" in g:
+            g.db_started.append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, *args):
+        if not has_request_context() or not g.get("db_started"):
+            return
+        seconds = time.perf_counter() - g.db_started.pop()
+        g.db_queries += 1
+        g.db_seconds += seconds
+        if len(g.db_statements) < self.MAX_STATEMENTS:
+            g.db_statements.append((seconds, statement))
+
+    def after_request(self, response):
+        if "request_started" not in g:
+            return response
+        seconds = time.perf_counter() - g.request_started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        self.observe(request.method, route, response.status_code, seconds,
+                     g.db_queries, g.db_seconds)
+        if self.slow_request_seconds and seconds >= self.slow_request_seconds:
+            self.log_slow_request(seconds)
+        return response
+
+    def observe(self, method, route, status, seconds, queries, db_seconds):
+        """ Records one finished request """
+        duration, query_count, db_time = self.histograms
+        with self._lock:
+            duration.observe((method, route, str(status)), seconds)
+            query_count.observe((method, route), queries)
+            db_time.observe((method, route), db_seconds)
+            self._dirty = True
+            if self.directory and self._flusher is None:
+                # started by the first request, so it runs in the worker, not the master
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, name="metrics-flush", daemon=True
+                )
+                self._flusher.start()
+
+    def _flush_loop(self):
+        """ Writes the snapshot to the metrics directory whenever it changed """
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    def log_slow_request(self, seconds):
+        """ Logs a slow request with the SQL statements it executed """
+        lines = [
+            "Slow request %s %s took %.1f ms, %d SQL statements in %.1f ms" % (
+                request.method, request.full_path.rstrip("?"), seconds * 1000,
+                g.db_queries, g.db_seconds * 1000
+            )
+        ]
+        for statement_seconds, statement in g.db_statements:
+            lines.append("  %8.1f ms  %s" % (statement_seconds * 1000, " ".join(statement.split())))
+        if g.db_queries > len(g.db_statements):
+            lines.append("  ... %d more" % (g.db_queries - len(g.db_statements)))
+        logger.warning("\n".join(lines))
+
+    def snapshot(self):
+        """ Returns the metrics of this process as a JSON serializable list """
+        with self._lock:
+            return [histogram.snapshot() for histogram in self.histograms]
+
+    def flush(self):
+        """ Writes the snapshot of this process to its file in the metrics directory """
+        self._dirty = False
+        if self._path is None:
+            # unique per process, so a reused pid never overwrites a dead worker
+            self._path = os.path.join(
+                self.directory, "requests-%d-%s.json" % (os.getpid(), uuid.uuid4().hex[:8])
+            )
+        temporary = self._path + ".tmp"
+        try:
+            with open(temporary, "w") as metrics_file:
+                json.dump(self.snapshot(), metrics_file)
+            os.replace(temporary, self._path)
+        except OSError as error:
+            logger.warning("Could not write request metrics to %s: %s", self._path, error)
+
+    def snapshots(self):
+        """ Returns the snapshots of every worker, or of this process alone """
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "requests-*.json")):
+            try:
+                with open(path) as metrics_file:
+                    snapshots.append(json.load(metrics_file))
+            except (OSError, ValueError) as error:
+                logger.warning("Could not read request metrics from %s: %s", path, error)
+        return snapshots
+
+    def render(self):
+        """ Returns the request metrics in the Prometheus text format """
+        snapshots = self.snapshots()
+        lines = []
+        for index, histogram in enumerate(self.histograms):
+            lines.extend(histogram.render([snapshot[index] for snapshot in snapshots]))
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    """ Escapes a label value for the Prometheus text format """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def metric(name, kind, help_text, value):
+    """ Returns the lines of a single Prometheus metric """
+    return [
+        "# HELP %s %s" % (name, help_text),
+        "# TYPE %s %s" % (name, kind),
+        "%s %s" % (name, value),
+    ]
+
+
+pool_metrics = PoolMetrics()
+request_metrics = RequestMetrics()
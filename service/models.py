@@ -11,6 +11,12 @@ ShopCart - A cart with items in it
 Attributes:
 id
 customer_id
+version
+item_count
+unit_count
+subtotal
+created_at
+updated_at
 items
 
 --------
@@ -26,9 +32,24 @@ price
 
 """
 import logging
+import sqlite3
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from contextlib import contextmanager
+from flask import abort, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Float, Numeric, and_, case, event, exists, func, inspect
+from sqlalchemy import literal_column, text, true
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.pool import NullPool
+from service.cache import NullCache, make_cache
+from service.metrics import TimedQueuePool, pool_metrics
 
-logger = logging.getLogger("flask.app")
+logger = logging.getLogger(__name__)
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
@@ -39,61 +60,671 @@ class DataValidationError(Exception):
 
 DATETIME_FORMAT='%Y-%m-%d %H:%M:%S.%f'
 
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """ SQLite only honors ON DELETE CASCADE with foreign keys turned on """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+        # pysqlite starts transactions late, which breaks SAVEPOINTs,
+        # so let begin_sqlite_transaction() start them instead
+        dbapi_connection.isolation_level = None
+
+@event.listens_for(Engine, "begin")
+def begin_sqlite_transaction(connection):
+    """ Starts SQLite transactions when SQLAlchemy begins them """
+    if connection.dialect.name == "sqlite":
+        # on the DBAPI connection, so it is not counted as a request statement
+        connection.connection.execute("BEGIN")
+
+def engine_options(config):
+    """ Returns the SQLAlchemy engine options for the DB_* settings
+
+    Only Postgres is tuned, every other database keeps the defaults
+    """
+    if not config["SQLALCHEMY_DATABASE_URI"].startswith("postgres"):
+        return {}
+    if config.get("DB_EXTERNAL_POOLER"):
+        # PgBouncer pools the connections, so hold none open between requests
+        # and leave the statement timeout to the database role
+        return {"poolclass": NullPool}
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": config.get("DB_POOL_SIZE", 2),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", 0),
+        "pool_timeout": config.get("DB_POOL_TIMEOUT", 10),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", True),
+    }
+    if config.get("DB_STATEMENT_TIMEOUT"):
+        options["connect_args"] = {
+            "options": "-c statement_timeout=%d" % config["DB_STATEMENT_TIMEOUT"]
+        }
+    return options
+
+# Loader options for ShopCart.items, keyed by the SHOPCART_ITEMS_LOADING setting
+ITEMS_LOADERS = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "lazy": None,
+}
+# how CartItem.merge() combines the quantities of a SKU in both ShopCarts
+MERGE_POLICIES = ("sum", "max", "target", "source")
+# prices and subtotals are kept in cents
+CENTS = Decimal("0.01")
+
+############################################################
+# U N I T   O F   W O R K
+############################################################
+class UnitOfWork():
+    """
+    One transaction per request
+
+    Inside a request the model methods only flush. The request commits
+    once at the end if it answered with a success status and rolls back
+    otherwise. Cart cache entries are dropped again after the commit, so
+    no reader can cache what the transaction had not committed yet.
+    """
+
+    def __init__(self):
+        self.dirty = False
+        self.cart_ids = set()
+        self.clear_cache = False
+
+    @staticmethod
+    def current():
+        """ Returns the unit of work of the current request or None """
+        return g.get("unit_of_work") if has_request_context() else None
+
+    @classmethod
+    def init_app(cls, app):
+        """ Wraps every request of a Flask app in a unit of work """
+        if getattr(app, "_unit_of_work", False):
+            return
+        app._unit_of_work = True
+        app.before_request(cls.begin)
+        app.after_request(cls.end)
+        app.teardown_request(cls.teardown)
+
+    @classmethod
+    def begin(cls):
+        g.unit_of_work = cls()
+
+    @staticmethod
+    def end(response):
+        unit_of_work = g.pop("unit_of_work", None)
+        if unit_of_work is None:
+            return response
+        if response.status_code >= 400:
+            # whether or not it flushed, nothing of a failed request is kept
+            logger.info("Rolling back request with status %s", response.status_code)
+            db.session.rollback()
+            return response
+        if not unit_of_work.dirty:
+            if db.session.new or db.session.dirty or db.session.deleted:
+                # changed objects nobody committed must not leak into the next request
+                db.session.rollback()
+            # nothing written, and a streamed body may still need the transaction
+            return response
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        PersistentBase.cache.delete(*unit_of_work.cart_ids)
+        if unit_of_work.clear_cache:
+            PersistentBase.cache.clear()
+        return response
+
+    @staticmethod
+    def teardown(error):
+        # runs after a streamed body is done, and also when after_request was
+        # skipped for an exception: end whatever transaction is still open,
+        # reads included, and give the connection back to the pool
+        g.pop("unit_of_work", None)
+        db.session.rollback()
+        db.session.remove()
+
+
+def commit():
+    """ Commits the session, or only flushes it inside a request's unit of work """
+    unit_of_work = UnitOfWork.current()
+    if unit_of_work is None:
+        db.session.commit()
+        return
+    db.session.flush()
+    unit_of_work.dirty = True
+    # reload on next access like a commit would, bulk UPDATEs bypass the session
+    db.session.expire_all()
+
+
+def invalidate(cart_ids=None):
+    """ Drops ShopCarts from the cache, all of them when no ids are given """
+    unit_of_work = UnitOfWork.current()
+    if cart_ids is None:
+        PersistentBase.cache.clear()
+        if unit_of_work is not None:
+            unit_of_work.clear_cache = True
+        return
+    PersistentBase.cache.delete(*cart_ids)
+    if unit_of_work is not None:
+        unit_of_work.cart_ids.update(cart_ids)
+
+
+def line_totals(quantity, price, sign=1):
+    """ Returns the (item_count, unit_count, subtotal) a cart line adds to its ShopCart
+
+    A NULL quantity or price adds nothing but the line, as SUM() skips it.
+    The price is rounded to cents first, as the price column stores it
+    """
+    quantity = quantity or 0
+    if price is None:
+        return (sign, sign * quantity, 0)
+    price = Decimal(str(price)).quantize(CENTS, ROUND_HALF_UP)
+    return (sign, sign * quantity, sign * quantity * price)
+
+
+def is_numeric(type_):
+    """ Tells a NUMERIC column type from FLOAT, which SQLAlchemy makes a kind of it """
+    return isinstance(type_, Numeric) and not isinstance(type_, Float)
+
+
+def add_totals(deltas, cart_id, totals):
+    """ Adds (item_count, unit_count, subtotal) to the change of a ShopCart's totals """
+    deltas[cart_id] = tuple(a + b for a, b in zip(deltas.get(cart_id, (0, 0, 0)), totals))
+
+
+@contextmanager
+def savepoint():
+    """
+    Runs a block in a SAVEPOINT
+    If the block raises, only its own changes are rolled back
+    """
+    transaction = db.session.begin_nested()
+    try:
+        yield transaction
+    except Exception:
+        transaction.rollback()
+        raise
+    transaction.commit()
+
+
 ############################################################
 # P E R S I S T E N T   B A S E    M O D E L 
 ############################################################
 class PersistentBase():
     """ Base class added persistent methods """
 
+    # Serialized ShopCarts keyed by id, replaced in init_db()
+    cache = NullCache()
+    # the members a PATCH may set, with the JSON types they take
+    PATCHABLE = {}
+    # the fields a sparse fieldset (?fields=) may name
+    FIELDS = ()
+    # the columns read even when a fieldset leaves them out
+    KEY_FIELDS = ("id",)
+
     def create(self):
         """
         Creates a ShopCart to the database
         """
         logger.info("Creating %s", self.id)
         self.id = None  
+        cart_ids = self.changed_cart_ids()
         db.session.add(self)
-        db.session.commit()
+        self.commit_carts(cart_ids)
 
     def save(self):
         """
         Updates a ShopCart to the database
         """
         logger.info("Saving %s", self.id)
-        db.session.commit()
+        self.commit_carts(self.changed_cart_ids())
 
     def delete(self):
         """ Removes a ShopCart from the data store """
         logger.info("Deleting %s", self.id)
+        cart_ids = self.changed_cart_ids()
         db.session.delete(self)
-        db.session.commit()
+        self.commit_carts(cart_ids)
+
+    def changed_cart_ids(self):
+        """ Returns the ids of the existing ShopCarts a change to this record touches """
+        return set()
+
+    @classmethod
+    def added_totals(cls, records):
+        """ Returns what new records add to the totals of existing ShopCarts, by id """
+        return {}
+
+    @staticmethod
+    def commit_carts(cart_ids, deltas=None):
+        """ Bumps the version of the changed ShopCarts, commits and invalidates them
+
+        Their totals move by what the change added or removed, no items
+        are recounted
+
+        Args:
+            cart_ids: the ids of the changed ShopCarts
+            deltas (dict): the (item_count, unit_count, subtotal) the change
+                added to each ShopCart, by id. Taken from the items pending
+                in the session if not given
+        """
+        if deltas is None:
+            deltas = CartItem.pending_totals()
+        db.session.flush()
+        cart_ids = set(cart_ids) | set(deltas)
+        ShopCart.bump_version(cart_ids - set(deltas))
+        for cart_id, delta in deltas.items():
+            ShopCart.bump_version([cart_id], delta=delta)
+        commit()
+        invalidate(cart_ids)
+
+    @classmethod
+    def bulk_create(cls, records):
+        """ Creates many records in a single transaction
+
+        Args:
+            records (list): new, unsaved records
+        Returns:
+            the records with their ids assigned
+        """
+        logger.info("Creating %d %s records", len(records), cls.__name__)
+        cart_ids = set()
+        for record in records:
+            cart_ids.update(record.changed_cart_ids())
+        deltas = cls.added_totals(records)
+        cls.insert_many(records)
+        cls.commit_carts(cart_ids, deltas)
+        return records
+
+    @classmethod
+    def reserve_ids(cls, count):
+        """ Returns a SELECT of count new ids from the Postgres id sequence """
+        sequence = func.pg_get_serial_sequence(cls.__tablename__, "id")
+        return db.select([func.nextval(sequence)]).select_from(func.generate_series(1, count))
+
+    @classmethod
+    def insert_many(cls, records):
+        """ Inserts records with one multi-row INSERT and assigns their ids """
+        if not records:
+            return
+        table = cls.__table__
+        columns = [column for column in table.columns if not column.primary_key]
+        for record in records:
+            # apply the column defaults up front so the records serialize complete
+            for column in columns:
+                default = column.default
+                if getattr(record, column.key) is None and default is not None:
+                    setattr(record, column.key, default.arg(None) if default.is_callable else default.arg)
+        if db.engine.dialect.name == "postgresql":
+            # RETURNING does not promise the VALUES order, so take the ids from
+            # the sequence first and INSERT ... VALUES (...), (...) with them
+            result = db.session.execute(cls.reserve_ids(len(records)))
+            for record, row in zip(records, result):
+                record.id = row[0]
+            rows = [
+                {column.key: getattr(record, column.key) for column in table.columns}
+                for record in records
+            ]
+            db.session.execute(table.insert().values(rows))
+        else:
+            # no RETURNING support, so let the ORM fetch each new id
+            db.session.bulk_save_objects(records, return_defaults=True)
+
+    @classmethod
+    def patch_values(cls, patch):
+        """ Validates a JSON Merge Patch and returns the column values it sets
+
+        A member set to null clears the column, members left out are
+        not touched
+
+        Args:
+            patch (dict): the patch, only with members named in PATCHABLE
+        """
+        if not isinstance(patch, dict):
+            raise DataValidationError("Invalid patch: body of request must be an object")
+        values = {}
+        for key, value in patch.items():
+            types = cls.PATCHABLE.get(key)
+            if types is None:
+                raise DataValidationError("Invalid patch: {} cannot be changed".format(key))
+            if value is not None and (not isinstance(value, types) or isinstance(value, bool)):
+                raise DataValidationError("Invalid patch: {} has the wrong type".format(key))
+            values[key] = value
+        return values
+
+    @classmethod
+    def update_returning(cls, criterion, values):
+        """ Runs UPDATE ... SET values WHERE criterion RETURNING *
+
+        Without RETURNING support the row is read back after the UPDATE
+
+        Returns:
+            the updated row, or None if nothing matched
+        """
+        table = cls.__table__
+        statement = table.update().where(criterion).values(values)
+        if db.engine.dialect.implicit_returning:
+            return db.session.execute(statement.returning(*table.c)).first()
+        if not db.session.execute(statement).rowcount:
+            return None
+        return db.session.execute(table.select().where(criterion)).first()
+
+    @classmethod
+    def update_changes(cls, criterion, values, columns):
+        """ Runs update_returning() and also returns columns as they were before
+
+        With RETURNING the old values come from a locked subquery in the same
+        UPDATE. Without it the row is read first and the values, which must
+        be plain values then, are applied to it rather than reading it back
+
+        Returns:
+            (the updated row, the old values of columns), or (None, None)
+        """
+        table = cls.__table__
+        if db.engine.dialect.implicit_returning:
+            before = db.select([table.c.id] + list(columns)).where(criterion).with_for_update()
+            before = before.alias("previous")
+            row = db.session.execute(
+                table.update().where(table.c.id == before.c.id).values(values)
+                .returning(*table.c, *[before.c[column.name] for column in columns])
+            ).first()
+            if row is None:
+                return None, None
+            return tuple(row)[:len(table.c)], tuple(row)[len(table.c):]
+        row = db.session.execute(table.select().where(criterion)).first()
+        if row is None:
+            return None, None
+        db.session.execute(table.update().where(table.c.id == row.id).values(values))
+        old = tuple(row[column.name] for column in columns)
+        return tuple(values.get(column.name, row[column.name]) for column in table.c), old
+
+    @classmethod
+    def delete_returning(cls, criterion, columns):
+        """ Runs DELETE ... WHERE criterion RETURNING columns
+
+        Without RETURNING support the rows are read before the DELETE
+
+        Returns:
+            the columns of the deleted rows
+        """
+        statement = cls.__table__.delete().where(criterion)
+        if db.engine.dialect.implicit_returning:
+            return db.session.execute(statement.returning(*columns)).fetchall()
+        rows = db.session.execute(db.select(columns).where(criterion)).fetchall()
+        db.session.execute(statement)
+        return rows
+
+    @classmethod
+    def delete_all(cls, *criterion):
+        """ Removes all matching records with a single DELETE statement
+
+        Args:
+            criterion: SQL expressions to filter the records, all if omitted
+        Returns:
+            the number of records removed
+        """
+        logger.info("Deleting all %s records matching %s", cls.__name__, criterion)
+        count = cls.query.filter(*criterion).delete(synchronize_session=False)
+        commit()
+        invalidate()
+        return count
 
     @classmethod
     def init_db(cls, app):
         """ Initializes the database session """
         logger.info("Initializing database")
         cls.app = app
+        PersistentBase.cache = make_cache(app.config)
+        options = engine_options(app.config)
+        options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
+        pool_metrics.watch(db.engine)
         db.create_all()  # make our sqlalchemy tables
+        added = cls.create_columns()
+        cls.convert_columns()
+        if any(column.name in ("item_count", "unit_count", "subtotal") for column in added):
+            # writes only move the totals, so count them once for the carts there are
+            logger.info("Counting the totals of every ShopCart")
+            ShopCart.count_totals()
+            db.session.commit()
+        cls.create_foreign_keys()
+        cls.create_indexes()
+
+    @staticmethod
+    def create_columns():
+        """ Adds any columns missing from tables made before they were added
+
+        Returns:
+            the columns added
+        """
+        added = []
+        inspector = inspect(db.engine)
+        compiler = db.engine.dialect.ddl_compiler(db.engine.dialect, None)
+        for table in db.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    logger.info("Adding column %s.%s", table.name, column.name)
+                    try:
+                        db.engine.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                            table.name, compiler.get_column_specification(column)
+                        ))
+                    except DBAPIError as error:
+                        # e.g. SQLite only adds columns with a constant default
+                        logger.error("Could not add column %s.%s: %s", table.name, column.name, error)
+                    else:
+                        added.append(column)
+        return added
+
+    @staticmethod
+    def convert_columns():
+        """ Converts columns the model keeps as NUMERIC that were made as another type
+
+        e.g. cart_item.price, which lost cents as a FLOAT
+        """
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            existing = {
+                column["name"]: column["type"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                current = existing.get(column.name)
+                if not is_numeric(column.type) or current is None or is_numeric(current):
+                    continue
+                type_name = column.type.compile(dialect=db.engine.dialect)
+                if db.engine.dialect.name != "postgresql":
+                    logger.error(
+                        "Column %s.%s is %s, not %s, recreate the table",
+                        table.name, column.name, current, type_name
+                    )
+                    continue
+                logger.info("Converting column %s.%s to %s", table.name, column.name, type_name)
+                db.engine.execute(
+                    "ALTER TABLE {table} ALTER COLUMN {column} TYPE {type} "
+                    "USING {column}::{type}".format(
+                        table=table.name, column=column.name, type=type_name
+                    )
+                )
+
+    @staticmethod
+    def create_foreign_keys():
+        """ Recreates foreign keys whose ON DELETE rule changed since their table was made """
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            existing = {
+                tuple(foreign_key["constrained_columns"]): foreign_key
+                for foreign_key in inspector.get_foreign_keys(table.name)
+            }
+            for constraint in table.foreign_key_constraints:
+                columns = [column.name for column in constraint.columns]
+                foreign_key = existing.get(tuple(columns))
+                if foreign_key is None:
+                    continue
+                ondelete = (constraint.ondelete or "NO ACTION").upper()
+                if (foreign_key["options"].get("ondelete") or "NO ACTION").upper() == ondelete:
+                    continue
+                if db.engine.dialect.name != "postgresql":
+                    logger.error(
+                        "Foreign key %s(%s) needs ON DELETE %s, recreate the table",
+                        table.name, ", ".join(columns), ondelete
+                    )
+                    continue
+                logger.info(
+                    "Recreating foreign key %s with ON DELETE %s", foreign_key["name"], ondelete
+                )
+                # one statement, so the table is never without the constraint
+                db.engine.execute(
+                    "ALTER TABLE {table} DROP CONSTRAINT {name}, ADD CONSTRAINT {name} "
+                    "FOREIGN KEY ({columns}) REFERENCES {referred} ({referred_columns}) "
+                    "ON DELETE {ondelete}".format(
+                        table=table.name, name=foreign_key["name"], columns=", ".join(columns),
+                        referred=constraint.referred_table.name,
+                        referred_columns=", ".join(
+                            element.column.name for element in constraint.elements
+                        ),
+                        ondelete=ondelete,
+                    )
+                )
+
+    @staticmethod
+    def create_indexes():
+        """ Creates any indexes missing from tables made before they were added
+
+        Rows a new unique index would reject are merged first. If it still
+        cannot be created the app must not start, the queries count on it
+        """
+        inspector = inspect(db.engine)
+        for model in PersistentBase.__subclasses__():
+            table = model.__table__
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.unique:
+                    model.merge_duplicates(index)
+                logger.info("Creating index %s", index.name)
+                try:
+                    index.create(bind=db.engine)
+                except DBAPIError as error:
+                    logger.error("Could not create index %s: %s", index.name, error)
+                    if index.unique:
+                        raise
+
+    @classmethod
+    def merge_duplicates(cls, index):
+        """ Merges the rows a new unique index would reject, before it is created """
+
+    @classmethod
+    def read_query(cls):
+        """ Returns the query used by all of the read methods """
+        return cls.query
 
     @classmethod
     def all(cls):
         """ Returns all of the records in the database """
         logger.info("Processing all records")
-        return cls.query.all()
+        return cls.read_query().all()
 
     @classmethod
     def find(cls, by_id):
         """ Finds a record by it's ID """
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        return cls.read_query().get(by_id)
 
     @classmethod
     def find_or_404(cls, by_id):
         """ Find a record by it's id """
         logger.info("Processing lookup or 404 for id %s ...", by_id)
-        return cls.query.get_or_404(by_id)
+        return cls.read_query().get_or_404(by_id)
+
+    @classmethod
+    def row_query(cls, query, fields=None):
+        """ Returns the query reading only the columns serialize_rows() needs
+
+        Args:
+            query (Query): the query to read
+            fields (list): a sparse fieldset, read only its columns and KEY_FIELDS
+        """
+        if fields is not None:
+            return query.with_entities(*[getattr(cls, name) for name in cls.field_columns(fields)])
+        return query.with_entities(*cls.__table__.columns)
+
+    @classmethod
+    def field_columns(cls, fields):
+        """ Returns the columns read for a sparse fieldset, KEY_FIELDS first """
+        for name in fields:
+            if name not in cls.FIELDS:
+                raise DataValidationError("Invalid fields: {} has no field {}".format(
+                    cls.__name__, name
+                ))
+        return list(cls.KEY_FIELDS) + [name for name in fields if name not in cls.KEY_FIELDS]
+
+    @classmethod
+    def sparse(cls, record, fields):
+        """ Returns only the fields of a serialized record that a fieldset names """
+        return {name: record[name] for name in fields}
+
+    @classmethod
+    def read_rows(cls, query, stream=False, fields=None):
+        """ Runs a query as a Core SELECT of the row_query() columns
+
+        The rows come straight from the cursor as __slots__ based records,
+        without building ORM instances or adding anything to the identity map
+
+        Args:
+            query (Query): the query to read, e.g. from keyset_page()
+            stream (bool): read the rows from a server-side cursor
+            fields (list): a sparse fieldset to read, see row_query()
+        """
+        statement = cls.row_query(query, fields).statement
+        if stream:
+            statement = statement.execution_options(stream_results=True)
+        return db.session.execute(statement)
+
+    @classmethod
+    def find_row_or_404(cls, by_id):
+        """ Finds the plain row of a record by it's id """
+        logger.info("Processing row lookup or 404 for id %s ...", by_id)
+        row = cls.read_rows(cls.query.filter(cls.id == by_id)).first()
+        if row is None:
+            abort(404, "{} with id '{}' was not found.".format(cls.__name__, by_id))
+        return row
+
+    @classmethod
+    def serialize_rows(cls, rows, fields=None):
+        """ Serializes plain column tuples from row_query() into dictionaries
+
+        Skips building ORM objects, so it is only for read-only lists
+        """
+        if fields is not None:
+            columns = cls.field_columns(fields)
+            return [cls.sparse(dict(zip(columns, row)), fields) for row in rows]
+        return [row._asdict() for row in rows]
+
+    @classmethod
+    def keyset_page(cls, after_id=None, limit=None, query=None):
+        """ Returns a query for one page of records ordered by id
+
+        Args:
+            after_id (int): only return records with an id greater than this
+            limit (int): the maximum number of records to return
+            query (Query): the query to page through, defaults to read_query()
+        """
+        logger.info("Processing page after id %s limit %s ...", after_id, limit)
+        if query is None:
+            query = cls.read_query()
+        query = query.order_by(cls.id)
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
 
 
 #############################################################
@@ -106,23 +737,388 @@ class ShopCart(db.Model, PersistentBase):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    customer_id =  db.Column(db.Integer)
-    items  = db.relationship('CartItem', backref='shopcart', lazy=True)
+    customer_id =  db.Column(db.Integer, index=True)
+    # bumped on every change to the cart or its items, used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # totals of the items, moved by what every write adds or removes
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    unit_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    subtotal = db.Column(db.Numeric(12, 2), nullable=False, default=0, server_default="0")
+    # UTC, updated_at moves with every version bump and is what the reaper looks at
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, server_default=func.now()
+    )
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+        server_default=func.now(), index=True
+    )
+    items  = db.relationship(
+        'CartItem', backref='shopcart', lazy=True, order_by='CartItem.id',
+        cascade="all, delete", passive_deletes=True
+    )
    
+    PATCHABLE = {"customer_id": int}
+    # "items" includes the items, "items.<field>" only some of their fields
+    FIELDS = ("id", "customer_id", "version", "items")
+    KEY_FIELDS = ("id", "version")
+
     def __repr__(self):
         return "<ShopCart id=[%s]>" % (self.id)
 
-    def serialize(self):
-        """ Serializes a ShopCart into a dictionary """       
+    @classmethod
+    def read_query(cls, loading=None):
+        """ Returns a ShopCart query that loads the items eagerly
+
+        Args:
+            loading (string): one of "selectin", "joined" or "lazy".
+                Defaults to the SHOPCART_ITEMS_LOADING setting
+        """
+        if loading is None and cls.app:
+            loading = cls.app.config.get("SHOPCART_ITEMS_LOADING")
+        loading = loading or "selectin"
+        if loading not in ITEMS_LOADERS:
+            raise ValueError("Unknown items loading strategy: %s" % loading)
+        loader = ITEMS_LOADERS[loading]
+        if loader is None:
+            return cls.query
+        return cls.query.options(loader(cls.items))
+
+    def changed_cart_ids(self):
+        """ Returns the id of this ShopCart once it has one """
+        return {self.id} if self.id is not None else set()
+
+    def count_items(self):
+        """ Sets the totals of this new ShopCart from the items it comes with """
+        lines = [line_totals(item.quantity, item.price) for item in self.items]
+        self.item_count = len(lines)
+        self.unit_count = sum(units for _, units, _ in lines)
+        self.subtotal = sum(amount for _, _, amount in lines)
+
+    @classmethod
+    def totals(cls):
+        """ Returns the column values that recount the totals of a ShopCart """
+        items = CartItem.__table__
+
+        def of_items(aggregate):
+            return db.select([func.coalesce(aggregate, 0)]).where(
+                items.c.shopcart_id == cls.id
+            ).as_scalar()
+
+        return {
+            cls.item_count: of_items(func.count(items.c.id)),
+            cls.unit_count: of_items(func.sum(items.c.quantity)),
+            cls.subtotal: of_items(func.sum(items.c.quantity * items.c.price)),
+        }
+
+    @classmethod
+    def count_totals(cls, ids=None):
+        """ Recounts the totals of ShopCarts from their items with one UPDATE
+
+        Only for repairs, writes move the totals by their change. All
+        ShopCarts are recounted when no ids are given
+        """
+        query = cls.query
+        if ids is not None:
+            if not ids:
+                return 0
+            query = query.filter(cls.id.in_(ids))
+        return query.update(cls.totals(), synchronize_session=False)
+
+    @classmethod
+    def bump_version(cls, ids, expected=None, delta=None, recount=False):
+        """ Increments the version of ShopCarts with one UPDATE statement
+
+        The same statement adds a change to their totals
+
+        Args:
+            ids: the ShopCart ids, as a collection or a subquery
+            expected (int): only bump carts that are still at this version
+            delta (tuple): the (item_count, unit_count, subtotal) to add
+            recount (bool): recount the totals from the items instead
+        Returns:
+            the number of ShopCarts bumped
+        """
+        if isinstance(ids, (set, list, tuple)) and not ids:
+            return 0
+        query = cls.query.filter(cls.id.in_(ids))
+        if expected is not None:
+            query = query.filter(cls.version == expected)
+        values = cls.totals() if recount else {}
+        values[cls.version] = cls.version + 1
+        if delta is not None and any(delta):
+            items, units, amount = delta
+            values[cls.item_count] = cls.item_count + items
+            values[cls.unit_count] = cls.unit_count + units
+            values[cls.subtotal] = cls.subtotal + amount
+        return query.update(values, synchronize_session=False)
+
+    @classmethod
+    def claim_version(cls, by_id, expected):
+        """ Bumps a ShopCart that is still at a version, as part of the request's write
+
+        The claim joins the unit of work, so if the request fails it is
+        rolled back with everything else and the version stays as it was
+
+        Returns:
+            True if the ShopCart was still at that version
+        """
+        if not cls.bump_version([by_id], expected=expected):
+            return False
+        commit()
+        invalidate([by_id])
+        return True
+
+    @classmethod
+    def reap_idle(cls, cutoff, batch_size=500):
+        """ Deletes one batch of ShopCarts that have not changed since a cutoff
+
+        DELETE ... WHERE id IN (SELECT id ... LIMIT n) in its own short
+        transaction; their items go with them through ON DELETE CASCADE.
+        Postgres skips carts another transaction has locked, so the reaper
+        never waits on a cart that is being used
+
+        Args:
+            cutoff (datetime): the UTC time before which carts count as idle
+            batch_size (int): the most carts deleted by this batch
+        Returns:
+            the ids of the deleted ShopCarts
+        """
+        table = cls.__table__
+        idle = db.select([table.c.id]).where(table.c.updated_at < cutoff)
+        idle = idle.order_by(table.c.updated_at).limit(batch_size)
+        if db.engine.dialect.name == "postgresql":
+            idle = idle.with_for_update(skip_locked=True)
+        if db.engine.dialect.implicit_returning:
+            result = db.session.execute(
+                table.delete().where(table.c.id.in_(idle)).returning(table.c.id)
+            )
+            ids = [row[0] for row in result]
+        else:
+            # without RETURNING read the ids in the same transaction first
+            ids = [row[0] for row in db.session.execute(idle)]
+            if ids:
+                db.session.execute(table.delete().where(table.c.id.in_(ids)))
+        commit()
+        invalidate(ids)
+        return ids
+
+    @classmethod
+    def patch(cls, by_id, patch):
+        """ Applies a JSON Merge Patch to a ShopCart with one UPDATE
+
+        The same statement bumps the version, no SELECT goes before it
+
+        Returns:
+            the updated ShopCart row, as serialize_rows() takes it
+        """
+        logger.info("Patching shopcart %s with %s", by_id, patch)
+        table = cls.__table__
+        values = cls.patch_values(patch)
+        values["version"] = table.c.version + 1
+        row = cls.update_returning(table.c.id == by_id, values)
+        if row is None:
+            abort(404, "ShopCart with id '{}' was not found.".format(by_id))
+        commit()
+        invalidate([by_id])
+        return row.id, row.customer_id, row.version
+
+    def clear_items(self):
+        """ Removes the items of this ShopCart with one DELETE, ready for new ones """
+        CartItem.query.filter(CartItem.shopcart_id == self.id).delete(synchronize_session=False)
+        ShopCart.query.filter(ShopCart.id == self.id).update(
+            {ShopCart.item_count: 0, ShopCart.unit_count: 0, ShopCart.subtotal: 0},
+            synchronize_session=False,
+        )
+        db.session.expire(self, ["items", "item_count", "unit_count", "subtotal"])
+
+    @classmethod
+    def find_version_or_404(cls, by_id):
+        """ Returns the version of a ShopCart without loading it or its items """
+        shopcart = cls.cache.get(by_id)
+        if shopcart is not None:
+            return shopcart["version"]
+        version = db.session.query(cls.version).filter(cls.id == by_id).scalar()
+        if version is None:
+            abort(404, "ShopCart with id '{}' was not found.".format(by_id))
+        return version
+
+    @classmethod
+    def find_summary_or_404(cls, by_id):
+        """ Returns the version and totals of a ShopCart without reading its items """
+        summary = db.session.query(
+            cls.version, cls.item_count, cls.unit_count, cls.subtotal
+        ).filter(cls.id == by_id).first()
+        if summary is None:
+            abort(404, "ShopCart with id '{}' was not found.".format(by_id))
+        return summary
+
+    @classmethod
+    def find_items_or_404(cls, by_id, fields=None):
+        """ Returns the version and serialized items of a ShopCart
+
+        Read through the cache, or else with one outer join of the ShopCart
+        and its items, so a missing ShopCart and an empty one tell apart
+
+        Args:
+            by_id (int): the id of the ShopCart
+            fields (list): a sparse fieldset of the items
+        """
+        if fields is not None:
+            # validated up front, a cached cart would not check the names
+            CartItem.field_columns(fields)
+        shopcart = cls.cache.get(by_id)
+        if shopcart is not None:
+            items = shopcart["items"]
+            if fields is not None:
+                items = [CartItem.sparse(item, fields) for item in items]
+            return shopcart["version"], items
+        items = CartItem.__table__
+        if fields is None:
+            columns = list(items.c)
+        else:
+            columns = [items.c[name] for name in CartItem.field_columns(fields)]
+        rows = db.session.execute(
+            db.select([cls.__table__.c.version] + columns)
+            .select_from(cls.__table__.outerjoin(items))
+            .where(cls.__table__.c.id == by_id)
+            .order_by(items.c.id)
+        ).fetchall()
+        if not rows:
+            abort(404, "ShopCart with id '{}' was not found.".format(by_id))
+        item_rows = [tuple(row)[1:] for row in rows if row[1] is not None]
+        return rows[0][0], CartItem.serialize_rows(item_rows, fields)
+
+    @classmethod
+    def find_sparse_or_404(cls, by_id, fields):
+        """ Returns the version and a sparse fieldset of a ShopCart
+
+        Taken from the cache, or else read with only the columns it names
+        """
+        # validated up front, a cached cart would not check the names
+        cls.field_columns(fields)
+        shopcart = cls.cache.get(by_id)
+        if shopcart is not None:
+            return shopcart["version"], cls.sparse(shopcart, fields)
+        rows = cls.read_rows(cls.query.filter(cls.id == by_id), fields=fields).fetchall()
+        if not rows:
+            abort(404, "ShopCart with id '{}' was not found.".format(by_id))
+        # the rows lead with the KEY_FIELDS id and version
+        return rows[0][1], cls.serialize_rows(rows, fields)[0]
+
+    @classmethod
+    def split_fields(cls, fields):
+        """ Splits a sparse fieldset into the ShopCart fields and the item fields
+
+        Returns:
+            the ShopCart fields, whether the items are included and their
+            fields, None for all of them
+        """
+        cart_fields = []
+        item_fields = []
+        with_items = False
+        for name in fields:
+            if name == "items":
+                with_items = True
+            elif name.startswith("items."):
+                with_items = True
+                item_fields.append(name[len("items."):])
+            else:
+                cart_fields.append(name)
+        return cart_fields, with_items, item_fields or None
+
+    @classmethod
+    def field_columns(cls, fields):
+        cart_fields, _, item_fields = cls.split_fields(fields)
+        if item_fields is not None:
+            CartItem.field_columns(item_fields)
+        return super(ShopCart, cls).field_columns(cart_fields)
+
+    @classmethod
+    def sparse(cls, record, fields):
+        cart_fields, with_items, item_fields = cls.split_fields(fields)
+        shopcart = {name: record[name] for name in cart_fields}
+        if with_items:
+            shopcart["items"] = record["items"]
+            if item_fields is not None:
+                shopcart["items"] = [CartItem.sparse(item, item_fields) for item in record["items"]]
+        return shopcart
+
+    @classmethod
+    def find_serialized_or_404(cls, by_id):
+        """ Returns a serialized ShopCart, read through the cache """
+        shopcart = cls.cache.get(by_id)
+        if shopcart is None:
+            shopcart = cls.find_or_404(by_id).serialize()
+            cls.cache.set(by_id, shopcart)
+        return shopcart
+
+    def serialize(self, fields=None):
+        """ Serializes a ShopCart into a dictionary, or a sparse fieldset of it """
+        if fields is not None:
+            return self.sparse(self.serialize(), fields)
         item_list = {
             "id": self.id,
             "customer_id": self.customer_id,
+            "version": self.version,
             "items": []
         }
         for item in self.items:
             item_list['items'].append(item.serialize())
         return item_list
 
+    @classmethod
+    def row_query(cls, query, fields=None):
+        if fields is not None:
+            return super(ShopCart, cls).row_query(query, fields)
+        return query.with_entities(cls.id, cls.customer_id, cls.version)
+
+    @classmethod
+    def serialize_rows(cls, rows, fields=None):
+        """ Serializes ShopCart tuples and reads all of their items with one query
+
+        With a sparse fieldset the items are only read if it names them,
+        and then only the item columns it names
+        """
+        if fields is None:
+            return cls._serialize_all_rows(rows)
+        cart_fields, with_items, item_fields = cls.split_fields(fields)
+        columns = cls.field_columns(fields)
+        shopcarts = {}
+        for row in rows:
+            values = dict(zip(columns, row))
+            shopcarts[values["id"]] = {name: values[name] for name in cart_fields}
+            if with_items:
+                shopcarts[values["id"]]["items"] = []
+        if shopcarts and with_items:
+            items = CartItem.read_rows(
+                CartItem.query.filter(CartItem.shopcart_id.in_(list(shopcarts)))
+                .order_by(CartItem.id),
+                fields=item_fields
+            ).fetchall()
+            # the rows lead with the KEY_FIELDS id and shopcart_id
+            for row, item in zip(items, CartItem.serialize_rows(items, item_fields)):
+                shopcarts[row[1]]["items"].append(item)
+        return list(shopcarts.values())
+
+    @classmethod
+    def _serialize_all_rows(cls, rows):
+        shopcarts = {}
+        for shopcart_id, customer_id, version in rows:
+            shopcarts[shopcart_id] = {
+                "id": shopcart_id,
+                "customer_id": customer_id,
+                "version": version,
+                "items": []
+            }
+        if shopcarts:
+            items = CartItem.read_rows(
+                CartItem.query.filter(CartItem.shopcart_id.in_(list(shopcarts)))
+                .order_by(CartItem.id)
+            )
+            for item in CartItem.serialize_rows(items):
+                shopcarts[item["shopcart_id"]]["items"].append(item)
+        return list(shopcarts.values())
+
     def deserialize(self, data):
         """
         Deserializes a ShopCart from a dictionary
@@ -146,14 +1142,55 @@ class ShopCart(db.Model, PersistentBase):
         return self
 
     @classmethod
-    def find_by_item_name(cls, name):
-        """ Returns all ShopCarts with the given name
+    def insert_many(cls, shopcarts):
+        """ Inserts ShopCarts and then all of their items, one INSERT each """
+        # read the items while the carts are still transient so they never lazy load
+        cart_items = [(shopcart, list(shopcart.items)) for shopcart in shopcarts]
+        for shopcart in shopcarts:
+            shopcart.count_items()
+        super(ShopCart, cls).insert_many(shopcarts)
+        items = []
+        for shopcart, new_items in cart_items:
+            for item in new_items:
+                item.shopcart_id = shopcart.id
+                items.append(item)
+        CartItem.insert_many(items)
+
+    @classmethod
+    def find_by_customer(cls, customer_id, query=None):
+        """ Returns all ShopCarts that belong to a customer
 
         Args:
-            name (string): the name of the ShopCarts you want to match
+            customer_id (int): the id of the customer
+            query (Query): the query to filter, defaults to read_query()
+        """
+        logger.info("Processing customer query for %s ...", customer_id)
+        query = cls.read_query() if query is None else query
+        return query.filter(cls.customer_id == customer_id)
+
+    @classmethod
+    def find_by_item_name(cls, name, query=None):
+        """ Returns all ShopCarts holding an item with the given name
+
+        Args:
+            name (string): the name of the item you want to match
+            query (Query): the query to filter, defaults to read_query()
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.item_name == name)
+        query = cls.read_query() if query is None else query
+        return query.filter(cls.id.in_(CartItem.shopcart_ids(CartItem.item_name == name)))
+
+    @classmethod
+    def find_by_sku(cls, sku, query=None):
+        """ Returns all ShopCarts holding an item with the given sku
+
+        Args:
+            sku (string): the sku of the item you want to match
+            query (Query): the query to filter, defaults to read_query()
+        """
+        logger.info("Processing sku query for %s ...", sku)
+        query = cls.read_query() if query is None else query
+        return query.filter(cls.id.in_(CartItem.shopcart_ids(CartItem.sku == sku)))
 
 #############################################################
 # I T E M    M O D E L 
@@ -163,13 +1200,28 @@ class CartItem(db.Model, PersistentBase):
     """
     Class that represents an CartItem
     """
+    __table_args__ = (
+        # one line per SKU in a cart, the conflict target of increment();
+        # also serves lookups and cascades on shopcart_id alone
+        db.Index("uq_cart_item_shopcart_id_sku", "shopcart_id", "sku", unique=True),
+    )
+
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    shopcart_id = db.Column(db.Integer, db.ForeignKey('shopcart.id'), nullable=False)
-    item_name = db.Column(db.String(64)) 
-    sku = db.Column(db.String(16))
-    quantity = db.Column(db.Integer)
-    price = db.Column(db.Float)
+    # active_history loads the old value before a change, the totals need it
+    shopcart_id = db.column_property(db.Column(
+        db.Integer, db.ForeignKey('shopcart.id', ondelete='CASCADE'),
+        nullable=False
+    ), active_history=True)
+    item_name = db.Column(db.String(64), index=True)
+    sku = db.Column(db.String(16), index=True)
+    quantity = db.column_property(db.Column(db.Integer), active_history=True)
+    price = db.column_property(db.Column(db.Numeric(10, 2)), active_history=True)
+
+    PATCHABLE = {"item_name": str, "sku": str, "quantity": int, "price": (int, float)}
+    FIELDS = ("id", "shopcart_id", "item_name", "sku", "quantity", "price")
+    # shopcart_id too, so items read for several carts can be grouped
+    KEY_FIELDS = ("id", "shopcart_id")
 
     def __repr__(self):
         return "<Item %r id=[%s] ShopCart [%s]>" % (self.item_name, self.id, self.shopcart_id)
@@ -177,17 +1229,169 @@ class CartItem(db.Model, PersistentBase):
     def __str__(self):
         return "%s: %s,%s,%s " % (self.item_name, self.sku, self.quantity, self.price)
 
-    def serialize(self):
-        """ Serializes a Item into a dictionary """
+    @classmethod
+    def merge_duplicates(cls, index):
+        """ Merges the lines of a SKU in a cart into its first one
+
+        Tables from before uq_cart_item_shopcart_id_sku may hold several;
+        the first line keeps its price and gets the quantity of them all
+        """
+        if index.name != "uq_cart_item_shopcart_id_sku":
+            return
+        first = func.min(cls.id)
+        duplicates = db.session.query(
+            cls.shopcart_id, cls.sku, first, func.sum(cls.quantity)
+        ).filter(cls.sku.isnot(None)).group_by(cls.shopcart_id, cls.sku).having(
+            func.count(cls.id) > 1
+        ).all()
+        if not duplicates:
+            return
+        logger.warning("Merging %d SKUs with several lines in a cart", len(duplicates))
+        for shopcart_id, sku, first_id, quantity in duplicates:
+            cls.query.filter(cls.id == first_id).update(
+                {cls.quantity: quantity}, synchronize_session=False
+            )
+            cls.query.filter(
+                cls.shopcart_id == shopcart_id, cls.sku == sku, cls.id != first_id
+            ).delete(synchronize_session=False)
+        cart_ids = {shopcart_id for shopcart_id, _, _, _ in duplicates}
+        ShopCart.bump_version(cart_ids, recount=True)
+        db.session.commit()
+        invalidate(cart_ids)
+
+    @classmethod
+    def shopcart_ids(cls, *criterion):
+        """ Returns a subquery of the ids of the ShopCarts holding matching items
+
+        Used as "shopcart.id IN (SELECT shopcart_id ...)", which every database
+        plans as an index lookup on cart_item followed by primary key probes
+        """
+        return db.session.query(cls.shopcart_id).filter(*criterion).subquery()
+
+    @classmethod
+    def added_totals(cls, records):
+        """ Returns what new items add to the totals of their ShopCarts, by id """
+        deltas = {}
+        for item in records:
+            if item.shopcart_id is not None:
+                add_totals(deltas, item.shopcart_id, line_totals(item.quantity, item.price))
+        return deltas
+
+    @classmethod
+    def pending_totals(cls):
+        """ Returns what the items pending in the session change in the totals
+        of existing ShopCarts, by id
+
+        New ShopCarts have their totals set from their items instead
+        """
+        deltas = {}
+        for record in db.session.new:
+            if isinstance(record, ShopCart):
+                record.count_items()
+            elif isinstance(record, cls):
+                shopcart = record.shopcart
+                shopcart_id = record.shopcart_id if shopcart is None else shopcart.id
+                if shopcart_id is not None:
+                    add_totals(deltas, shopcart_id, line_totals(record.quantity, record.price))
+        for record in db.session.dirty:
+            if not isinstance(record, cls):
+                continue
+            before = [cls._committed(record, key) for key in ("shopcart_id", "quantity", "price")]
+            after = [record.shopcart_id, record.quantity, record.price]
+            if before != after:
+                add_totals(deltas, before[0], line_totals(before[1], before[2], -1))
+                add_totals(deltas, after[0], line_totals(after[1], after[2]))
+        for record in db.session.deleted:
+            if isinstance(record, cls):
+                add_totals(deltas, cls._committed(record, "shopcart_id"), line_totals(
+                    cls._committed(record, "quantity"), cls._committed(record, "price"), -1
+                ))
+        return deltas
+
+    @staticmethod
+    def _committed(record, key):
+        """ Returns the value of an attribute as it is in the database """
+        history = get_history(record, key)
+        if history.deleted:
+            return history.deleted[0]
+        if history.unchanged:
+            return history.unchanged[0]
+        return None
+
+    @classmethod
+    def delete_all(cls, *criterion):
+        """ Removes all matching items with a single DELETE statement
+
+        Their ShopCarts lose the totals of the rows the DELETE returns
+
+        Args:
+            criterion: SQL expressions to filter the items, all if omitted
+        Returns:
+            the number of items removed
+        """
+        logger.info("Deleting all %s records matching %s", cls.__name__, criterion)
+        table = cls.__table__
+        rows = cls.delete_returning(
+            and_(true(), *criterion), [table.c.shopcart_id, table.c.quantity, table.c.price]
+        )
+        deltas = {}
+        for shopcart_id, quantity, price in rows:
+            add_totals(deltas, shopcart_id, line_totals(quantity, price, -1))
+        cls.commit_carts(deltas, deltas)
+        return len(rows)
+
+    def changed_cart_ids(self):
+        """ Returns the ids of the ShopCarts this item is in or was moved from """
+        history = get_history(self, "shopcart_id")
+        return {
+            cart_id
+            for changes in history
+            for cart_id in changes or ()
+            if cart_id is not None
+        }
+
+    def serialize(self, fields=None):
+        """ Serializes a Item into a dictionary, or a sparse fieldset of it """
+        if fields is not None:
+            return self.sparse(self.serialize(), fields)
         return {
             "id": self.id,
             "shopcart_id": self.shopcart_id,
             "item_name": self.item_name,
             "sku":self.sku,
             "quantity":self.quantity,
-            "price":self.price
+            "price":float(self.price) if self.price is not None else None
         }
 
+    @classmethod
+    def row_query(cls, query, fields=None):
+        if fields is not None:
+            return super(CartItem, cls).row_query(query, fields)
+        return query.with_entities(
+            cls.id, cls.shopcart_id, cls.item_name, cls.sku, cls.quantity, cls.price
+        )
+
+    @classmethod
+    def serialize_rows(cls, rows, fields=None):
+        if fields is not None:
+            items = super(CartItem, cls).serialize_rows(rows, fields)
+            if "price" in fields:
+                for item in items:
+                    if item["price"] is not None:
+                        item["price"] = float(item["price"])
+            return items
+        return [
+            {
+                "id": id,
+                "shopcart_id": shopcart_id,
+                "item_name": item_name,
+                "sku": sku,
+                "quantity": quantity,
+                "price": float(price) if price is not None else None
+            }
+            for id, shopcart_id, item_name, sku, quantity, price in rows
+        ]
+
     def deserialize(self, data):
         """
         Deserializes a CartItem from a dictionary
@@ -207,4 +1411,276 @@ class CartItem(db.Model, PersistentBase):
             raise DataValidationError(
                 "Invalid Item: body of request contained" "bad or no data"
             )
-        return self
\ No newline at end of file
+        return self
+
+    @classmethod
+    def increment(cls, shopcart_id, sku, quantity, item_name=None, price=None):
+        """ Adds to the quantity of a SKU in a ShopCart with a single upsert
+
+        INSERT ... ON CONFLICT (shopcart_id, sku) DO UPDATE SET quantity =
+        quantity + :n, so concurrent increments never lose an update
+
+        Args:
+            shopcart_id (int): the id of the ShopCart
+            sku (string): the sku of the item
+            quantity (int): the number of units to add
+            item_name (string): the name, used only if the SKU is new to the cart
+            price (float): the price, used only if the SKU is new to the cart
+        Returns:
+            the CartItem as it is after the increment
+        """
+        logger.info("Incrementing sku %s in shopcart %s by %s", sku, shopcart_id, quantity)
+        table = cls.__table__
+        values = {
+            "shopcart_id": shopcart_id,
+            "item_name": item_name,
+            "sku": sku,
+            "quantity": quantity,
+            "price": price,
+        }
+        if db.engine.dialect.name == "postgresql":
+            statement = postgresql.insert(table).values(**values)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.shopcart_id, table.c.sku],
+                set_={"quantity": func.coalesce(table.c.quantity, 0) + statement.excluded.quantity},
+            ).returning(*table.c, literal_column("xmax = 0").label("inserted"))
+            existed = None
+        else:
+            # SQLAlchemy has no upsert construct for other dialects,
+            # SQLite 3.24+ takes the same statement as text
+            statement = text(
+                "INSERT INTO cart_item (shopcart_id, item_name, sku, quantity, price) "
+                "VALUES (:shopcart_id, :item_name, :sku, :quantity, :price) "
+                "ON CONFLICT (shopcart_id, sku) "
+                "DO UPDATE SET quantity = coalesce(cart_item.quantity, 0) + excluded.quantity"
+            )
+            # no RETURNING, so the line is read before it instead of after
+            existed = db.session.execute(
+                table.select().where(cls._sku_clause(shopcart_id, sku))
+            ).first()
+        try:
+            result = db.session.execute(statement, values)
+        except IntegrityError:
+            # the only constraint left to break is the foreign key
+            db.session.rollback()
+            abort(404, "ShopCart with id '{}' was not found.".format(shopcart_id))
+        if result.returns_rows:
+            row = dict(result.first())
+            inserted = row.pop("inserted")
+        elif existed is None:
+            row = dict(values, id=result.lastrowid)
+            inserted = True
+        else:
+            row = dict(existed, quantity=(existed.quantity or 0) + quantity)
+            inserted = False
+        delta = line_totals(quantity, row["price"])
+        if not inserted:
+            delta = (0,) + delta[1:]
+        cls.commit_carts([shopcart_id], {shopcart_id: delta})
+        return cls(**row)
+
+    @classmethod
+    def decrement(cls, shopcart_id, sku, quantity):
+        """ Takes units of a SKU out of a ShopCart with a single UPDATE
+
+        The line is removed once its quantity drops to zero
+
+        Args:
+            shopcart_id (int): the id of the ShopCart
+            sku (string): the sku of the item
+            quantity (int): the number of units to take out
+        Returns:
+            the CartItem as it is after the decrement, or None if it was removed
+        """
+        logger.info("Decrementing sku %s in shopcart %s by %s", sku, shopcart_id, quantity)
+        table = cls.__table__
+        match = cls._sku_clause(shopcart_id, sku)
+        row = cls.update_returning(match, {"quantity": table.c.quantity - quantity})
+        if row is None:
+            db.session.rollback()
+            abort(404, "Item with sku '{}' was not found in ShopCart '{}'.".format(sku, shopcart_id))
+        if row.quantity is None:
+            # NULL - n stays NULL, the totals did not count it before either
+            delta = (0, 0, 0)
+        elif row.quantity <= 0:
+            db.session.execute(table.delete().where(table.c.id == row.id))
+            delta = line_totals(row.quantity + quantity, row.price, -1)
+            row = None
+        else:
+            delta = (0,) + line_totals(quantity, row.price, -1)[1:]
+        cls.commit_carts([shopcart_id], {shopcart_id: delta})
+        return cls(**dict(row)) if row is not None else None
+
+    @classmethod
+    def merge(cls, target_id, source_id, policy="sum"):
+        """ Merges the items of one ShopCart into another and deletes it
+
+        Lines of a SKU in both carts get a quantity from the policy, the
+        other source lines are moved over, all with set-based statements
+        on cart_item. Both carts are locked first, lowest id first, so
+        concurrent merges cannot deadlock
+
+        Args:
+            target_id (int): the id of the ShopCart that keeps the items
+            source_id (int): the id of the ShopCart merged in and deleted
+            policy (string): one of MERGE_POLICIES, how the quantities of a
+                SKU in both carts combine
+        Returns:
+            the number of source lines moved to the target
+        """
+        logger.info("Merging shopcart %s into %s with policy %s", source_id, target_id, policy)
+        if policy not in MERGE_POLICIES:
+            raise DataValidationError(
+                "Invalid policy: must be one of " + ", ".join(MERGE_POLICIES)
+            )
+        if target_id == source_id:
+            raise DataValidationError("Invalid merge: a ShopCart cannot be merged into itself")
+        found = {
+            row[0] for row in db.session.query(ShopCart.id)
+            .filter(ShopCart.id.in_([target_id, source_id]))
+            .order_by(ShopCart.id).with_for_update()
+        }
+        for shopcart_id in (target_id, source_id):
+            if shopcart_id not in found:
+                abort(404, "ShopCart with id '{}' was not found.".format(shopcart_id))
+        table = cls.__table__
+        other = table.alias("other")
+
+        def same_sku(shopcart_id):
+            return and_(other.c.shopcart_id == shopcart_id, other.c.sku == table.c.sku)
+
+        if policy != "target":
+            source = db.select([other.c.quantity]).where(same_sku(source_id)).as_scalar()
+            quantity = {
+                "sum": table.c.quantity + source,
+                "max": case([(source > table.c.quantity, source)], else_=table.c.quantity),
+                "source": source,
+            }[policy]
+            db.session.execute(
+                table.update()
+                .where(and_(table.c.shopcart_id == target_id, exists().where(same_sku(source_id))))
+                .values(quantity=quantity)
+            )
+        moved = db.session.execute(
+            table.update()
+            .where(and_(table.c.shopcart_id == source_id, ~exists().where(same_sku(target_id))))
+            .values(shopcart_id=target_id)
+        ).rowcount
+        # the lines left behind go with the cart through ON DELETE CASCADE
+        ShopCart.query.filter(ShopCart.id == source_id).delete(synchronize_session=False)
+        # the UPDATEs above already visit every target line, so recounting
+        # them costs no more than working out the change
+        ShopCart.bump_version([target_id], recount=True)
+        commit()
+        invalidate([target_id, source_id])
+        return moved
+
+    @classmethod
+    def _sku_clause(cls, shopcart_id, sku):
+        """ Returns the SQL expression matching the line of a SKU in a ShopCart """
+        return and_(cls.__table__.c.shopcart_id == shopcart_id, cls.__table__.c.sku == sku)
+
+    @classmethod
+    def in_cart(cls, shopcart_id, item_id):
+        """ Returns a query for an item that only matches in its own ShopCart """
+        return cls.query.filter(cls.shopcart_id == shopcart_id, cls.id == item_id)
+
+    @classmethod
+    def find_in_cart_or_404(cls, shopcart_id, item_id):
+        """ Finds an item of a ShopCart by it's id with one query """
+        logger.info("Processing lookup or 404 for item %s in shopcart %s ...", item_id, shopcart_id)
+        item = cls.in_cart(shopcart_id, item_id).first()
+        if item is None:
+            cls._abort_not_in_cart(shopcart_id, item_id)
+        return item
+
+    @classmethod
+    def find_row_in_cart_or_404(cls, shopcart_id, item_id, fields=None):
+        """ Reads the plain row of an item and the version of its ShopCart with one query
+
+        Args:
+            shopcart_id (int): the id of the ShopCart
+            item_id (int): the id of the item
+            fields (list): a sparse fieldset, read only its columns
+        Returns:
+            the item row, as serialize_rows() takes it, and the ShopCart version
+        """
+        logger.info("Processing row lookup or 404 for item %s in shopcart %s ...", item_id, shopcart_id)
+        table = cls.__table__
+        if fields is None:
+            columns = list(table.c)
+        else:
+            columns = [table.c[name] for name in cls.field_columns(fields)]
+        row = db.session.execute(
+            db.select(columns + [ShopCart.__table__.c.version])
+            .select_from(table.join(ShopCart.__table__))
+            .where(and_(table.c.shopcart_id == shopcart_id, table.c.id == item_id))
+        ).first()
+        if row is None:
+            cls._abort_not_in_cart(shopcart_id, item_id)
+        return tuple(row)[:-1], row[-1]
+
+    @classmethod
+    def patch_in_cart(cls, shopcart_id, item_id, patch):
+        """ Applies a JSON Merge Patch to an item of a ShopCart with one UPDATE
+
+        Only the columns in the patch are set. The ShopCart version and
+        totals are bumped after it
+
+        Returns:
+            the updated item row, as serialize_rows() takes it
+        """
+        logger.info("Patching item %s in shopcart %s with %s", item_id, shopcart_id, patch)
+        table = cls.__table__
+        values = cls.patch_values(patch)
+        match = and_(table.c.shopcart_id == shopcart_id, table.c.id == item_id)
+        before = None
+        if "quantity" in values or "price" in values:
+            # the totals move by the difference to the line as it was
+            row, before = cls.update_changes(match, values, [table.c.quantity, table.c.price])
+        elif values:
+            row = cls.update_returning(match, values)
+        else:
+            row = db.session.execute(table.select().where(match)).first()
+        if row is None:
+            cls._abort_not_in_cart(shopcart_id, item_id)
+        row = tuple(row)
+        if values:
+            deltas = {}
+            if before is not None:
+                after = dict(zip(table.c.keys(), row))
+                add_totals(deltas, shopcart_id, line_totals(*before, -1))
+                add_totals(deltas, shopcart_id, line_totals(after["quantity"], after["price"]))
+            cls.commit_carts([shopcart_id], deltas)
+        return row
+
+    @classmethod
+    def delete_in_cart(cls, shopcart_id, item_id):
+        """ Removes an item of a ShopCart with one DELETE, if it is there
+
+        Returns:
+            the number of items removed, 0 or 1
+        """
+        logger.info("Deleting item %s in shopcart %s", item_id, shopcart_id)
+        table = cls.__table__
+        rows = cls.delete_returning(
+            and_(table.c.shopcart_id == shopcart_id, table.c.id == item_id),
+            [table.c.quantity, table.c.price],
+        )
+        if rows:
+            cls.commit_carts([shopcart_id], {shopcart_id: line_totals(*rows[0], -1)})
+        return len(rows)
+
+    @staticmethod
+    def _abort_not_in_cart(shopcart_id, item_id):
+        abort(404, "Item with id '{}' was not found in ShopCart '{}'.".format(item_id, shopcart_id))
+
+    @classmethod
+    def find_by_shopcart(cls, shopcart_id):
+        """ Returns all of the CartItems in a ShopCart
+
+        Args:
+            shopcart_id (int): the id of the ShopCart the items belong to
+        """
+        logger.info("Processing items query for shopcart %s ...", shopcart_id)
+        return cls.query.filter(cls.shopcart_id == shopcart_id)
\ No newline at end of file
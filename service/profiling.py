@@ -0,0 +1,150 @@
+"""
+Per-request profiling for the ShopCarts service
+
+With PROFILING_ENABLED set, a request is profiled when it sends the
+PROFILE_HEADER header or is picked by PROFILE_SAMPLE_RATE. Its cProfile
+call tree and the SQL it ran (as timed by RequestMetrics) go into a ring
+buffer of the last PROFILE_BUFFER_SIZE profiles for /admin/profiles, and
+the response carries X-Profile-Id. Other requests only pay for a random()
+call and a header lookup.
+
+The buffer belongs to the worker process that served the request.
+"""
+import time
+import random
+import pstats
+import cProfile
+import itertools
+import threading
+from collections import deque
+from flask import g, request
+
+
+class Profiler():
+    """ Profiles chosen requests and keeps the last few profiles """
+
+    # call tree nodes under this share of the request time are left out
+    MIN_SHARE = 0.01
+    MAX_DEPTH = 40
+
+    def __init__(self, size=20):
+        self.enabled = False
+        self.header = "X-Profile"
+        self.sample_rate = 0.0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._profiles = deque(maxlen=size)
+
+    def init_app(self, app):
+        """ Profiles the requests of a Flask app as configured """
+        self.enabled = app.config.get("PROFILING_ENABLED", False)
+        self.header = app.config.get("PROFILE_HEADER", "X-Profile")
+        self.sample_rate = app.config.get("PROFILE_SAMPLE_RATE", 0.0)
+        size = app.config.get("PROFILE_BUFFER_SIZE", 20)
+        if size != self._profiles.maxlen:
+            self._profiles = deque(self._profiles, maxlen=size)
+        if not getattr(app, "_profiler", False):
+            app._profiler = True
+            app.before_request(self.before_request)
+            app.after_request(self.after_request)
+
+    def wants_profile(self):
+        """ Checks if the current request should be profiled """
+        if not self.enabled:
+            return False
+        if request.headers.get(self.header):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def before_request(self):
+        g.profile = None
+        if self.wants_profile():
+            g.profile = cProfile.Profile()
+            g.profile_started = time.perf_counter()
+            g.profile.enable()
+
+    def after_request(self, response):
+        profile = g.get("profile")
+        if profile is None:
+            return response
+        profile.disable()
+        g.profile = None
+        seconds = time.perf_counter() - g.profile_started
+        record = {
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "status": response.status_code,
+            "started": time.time() - seconds,
+            "duration_ms": round(seconds * 1000, 3),
+            "db_queries": g.get("db_queries", 0),
+            "db_ms": round(g.get("db_seconds", 0.0) * 1000, 3),
+            "sql": [
+                {"ms": round(statement_seconds * 1000, 3), "statement": statement}
+                for statement_seconds, statement in g.get("db_statements", [])
+            ],
+            "calls": call_tree(pstats.Stats(profile), seconds, self.MIN_SHARE, self.MAX_DEPTH),
+        }
+        with self._lock:
+            record["id"] = next(self._ids)
+            self._profiles.append(record)
+        response.headers["X-Profile-Id"] = str(record["id"])
+        return response
+
+    def profiles(self):
+        """ Returns a summary of the buffered profiles, newest first """
+        with self._lock:
+            profiles = list(self._profiles)
+        return [
+            {key: value for key, value in profile.items() if key not in ("sql", "calls")}
+            for profile in reversed(profiles)
+        ]
+
+    def find(self, profile_id):
+        """ Returns a buffered profile by its id or None """
+        with self._lock:
+            for profile in self._profiles:
+                if profile["id"] == profile_id:
+                    return profile
+        return None
+
+
+def call_tree(stats, total_seconds, min_share=0.01, max_depth=40):
+    """
+    Builds a call tree from the caller/callee edges of profile stats
+    Each node has the function, calls, cumulative and own milliseconds
+    """
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge))
+    roots = [
+        (function, (cc, nc, tt, ct))
+        for function, (cc, nc, tt, ct, callers) in stats.stats.items()
+        if not callers
+    ]
+    threshold = total_seconds * min_share
+
+    def node(function, edge, path):
+        _, calls, own, cumulative = edge
+        children = []
+        if len(path) < max_depth:
+            for callee, callee_edge in sorted(callees.get(function, []), key=lambda c: -c[1][3]):
+                if callee_edge[3] >= threshold and callee not in path:
+                    children.append(node(callee, callee_edge, path | {callee}))
+        return {
+            "function": pstats.func_std_string(function),
+            "calls": calls,
+            "cumulative_ms": round(cumulative * 1000, 3),
+            "own_ms": round(own * 1000, 3),
+            "children": children,
+        }
+
+    roots.sort(key=lambda root: -root[1][3])
+    return [
+        node(function, edge, {function})
+        for function, edge in roots
+        if edge[3] >= threshold
+    ]
+
+
+profiler = Profiler()
@@ -0,0 +1,121 @@
+"""
+Reaper of abandoned ShopCarts
+
+Deletes the carts that have not changed for CART_TTL_HOURS, in batches of
+REAPER_BATCH_SIZE carts, each in its own short transaction with a
+REAPER_PAUSE sleep in between, so it can run next to the peak traffic.
+
+Run it once, e.g. from cron or a Cloud Foundry task:
+  FLASK_APP=service:app flask reap-carts --ttl-hours 72
+
+or set REAPER_INTERVAL to have every worker run it in a background thread
+that many seconds apart. Postgres hands each batch only carts nobody else
+has locked, so workers reaping at the same time split the work.
+"""
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+import click
+from service.models import db, ShopCart
+
+logger = logging.getLogger(__name__)
+
+
+class Reaper():
+    """ Deletes idle ShopCarts in bounded batches """
+
+    def __init__(self):
+        self.app = None
+        self.ttl = timedelta(hours=168)
+        self.batch_size = 500
+        self.pause = 0.05
+        self.interval = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        """ Reaps the carts of a Flask app as configured and adds its command """
+        self.app = app
+        self.ttl = timedelta(hours=app.config.get("CART_TTL_HOURS", 168))
+        self.batch_size = app.config.get("REAPER_BATCH_SIZE", 500)
+        self.pause = app.config.get("REAPER_PAUSE", 0.05)
+        self.interval = app.config.get("REAPER_INTERVAL", 0)
+        if not getattr(app, "_reaper", False):
+            app._reaper = True
+            app.cli.add_command(reap_carts_command)
+            app.before_request(self.start)
+
+    def run(self, ttl=None, batch_size=None, limit=None, progress=None):
+        """ Deletes the idle carts batch by batch until none are left
+
+        Args:
+            ttl (timedelta): how long a cart may sit unchanged, CART_TTL_HOURS by default
+            batch_size (int): the most carts deleted per transaction
+            limit (int): stop after deleting about this many carts
+            progress (callable): called with (batch, total) after every batch
+        Returns:
+            the number of carts deleted
+        """
+        ttl = self.ttl if ttl is None else ttl
+        batch_size = batch_size or self.batch_size
+        # fixed up front, so carts going idle during the run wait for the next one
+        cutoff = datetime.utcnow() - ttl
+        logger.info("Reaping carts idle since %s in batches of %d", cutoff, batch_size)
+        total = 0
+        while limit is None or total < limit:
+            if limit is not None:
+                batch_size = min(batch_size, limit - total)
+            batch = len(ShopCart.reap_idle(cutoff, batch_size))
+            total += batch
+            if progress is not None:
+                progress(batch, total)
+            if batch < batch_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        logger.info("Reaped %d carts idle since %s", total, cutoff)
+        return total
+
+    def start(self):
+        """ Starts the background thread of this worker if REAPER_INTERVAL is set """
+        if not self.interval or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                # started by the first request, so it runs in the worker, not the master
+                self._thread = threading.Thread(
+                    target=self._reap_loop, name="cart-reaper", daemon=True
+                )
+                self._thread.start()
+
+    def _reap_loop(self):
+        """ Reaps every REAPER_INTERVAL seconds, on an app context of its own """
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                try:
+                    self.run()
+                except Exception:  # keep reaping after a failed run
+                    logger.exception("Cart reaper failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+@click.command("reap-carts")
+@click.option("--ttl-hours", type=float, help="Idle time before a cart is deleted")
+@click.option("--batch-size", type=int, help="Carts deleted per transaction")
+@click.option("--limit", type=int, help="Stop after deleting this many carts")
+def reap_carts_command(ttl_hours, batch_size, limit):
+    """ Deletes the ShopCarts that have not changed for a while """
+
+    def progress(batch, total):
+        click.echo("deleted {} carts, {} so far".format(batch, total))
+
+    ttl = timedelta(hours=ttl_hours) if ttl_hours is not None else None
+    total = reaper.run(ttl, batch_size, limit, progress)
+    click.echo("deleted {} idle carts".format(total))
+
+
+reaper = Reaper()
@@ -11,18 +11,36 @@ DELETE /shopcarts/{id}/items/{id}
 
 import os
 import sys
+import time
 import logging
-from flask import Flask, jsonify, request, url_for, make_response, abort
+from itertools import islice
+from flask import Flask, Response, json, jsonify, request, url_for, make_response, abort
+from flask import stream_with_context
 from flask_api import status  # HTTP Status Codes
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
 from flask_sqlalchemy import SQLAlchemy
-from service.models import ShopCart, CartItem, DataValidationError
+from sqlalchemy.exc import IntegrityError
+from service.models import db, ShopCart, CartItem, DataValidationError, UnitOfWork
+from service.metrics import CONTENT_TYPE, pool_metrics, request_metrics
+from service.encoders import make_json_encoder, pack_msgpack, unpack_msgpack
+from service.encoders import MSGPACK, MSGPACK_TYPES
+from service.profiling import profiler
+from service.compression import compressor, strip_encoding
+from service.snapshot import snapshot, MEDIA_TYPES
+from service.logs import log_payload
 
 # Import Flask application
 from . import app
 
+# media type of the JSON Merge Patch bodies the PATCH routes take
+MERGE_PATCH = "application/merge-patch+json"
+# the media types of request and response bodies, JSON first as the default
+PAYLOAD_TYPES = ("application/json",) + MSGPACK_TYPES
+# appended to the ETags of MessagePack bodies, before any content coding
+MSGPACK_SUFFIX = "msgpack"
+
 ######################################################################
 # Error Handlers
 ######################################################################
@@ -38,7 +56,7 @@ def bad_request(error):
     message = str(error)
     app.logger.warning(message)
     return (
-        jsonify(
+        encode_body(
             status=status.HTTP_400_BAD_REQUEST, error="Bad Request", message=message
         ),
         status.HTTP_400_BAD_REQUEST,
@@ -51,7 +69,7 @@ def not_found(error):
     message = str(error)
     app.logger.warning(message)
     return (
-        jsonify(status=status.HTTP_404_NOT_FOUND, error="Not Found", message=message),
+        encode_body(status=status.HTTP_404_NOT_FOUND, error="Not Found", message=message),
         status.HTTP_404_NOT_FOUND,
     )
 
@@ -62,7 +80,7 @@ def method_not_supported(error):
     message = str(error)
     app.logger.warning(message)
     return (
-        jsonify(
+        encode_body(
             status=status.HTTP_405_METHOD_NOT_ALLOWED,
             error="Method not Allowed",
             message=message,
@@ -71,13 +89,50 @@ def method_not_supported(error):
     )
 
 
+@app.errorhandler(IntegrityError)
+def integrity_error(error):
+    """ Handles writes that break a database constraint
+
+    The database's own message names tables and values, so it is only logged
+    """
+    db.session.rollback()
+    app.logger.warning("Constraint violated: %s", error.orig)
+    return conflict("The request conflicts with existing data")
+
+
+@app.errorhandler(status.HTTP_409_CONFLICT)
+def conflict(error):
+    """ Handles conflicts with existing data with 409_CONFLICT """
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        encode_body(status=status.HTTP_409_CONFLICT, error="Conflict", message=message),
+        status.HTTP_409_CONFLICT,
+    )
+
+
+@app.errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """ Handles stale If-Match versions with 412_PRECONDITION_FAILED """
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        encode_body(
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            error="Precondition Failed",
+            message=message,
+        ),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
 @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """ Handles unsuppoted media requests with 415_UNSUPPORTED_MEDIA_TYPE """
     message = str(error)
     app.logger.warning(message)
     return (
-        jsonify(
+        encode_body(
             status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
             error="Unsupported media type",
             message=message,
@@ -92,7 +147,7 @@ def internal_server_error(error):
     message = str(error)
     app.logger.error(message)
     return (
-        jsonify(
+        encode_body(
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             error="Internal Server Error",
             message=message,
@@ -123,17 +178,37 @@ def create_shopcarts():
     This endpoint will create a Shopcart based the data in the body that is posted
     """
     app.logger.info("Request to create a ShopCart")
-    app.logger.info(request.get_json())
-    check_content_type("application/json")
+    check_content_type()
+    data = get_payload()
+    log_payload(app.logger, "ShopCart payload", data)
     shopcart = ShopCart()
-    shopcart.deserialize(request.get_json())
+    shopcart.deserialize(data)
     shopcart.create()
     message = shopcart.serialize()
     location_url = url_for("get_shopcarts", shopcart_id=shopcart.id, _external=True)
     return make_response(
-        jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
+        encode_body(message), status.HTTP_201_CREATED, {"Location": location_url}
     ) 
 
+######################################################################
+# CREATE SHOPCARTS IN BULK
+######################################################################
+@app.route("/shopcarts:batch", methods=["POST"])
+def create_shopcarts_batch():
+    """
+    Creates many shopping carts
+    This endpoint takes an array of ShopCarts (with nested items) and creates
+    them all in one transaction, or none of them if any are invalid
+    """
+    app.logger.info("Request to create a batch of ShopCarts")
+    check_content_type()
+    shopcarts, errors = deserialize_batch(ShopCart)
+    if errors:
+        return batch_error_response(errors)
+    ShopCart.bulk_create(shopcarts)
+    results = [shopcart.serialize() for shopcart in shopcarts]
+    return make_response(encode_body(results), status.HTTP_201_CREATED)
+
 ######################################################################
 # RETRIEVE A SHOPCART - Robert UNG
 ######################################################################
@@ -142,12 +217,46 @@ def get_shopcarts(shopcart_id):
     """
     Retrieve a single ShopCart
     This endpoint will return an ShopCart based on its id
+    ?fields=id,items.sku,items.quantity returns only those fields
     """
     app.logger.info("Request for ShopCart with id: %s", shopcart_id)
-    shopcart = ShopCart.find_or_404(shopcart_id)
-    return make_response(jsonify(shopcart.serialize()), status.HTTP_200_OK)
+    resp = check_if_none_match(shopcart_id)
+    if resp:
+        return resp
+    fields = get_fields()
+    if fields is not None:
+        version, shopcart = ShopCart.find_sparse_or_404(shopcart_id, fields)
+    else:
+        shopcart = ShopCart.find_serialized_or_404(shopcart_id)
+        version = shopcart["version"]
+    etag = cart_etag(shopcart_id, version)
+    return with_etag(make_response(encode_body(shopcart), status.HTTP_200_OK), etag)
 
 
+######################################################################
+# RETRIEVE THE TOTALS OF A SHOPCART
+######################################################################
+@app.route("/shopcarts/<int:shopcart_id>/summary", methods=["GET"])
+def get_shopcart_summary(shopcart_id):
+    """
+    Retrieve the totals of a ShopCart
+    Returns the item count, unit count and subtotal kept on the ShopCart row,
+    so the items are never read
+    """
+    app.logger.info("Request for the summary of shopcart with id: %s", shopcart_id)
+    resp = check_if_none_match(shopcart_id)
+    if resp:
+        return resp
+    summary = ShopCart.find_summary_or_404(shopcart_id)
+    message = {
+        "shopcart_id": shopcart_id,
+        "item_count": summary.item_count,
+        "unit_count": summary.unit_count,
+        "subtotal": float(summary.subtotal),
+    }
+    etag = cart_etag(shopcart_id, summary.version)
+    return with_etag(make_response(encode_body(message), status.HTTP_200_OK), etag)
+
 ######################################################################
 # UPDATE AN EXISTING SHOPCART - Neil Vijapura
 ######################################################################
@@ -158,14 +267,37 @@ def update_shopcarts(shopcart_id):
     This endpoint will update an shopcart based the body that is posted
     """
     app.logger.info("Request to update shopcart with id: %s", shopcart_id)
-    check_content_type("application/json")
-    shopcart = ShopCart.find(shopcart_id)
-    if not shopcart:
-        raise NotFound("ShopCart with id '{}' was not found.".format(shopcart_id))
-    shopcart.deserialize(request.get_json())
+    check_content_type()
+    check_if_match(shopcart_id)
+    data = get_payload()
+    shopcart = ShopCart.read_query("lazy").get_or_404(shopcart_id)
+    if isinstance(data, dict) and "items" in data:
+        # the items in the body replace the ones in the cart
+        shopcart.clear_items()
+    shopcart.deserialize(data)
     shopcart.id = shopcart_id
     shopcart.save()
-    return make_response(jsonify(shopcart.serialize()), status.HTTP_200_OK)
+    message = shopcart.serialize()
+    etag = cart_etag(shopcart_id, message["version"])
+    return with_etag(make_response(encode_body(message), status.HTTP_200_OK), etag)
+
+######################################################################
+# PATCH AN EXISTING SHOPCART
+######################################################################
+@app.route("/shopcarts/<int:shopcart_id>", methods=["PATCH"])
+def patch_shopcarts(shopcart_id):
+    """
+    Partially update a shopcart
+    Takes a JSON Merge Patch (RFC 7386) of customer_id and applies it with a
+    single UPDATE. The items are changed through their own routes
+    """
+    app.logger.info("Request to patch shopcart with id: %s", shopcart_id)
+    check_content_type(MERGE_PATCH, *PAYLOAD_TYPES)
+    check_if_match(shopcart_id)
+    row = ShopCart.patch(shopcart_id, get_payload())
+    message = ShopCart.serialize_rows([row])[0]
+    etag = cart_etag(shopcart_id, message["version"])
+    return with_etag(make_response(encode_body(message), status.HTTP_200_OK), etag)
 
 ######################################################################
 # DELETE A SHOPCART - Robert Ung
@@ -187,34 +319,127 @@ def delete_shopcarts(shopcart_id):
 ######################################################################
 @app.route("/shopcarts", methods=["GET"])
 def list_shopcarts():
-    """ Returns IDs of the ShopCarts """
+    """
+    Returns a page of ShopCarts
+    Filters by ?customer_id=, ?sku= or ?item_name= using indexed lookups
+    Supports ?limit=&after_id= keyset pagination, ?stream=true and ?fields=
+    """
     app.logger.info("Request for ShopCart list")
-    shopcarts = []
+    after_id, limit = get_page_args()
+    query = ShopCart.read_query("lazy")
     id = request.args.get("id")
     if id:
-        shopcarts = ShopCart.find(id)
-    else:
-        shopcarts = ShopCart.all()
-
-    results = [shopcart.serialize() for shopcart in shopcarts]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+        query = query.filter(ShopCart.id == id)
+    customer_id = request.args.get("customer_id")
+    if customer_id:
+        if not customer_id.isdigit():
+            abort(400, "customer_id must be an integer")
+        query = ShopCart.find_by_customer(int(customer_id), query)
+    sku = request.args.get("sku")
+    if sku:
+        query = ShopCart.find_by_sku(sku, query)
+    item_name = request.args.get("item_name")
+    if item_name:
+        query = ShopCart.find_by_item_name(item_name, query)
+    query = ShopCart.keyset_page(after_id, limit, query)
+    return make_page_response(query, limit, "list_shopcarts")
 
 ######################################################################
 # DELETE ALL ShopCarts
 ######################################################################
 @app.route("/shopcarts/clear", methods=["GET"])
 def delete_all_shopcarts():
-    """ Returns IDs of the ShopCarts """
-    app.logger.info("Request for ShopCart list")
-    shopcarts = []
+    """
+    Delete all ShopCarts
+    Removes every ShopCart (or only ?id=) and their items in one statement
+    """
+    app.logger.info("Request to delete all ShopCarts")
+    criterion = []
     id = request.args.get("id")
     if id:
-        shopcarts = ShopCart.find(id)
-    else:
-        shopcarts = ShopCart.all()
+        criterion.append(ShopCart.id == id)
+    count = ShopCart.delete_all(*criterion)
+    return make_response("", status.HTTP_204_NO_CONTENT, {"X-Deleted-Count": str(count)})
 
-    results = [shopcart.delete() for shopcart in shopcarts]
-    return make_response("", status.HTTP_204_NO_CONTENT)
+######################################################################
+# CART CACHE STATISTICS
+######################################################################
+@app.route("/admin/cache", methods=["GET"])
+def get_cache_stats():
+    """ Returns the hit, miss and eviction counters of the cart cache """
+    app.logger.info("Request for cart cache statistics")
+    return make_response(encode_body(ShopCart.cache.stats()), status.HTTP_200_OK)
+
+######################################################################
+# REQUEST PROFILES
+######################################################################
+@app.route("/admin/profiles", methods=["GET"])
+def list_profiles():
+    """ Returns a summary of the last profiled requests, newest first """
+    app.logger.info("Request for the list of profiles")
+    if not profiler.enabled:
+        abort(404, "Profiling is not enabled.")
+    return make_response(encode_body(profiler.profiles()), status.HTTP_200_OK)
+
+@app.route("/admin/profiles/<int:profile_id>", methods=["GET"])
+def get_profiles(profile_id):
+    """ Returns the call tree and SQL of a profiled request """
+    app.logger.info("Request for profile with id: %s", profile_id)
+    profile = profiler.find(profile_id) if profiler.enabled else None
+    if profile is None:
+        abort(404, "Profile with id '{}' was not found.".format(profile_id))
+    return make_response(encode_body(profile), status.HTTP_200_OK)
+
+######################################################################
+# SNAPSHOTS
+######################################################################
+@app.route("/admin/snapshot", methods=["GET"])
+def export_snapshot():
+    """
+    Streams every ShopCart and CartItem row out
+    Takes ?format=ndjson (default) or csv, and ?table= for a single table,
+    which CSV needs
+    """
+    fmt = request.args.get("format", "ndjson")
+    table = request.args.get("table")
+    app.logger.info("Request to export a %s snapshot of %s", fmt, table or "all carts")
+    snapshot.tables(fmt, table)
+    name = "{}.{}".format(table or "shopcarts", fmt)
+    return Response(
+        stream_with_context(snapshot.dump(fmt, table)),
+        mimetype=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": "attachment; filename=" + name},
+    )
+
+@app.route("/admin/snapshot", methods=["POST"])
+def import_snapshot():
+    """
+    Loads a snapshot made by GET /admin/snapshot
+    The body is NDJSON, or CSV with ?table=, all of it loaded in one
+    transaction. Returns the rows loaded per table and the rows per second
+    """
+    check_content_type(*MEDIA_TYPES.values())
+    fmt = "csv" if request.mimetype == MEDIA_TYPES["csv"] else "ndjson"
+    table = request.args.get("table")
+    app.logger.info("Request to import a %s snapshot of %s", fmt, table or "all carts")
+    start = time.perf_counter()
+    counts = snapshot.load(request.stream, fmt, table)
+    seconds = time.perf_counter() - start
+    message = {
+        "rows": counts,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(sum(counts.values()) / seconds, 1) if seconds else None,
+    }
+    return make_response(encode_body(message), status.HTTP_200_OK)
+
+######################################################################
+# METRICS
+######################################################################
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """ Returns the service metrics in the Prometheus text format """
+    text = pool_metrics.render() + request_metrics.render()
+    return make_response(text, status.HTTP_200_OK, {"Content-Type": CONTENT_TYPE})
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
@@ -223,14 +448,227 @@ def delete_all_shopcarts():
 def init_db():
     """ Initialies the SQLAlchemy app """
     global app
+    app.json_encoder = make_json_encoder(app.config)
     ShopCart.init_db(app)
+    request_metrics.init_app(app, db.engine)
+    compressor.init_app(app)
+    # registered last so its commit runs first and is part of the timings
+    UnitOfWork.init_app(app)
+
+def get_page_args():
+    """ Returns the (after_id, limit) keyset pagination arguments """
+    try:
+        after_id = request.args.get("after_id")
+        after_id = int(after_id) if after_id is not None else None
+        limit = request.args.get("limit")
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        abort(400, "limit and after_id must be integers")
+    if limit is not None and limit < 1:
+        abort(400, "limit must be greater than 0")
+    return after_id, limit
+
+def get_fields():
+    """ Returns the ?fields= sparse fieldset as a list of names, or None for all """
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+    return [name.strip() for name in fields.split(",") if name.strip()]
+
+def wants_stream():
+    """ Checks if the client asked for a streamed response """
+    return request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+def make_page_response(query, limit, endpoint, **values):
+    """
+    Makes an array response from a page query
+    The rows are read with Core and serialized without building ORM objects,
+    only with the columns of a ?fields= sparse fieldset if there is one.
+    MessagePack pages are never streamed, their array header needs the length.
+    Adds Link and X-Next-Cursor headers when there may be another page
+    """
+    headers = {}
+    model = query.column_descriptions[0]["entity"]
+    fields = get_fields()
+    if fields is not None:
+        values["fields"] = request.args["fields"]
+    if wants_stream() and not wants_msgpack():
+        next_cursor = None
+        if limit is not None:
+            # the id of the last row in the page, found without loading the rows
+            next_cursor = query.with_entities(model.id).offset(limit - 1).limit(1).scalar()
+        body = stream_json_array(model, model.read_rows(query, stream=True, fields=fields), fields)
+    else:
+        rows = model.read_rows(query, fields=fields).fetchall()
+        # the id is the first column, fieldset or not
+        next_cursor = rows[-1][0] if limit is not None and len(rows) == limit else None
+        body = encode_body(model.serialize_rows(rows, fields))
+    if next_cursor is not None:
+        next_url = url_for(
+            endpoint, after_id=next_cursor, limit=limit, _external=True, **values
+        )
+        headers["Link"] = '<{}>; rel="next"'.format(next_url)
+        headers["X-Next-Cursor"] = str(next_cursor)
+    return make_response(body, status.HTTP_200_OK, headers)
+
+def stream_json_array(model, rows, fields=None):
+    """ Streams rows as a JSON array, serializing one batch at a time """
+    def generate():
+        yield "["
+        separator = ""
+        records = iter(rows)
+        while True:
+            batch = list(islice(records, app.config["STREAM_BATCH_SIZE"]))
+            if not batch:
+                break
+            for record in model.serialize_rows(batch, fields):
+                yield separator + json.dumps(record)
+                separator = ","
+        yield "]"
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+def wants_msgpack():
+    """ Checks if the client prefers a MessagePack response to a JSON one """
+    return bool(MSGPACK_TYPES) and request.accept_mimetypes.best_match(PAYLOAD_TYPES) == MSGPACK
+
+def encode_body(*args, **kwargs):
+    """
+    Makes a response body like jsonify() does, in the format the Accept
+    header prefers: MessagePack or, by default, JSON
+    """
+    if wants_msgpack():
+        data = args[0] if len(args) == 1 else list(args) or kwargs
+        response = Response(pack_msgpack(data), mimetype=MSGPACK)
+    else:
+        response = jsonify(*args, **kwargs)
+    if MSGPACK_TYPES:
+        response.vary.add("Accept")
+    return response
+
+def get_payload():
+    """ Returns the request body decoded from JSON or MessagePack """
+    if request.mimetype == MSGPACK and MSGPACK_TYPES:
+        try:
+            return unpack_msgpack(request.get_data())
+        except ValueError:
+            raise DataValidationError("Invalid body: not valid MessagePack")
+    return request.get_json()
+
+def deserialize_batch(model):
+    """
+    Deserializes every element of an array body in one pass
+    Returns the new records and a list of per-element errors
+    """
+    data = get_payload()
+    if not isinstance(data, list):
+        raise DataValidationError("Invalid batch: body of request must be a list")
+    if len(data) > app.config["MAX_BATCH_SIZE"]:
+        raise DataValidationError(
+            "Invalid batch: at most {} elements allowed".format(app.config["MAX_BATCH_SIZE"])
+        )
+    records = []
+    errors = []
+    for index, element in enumerate(data):
+        try:
+            records.append(model().deserialize(element))
+        except DataValidationError as error:
+            errors.append({"index": index, "message": str(error)})
+    return records, errors
+
+def batch_error_response(errors):
+    """ Makes a 400_BAD_REQUEST response listing the invalid batch elements """
+    message = "{} invalid element(s) in batch".format(len(errors))
+    app.logger.warning(message)
+    return make_response(
+        encode_body(
+            status=status.HTTP_400_BAD_REQUEST,
+            error="Bad Request",
+            message=message,
+            errors=errors,
+        ),
+        status.HTTP_400_BAD_REQUEST,
+    )
 
-def check_content_type(content_type):
-    """ Checks that the media type is correct """
-    if request.headers["Content-Type"] == content_type:
+def cart_etag(shopcart_id, version):
+    """ Makes the entity tag of a ShopCart, or anything in it, at a version """
+    return "{}-{}".format(shopcart_id, version)
+
+def with_etag(response, etag, weak=False):
+    """ Adds an ETag header to a response, tagged with the format of its body """
+    if response.mimetype == MSGPACK:
+        etag = format_etag(etag)
+    response.set_etag(etag, weak)
+    return response
+
+def format_etag(etag):
+    """ Returns the ETag of the MessagePack representation, it differs from JSON's """
+    return etag + "-" + MSGPACK_SUFFIX
+
+def strip_etag(etag):
+    """ Returns the cart ETag in a representation's, without its content coding or format """
+    etag = strip_encoding(etag)
+    if etag.endswith("-" + MSGPACK_SUFFIX):
+        return etag[:-len(MSGPACK_SUFFIX) - 1]
+    return etag
+
+def check_if_none_match(shopcart_id):
+    """
+    Checks an If-None-Match header against the version of a ShopCart
+    Returns a 304_NOT_MODIFIED response if it still matches, without loading
+    or serializing the items, otherwise None. The 304 carries the tag that
+    matched, content coding and all, as the 200 would have
+    """
+    if not request.if_none_match:
+        return None
+    etag = cart_etag(shopcart_id, ShopCart.find_version_or_404(shopcart_id))
+    if wants_msgpack():
+        # a JSON body's ETag does not validate a MessagePack one
+        etag = format_etag(etag)
+    not_modified = make_response("", status.HTTP_304_NOT_MODIFIED)
+    for tag in request.if_none_match.as_set(include_weak=True):
+        if strip_encoding(tag) == etag:
+            return with_etag(not_modified, tag, request.if_none_match.is_weak(tag))
+    if request.if_none_match.star_tag:
+        return with_etag(not_modified, etag)
+    return None
+
+def check_if_match(shopcart_id):
+    """
+    Checks an If-Match header against the version of a ShopCart
+    The version is claimed with a conditional UPDATE, so only one of several
+    concurrent writers holding the same ETag can succeed
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return
+    for etag in request.if_match.as_set():
+        cart_id, _, version = strip_etag(etag).partition("-")
+        if cart_id == str(shopcart_id) and version.isdigit():
+            if ShopCart.claim_version(shopcart_id, int(version)):
+                return
+    abort(412, "ShopCart with id '{}' has been modified".format(shopcart_id))
+
+def get_quantity_args():
+    """ Returns the optional body of an increment with a valid quantity, item_name and price """
+    data = {}
+    if request.data:
+        check_content_type()
+        data = get_payload()
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid quantity: body of request must be an object")
+    quantity = data.setdefault("quantity", 1)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        raise DataValidationError("Invalid quantity: must be a positive integer")
+    # the same type rules as a PATCH of the item
+    CartItem.patch_values({key: data[key] for key in ("item_name", "price") if key in data})
+    return data
+
+def check_content_type(*content_types):
+    """ Checks that the media type is one of the given ones, PAYLOAD_TYPES by default """
+    content_types = content_types or PAYLOAD_TYPES
+    if request.mimetype in content_types:
         return
-    app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
-    abort(415, "Content-Type must be {}".format(content_type))
+    app.logger.error("Invalid Content-Type: %s", request.headers.get("Content-Type"))
+    abort(415, "Content-Type must be {}".format(" or ".join(content_types)))
 #---------------------------------------------------------------------
 #                C A R T  I T E M   M E T H O D S
 #---------------------------------------------------------------------
@@ -245,14 +683,36 @@ def create_items(shopcart_id):
     This endpoint will add an item to a shopcart
     """
     app.logger.info("Request to add an item to a shopcart")
-    check_content_type("application/json")
+    check_content_type()
     shopcart = ShopCart.find_or_404(shopcart_id)
     item = CartItem()
-    item.deserialize(request.get_json())
+    item.deserialize(get_payload())
     shopcart.items.append(item)
     shopcart.save()
     message = item.serialize()
-    return make_response(jsonify(message), status.HTTP_201_CREATED)
+    return make_response(encode_body(message), status.HTTP_201_CREATED)
+
+######################################################################
+# ADD ITEMS TO A SHOPCART IN BULK
+######################################################################
+@app.route('/shopcarts/<int:shopcart_id>/items:batch', methods=['POST'])
+def create_items_batch(shopcart_id):
+    """
+    Create many Items in a Shopcart
+    This endpoint takes an array of items and adds them all in one transaction,
+    or none of them if any are invalid
+    """
+    app.logger.info("Request to add a batch of items to a shopcart")
+    check_content_type()
+    ShopCart.read_query("lazy").get_or_404(shopcart_id)
+    items, errors = deserialize_batch(CartItem)
+    if errors:
+        return batch_error_response(errors)
+    for item in items:
+        item.shopcart_id = shopcart_id
+    CartItem.bulk_create(items)
+    results = [item.serialize() for item in items]
+    return make_response(encode_body(results), status.HTTP_201_CREATED)
 
 ######################################################################
 # RETRIEVE AN ITEM FROM A SHOPCART
@@ -261,11 +721,16 @@ def create_items(shopcart_id):
 def get_addresses(shopcart_id, item_id):
     """
     Get an Item
-    This endpoint returns just an item
+    This endpoint returns just an item, or the ?fields= of it
     """
     app.logger.info("Request to get an item with id: %s", item_id)
-    item = CartItem.find_or_404(item_id)
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    resp = check_if_none_match(shopcart_id)
+    if resp:
+        return resp
+    fields = get_fields()
+    row, version = CartItem.find_row_in_cart_or_404(shopcart_id, item_id, fields)
+    item = CartItem.serialize_rows([row], fields)[0]
+    return with_etag(make_response(encode_body(item), status.HTTP_200_OK), cart_etag(shopcart_id, version))
 
 ######################################################################
 # DELETE AN ITEM FROM SHOPCART
@@ -276,10 +741,8 @@ def delete_items(shopcart_id, item_id):
     Delete an item
     This endpoint will delete an item based the id specified in the path
     """
-    app.logger.info("Request to delete shopcart with id: %s", shopcart_id)
-    item = CartItem.find(item_id)
-    if item:
-        item.delete()
+    app.logger.info("Request to delete item %s from shopcart %s", item_id, shopcart_id)
+    CartItem.delete_in_cart(shopcart_id, item_id)
     return make_response("", status.HTTP_204_NO_CONTENT)
 
 
@@ -288,12 +751,24 @@ def delete_items(shopcart_id, item_id):
 ######################################################################
 @app.route("/shopcarts/<int:shopcart_id>/items", methods=["GET"])
 def list_items(shopcart_id):
-    """ Returns all of the items within the shopcart """
+    """
+    Returns the items within the shopcart
+    Supports ?limit=&after_id= keyset pagination, ?stream=true and ?fields=
+    """
     app.logger.info("Request to list items from the shopping cart")
-
-    shopcart = ShopCart.find_or_404(shopcart_id)
-    results = [item.serialize() for item in shopcart.items]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    after_id, limit = get_page_args()
+    resp = check_if_none_match(shopcart_id)
+    if resp:
+        return resp
+    if after_id is None and limit is None and not wants_stream():
+        version, items = ShopCart.find_items_or_404(shopcart_id, get_fields())
+        etag = cart_etag(shopcart_id, version)
+        resp = make_response(encode_body(items), status.HTTP_200_OK)
+    else:
+        etag = cart_etag(shopcart_id, ShopCart.find_version_or_404(shopcart_id))
+        query = CartItem.keyset_page(after_id, limit, CartItem.find_by_shopcart(shopcart_id))
+        resp = make_page_response(query, limit, "list_items", shopcart_id=shopcart_id)
+    return with_etag(resp, etag)
 
 ######################################################################
 # UPDATE AN ITEM
@@ -305,21 +780,98 @@ def update_items (shopcart_id, item_id):
     This endpoint will update an item based the body that is posted
     """
     app.logger.info("Request to update item with id: %s", item_id)
-    check_content_type("application/json")
-    item = CartItem.find_or_404(item_id)
-    item.deserialize(request.get_json())
-    item.id = item_id
+    check_content_type()
+    check_if_match(shopcart_id)
+    item = CartItem.find_in_cart_or_404(shopcart_id, item_id)
+    item.deserialize(get_payload())
+    # the cart in the path wins over the shopcart_id in the body
+    item.id, item.shopcart_id = item_id, shopcart_id
     item.save()
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    etag = cart_etag(shopcart_id, ShopCart.find_version_or_404(shopcart_id))
+    return with_etag(make_response(encode_body(item.serialize()), status.HTTP_200_OK), etag)
+
+######################################################################
+# PATCH AN ITEM
+######################################################################
+@app.route("/shopcarts/<int:shopcart_id>/items/<int:item_id>", methods=["PATCH"])
+def patch_items(shopcart_id, item_id):
+    """
+    Partially update an Item
+    Takes a JSON Merge Patch (RFC 7386) of item_name, sku, quantity and
+    price, e.g. {"quantity": 3}, and sets only those columns
+    """
+    app.logger.info("Request to patch item %s in shopcart %s", item_id, shopcart_id)
+    check_content_type(MERGE_PATCH, *PAYLOAD_TYPES)
+    check_if_match(shopcart_id)
+    row = CartItem.patch_in_cart(shopcart_id, item_id, get_payload())
+    item = CartItem.serialize_rows([row])[0]
+    etag = cart_etag(shopcart_id, ShopCart.find_version_or_404(shopcart_id))
+    return with_etag(make_response(encode_body(item), status.HTTP_200_OK), etag)
+
+######################################################################
+# ADD UNITS OF AN ITEM
+######################################################################
+@app.route("/shopcarts/<int:shopcart_id>/items/<sku>:increment", methods=["POST"])
+def increment_items(shopcart_id, sku):
+    """
+    Increment the quantity of an Item
+    Adds {"quantity": n} units (default 1) of a sku to a shopcart in one
+    statement. item_name and price are only used when the sku is new to it
+    """
+    app.logger.info("Request to increment sku %s in shopcart %s", sku, shopcart_id)
+    data = get_quantity_args()
+    item = CartItem.increment(
+        shopcart_id, sku, data["quantity"], data.get("item_name"), data.get("price")
+    )
+    return make_response(encode_body(item.serialize()), status.HTTP_200_OK)
+
+######################################################################
+# TAKE UNITS OF AN ITEM OUT
+######################################################################
+@app.route("/shopcarts/<int:shopcart_id>/items/<sku>:decrement", methods=["POST"])
+def decrement_items(shopcart_id, sku):
+    """
+    Decrement the quantity of an Item
+    Takes {"quantity": n} units (default 1) of a sku out of a shopcart and
+    removes the item, answering 204_NO_CONTENT, once none are left
+    """
+    app.logger.info("Request to decrement sku %s in shopcart %s", sku, shopcart_id)
+    data = get_quantity_args()
+    item = CartItem.decrement(shopcart_id, sku, data["quantity"])
+    if item is None:
+        return make_response("", status.HTTP_204_NO_CONTENT)
+    return make_response(encode_body(item.serialize()), status.HTTP_200_OK)
+
+######################################################################
+# MERGE A SHOPCART INTO ANOTHER
+######################################################################
+@app.route("/shopcarts/<int:shopcart_id>/merge", methods=["POST"])
+def merge_shopcarts(shopcart_id):
+    """
+    Merge a ShopCart into this one
+    Moves the items of the ?from= shopcart over and deletes it, e.g. the
+    guest cart of a customer who just logged in. Quantities of a sku in
+    both carts combine by ?policy= (sum, max, target or source), which
+    defaults to the MERGE_QUANTITY_POLICY setting
+    """
+    source_id = request.args.get("from", "")
+    app.logger.info("Request to merge shopcart %s into %s", source_id, shopcart_id)
+    if not source_id.isdigit():
+        abort(400, "from must be the id of a ShopCart")
+    policy = request.args.get("policy", app.config.get("MERGE_QUANTITY_POLICY", "sum"))
+    check_if_match(shopcart_id)
+    CartItem.merge(shopcart_id, int(source_id), policy)
+    message = ShopCart.find_or_404(shopcart_id).serialize()
+    etag = cart_etag(shopcart_id, message["version"])
+    return with_etag(make_response(encode_body(message), status.HTTP_200_OK), etag)
 
 ######################################################################
 # CLEAR ALL ITEMS FROM SHOPCART
 ######################################################################
 @app.route("/shopcarts/<int:shopcart_id>/clear", methods=["PUT"])
 def clear_shopcart (shopcart_id):
-    """ Returns all of the items within the shopcart """
+    """ Removes all of the items within the shopcart in one statement """
     app.logger.info("Request to clear items from the shopping cart")
-
-    shopcart = ShopCart.find_or_404(shopcart_id)
-    results = [item.delete() for item in shopcart.items]
-    return make_response("", status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    ShopCart.read_query("lazy").get_or_404(shopcart_id)
+    count = CartItem.delete_all(CartItem.shopcart_id == shopcart_id)
+    return make_response("", status.HTTP_204_NO_CONTENT, {"X-Deleted-Count": str(count)})
\ No newline at end of file
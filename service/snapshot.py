@@ -0,0 +1,397 @@
+"""
+Snapshots of every ShopCart and CartItem
+
+Exports the shopcart and cart_item tables as NDJSON, one object per row
+with the name of its table under "table", or as CSV, one table at a time
+with a header row, and loads them back:
+  FLASK_APP=service:app flask export-carts carts.ndjson
+  FLASK_APP=service:app flask import-carts carts.ndjson
+  FLASK_APP=service:app flask export-carts --format csv --table cart_item items.csv
+
+or over HTTP with GET and POST /admin/snapshot. Rows go through in batches
+of SNAPSHOT_BATCH_SIZE, from a server-side cursor on the way out and as one
+multi-row INSERT per batch on the way in, so the memory used stays the same
+whatever the number of carts. Postgres moves CSV files with COPY instead.
+
+Carts are written before their items and must be loaded in that order.
+Loading never replaces rows, a cart or item id that is already taken is an
+IntegrityError.
+"""
+import io
+import csv
+import json
+import time
+import logging
+from datetime import datetime
+from decimal import Decimal
+import click
+from sqlalchemy.exc import IntegrityError
+from service.models import db, ShopCart, CartItem, DataValidationError, commit, invalidate
+from service.encoders import orjson
+
+logger = logging.getLogger(__name__)
+
+# parents first, the order the rows are written and must be loaded in
+TABLES = (ShopCart.__table__, CartItem.__table__)
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _default(o):
+    """ Writes Decimals as numbers and datetimes in ISO 8601 """
+    if isinstance(o, Decimal):
+        return float(o)
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError("Object of type %s is not JSON serializable" % type(o).__name__)
+
+
+def _loads(line):
+    """ Decodes one NDJSON line, with orjson when it is installed """
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def _dumps(record):
+    """ Encodes one NDJSON line, with orjson when it is installed """
+    if orjson is not None:
+        return orjson.dumps(record, default=_default).decode("utf-8")
+    return json.dumps(record, default=_default, separators=(",", ":"))
+
+
+def _copy_cursor():
+    """ Returns a DBAPI cursor in the session's transaction for a COPY
+
+    A COPY of a whole table is one statement that may run for minutes, so
+    the DB_STATEMENT_TIMEOUT of the pooled connections is lifted for the
+    rest of this transaction only
+    """
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute("SET LOCAL statement_timeout = 0")
+    return cursor
+
+
+class _LineCounter(io.TextIOBase):
+    """ Reports progress on the lines COPY reads or writes through a text file
+
+    A TextIOBase, so psycopg2 hands it and takes from it str, not bytes
+    """
+
+    def __init__(self, file, table, every, progress, lines=0):
+        super().__init__()
+        self.file = file
+        self.table = table
+        self.every = every
+        self.progress = progress
+        self.lines = lines
+        self._next = every
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self._count(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.file.readline(size)
+        self._count(data)
+        return data
+
+    def write(self, data):
+        self._count(data)
+        return self.file.write(data)
+
+    def _count(self, data):
+        self.lines += data.count("\n")
+        if self.progress is not None and self.lines >= self._next:
+            self.progress(self.table, self.lines)
+            self._next = self.lines + self.every
+
+
+class Snapshot():
+    """ Streams all of the carts out to a file and back in, batch by batch """
+
+    def __init__(self):
+        self.batch_size = 5000
+
+    def init_app(self, app):
+        """ Adds the export and import commands to a Flask app """
+        self.batch_size = app.config.get("SNAPSHOT_BATCH_SIZE", 5000)
+        if not getattr(app, "_snapshot", False):
+            app._snapshot = True
+            app.cli.add_command(export_carts_command)
+            app.cli.add_command(import_carts_command)
+
+    @staticmethod
+    def tables(fmt, table=None):
+        """ Returns the tables a snapshot in a format covers, checking the arguments
+
+        Args:
+            fmt (str): ndjson or csv
+            table (str): the one table to cover, needed for CSV
+        """
+        if fmt not in FORMATS:
+            raise DataValidationError("Invalid format: must be one of " + ", ".join(FORMATS))
+        if table is None:
+            if fmt == "csv":
+                raise DataValidationError("Invalid table: a CSV snapshot holds a single table")
+            return TABLES
+        for candidate in TABLES:
+            if candidate.name == table:
+                return (candidate,)
+        raise DataValidationError("Invalid table: {} is not a cart table".format(table))
+
+    def dump(self, fmt, table=None, progress=None):
+        """ Yields a snapshot as text, one chunk per batch of rows
+
+        Args:
+            fmt (str): ndjson or csv
+            table (str): the one table to export, every table by default
+            progress (callable): called with (table, rows) after every batch
+        """
+        tables = self.tables(fmt, table)
+        connection = db.session.connection().execution_options(stream_results=True)
+        for table in tables:
+            names = [column.name for column in table.columns]
+            if fmt == "csv":
+                yield ",".join(names) + "\r\n"
+            result = connection.execute(table.select().order_by(table.c.id))
+            total = 0
+            while True:
+                rows = result.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                if fmt == "csv":
+                    chunk = io.StringIO()
+                    csv.writer(chunk).writerows(rows)
+                    yield chunk.getvalue()
+                else:
+                    yield "".join(
+                        _dumps(dict(zip(names, row), table=table.name)) + "\n" for row in rows
+                    )
+                total += len(rows)
+                if progress is not None:
+                    progress(table.name, total)
+            logger.info("Exported %d %s rows", total, table.name)
+
+    def export(self, out, fmt, table=None, progress=None):
+        """ Writes a snapshot to a text file
+
+        Returns:
+            the number of rows written per table
+        """
+        tables = self.tables(fmt, table)
+        if fmt == "csv" and db.engine.dialect.name == "postgresql":
+            return {tables[0].name: self._copy_to(out, tables[0], progress)}
+        counts = {table.name: 0 for table in tables}
+
+        def counted(name, total):
+            counts[name] = total
+            if progress is not None:
+                progress(name, total)
+
+        for chunk in self.dump(fmt, table, counted):
+            out.write(chunk)
+        return counts
+
+    def _copy_to(self, out, table, progress):
+        """ Writes a table as CSV with COPY TO STDOUT """
+        names = ", ".join(column.name for column in table.columns)
+        cursor = _copy_cursor()
+        # the header line is not a row
+        counter = _LineCounter(out, table.name, self.batch_size, progress, lines=-1)
+        cursor.copy_expert(
+            "COPY {} ({}) TO STDOUT WITH CSV HEADER".format(table.name, names), counter
+        )
+        logger.info("Exported %d %s rows with COPY", cursor.rowcount, table.name)
+        return cursor.rowcount
+
+    def load(self, stream, fmt, table=None, progress=None):
+        """ Loads a snapshot from a binary file, e.g. an upload
+
+        Outside of a request every batch is committed as it goes, inside one
+        the request's unit of work commits them all at the end
+
+        Args:
+            stream (file): the snapshot as UTF-8 bytes
+            fmt (str): ndjson or csv
+            table (str): the table of a CSV snapshot, NDJSON rows name their own
+            progress (callable): called with (table, rows) after every batch
+        Returns:
+            the number of rows loaded per table
+        """
+        tables = self.tables(fmt, table)
+        text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        try:
+            if fmt == "csv":
+                counts = self._load_csv(text, tables[0], progress)
+            else:
+                counts = self._load_ndjson(text, tables, progress)
+        finally:
+            text.detach()
+        self._reset_sequences()
+        commit()
+        invalidate()
+        return counts
+
+    def _load_csv(self, text, table, progress):
+        """ Loads the CSV rows of one table """
+        header = next(csv.reader([text.readline()]), None)
+        if not header:
+            raise DataValidationError("Invalid CSV: the header row is missing")
+        columns = self._columns(table, header)
+        if db.engine.dialect.name == "postgresql":
+            return {table.name: self._copy_from(text, table, header, progress)}
+        total = 0
+        batch = []
+        for line, values in enumerate(csv.reader(text), start=2):
+            # an empty CSV field is NULL, as it is for COPY
+            batch.append(self._convert(table, columns, zip(header, values), line, blank_null=True))
+            if len(batch) == self.batch_size:
+                total = self._insert(table, batch, total, progress)
+                batch = []
+        if batch:
+            total = self._insert(table, batch, total, progress)
+        return {table.name: total}
+
+    def _copy_from(self, text, table, header, progress):
+        """ Loads the rest of a CSV file with COPY FROM STDIN """
+        cursor = _copy_cursor()
+        cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN WITH CSV".format(table.name, ", ".join(header)),
+            _LineCounter(text, table.name, self.batch_size, progress),
+        )
+        commit()
+        logger.info("Imported %d %s rows with COPY", cursor.rowcount, table.name)
+        return cursor.rowcount
+
+    def _load_ndjson(self, text, tables, progress):
+        """ Loads NDJSON rows, a batch at a time for each run of one table """
+        by_name = {table.name: table for table in tables}
+        counts = {table.name: 0 for table in tables}
+        table = None
+        batch = []
+        for line, data in enumerate(text, start=1):
+            if not data.strip():
+                continue
+            try:
+                record = _loads(data)
+                name = record.pop("table")
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise DataValidationError("Invalid NDJSON: line {} is not a row".format(line))
+            if name not in by_name:
+                raise DataValidationError("Invalid NDJSON: line {} has table {}".format(line, name))
+            if by_name[name] is not table or len(batch) == self.batch_size:
+                # flush in file order, so carts always go in before their items
+                if batch:
+                    counts[table.name] = self._insert(table, batch, counts[table.name], progress)
+                table, batch = by_name[name], []
+            batch.append(self._convert(table, self._columns(table, record), record.items(), line))
+        if batch:
+            counts[table.name] = self._insert(table, batch, counts[table.name], progress)
+        return counts
+
+    @staticmethod
+    def _columns(table, names):
+        """ Returns the columns of a table by name, checking every name is one """
+        columns = {}
+        for name in names:
+            if name not in table.c:
+                raise DataValidationError("Invalid snapshot: {} has no column {}".format(
+                    table.name, name
+                ))
+            columns[name] = table.c[name]
+        return columns
+
+    @staticmethod
+    def _convert(table, columns, values, line, blank_null=False):
+        """ Returns a row of Python values for the INSERT, parsed from strings """
+        row = {}
+        for name, value in values:
+            if value == "" and blank_null:
+                value = None
+            elif isinstance(value, str):
+                python_type = columns[name].type.python_type
+                try:
+                    if python_type is datetime:
+                        value = datetime.fromisoformat(value)
+                    elif python_type is not str:
+                        value = python_type(value)
+                except (ValueError, ArithmeticError):
+                    # Decimal raises InvalidOperation, an ArithmeticError
+                    raise DataValidationError("Invalid snapshot: line {} has a bad {}.{}".format(
+                        line, table.name, name
+                    ))
+            row[name] = value
+        return row
+
+    @staticmethod
+    def _insert(table, batch, total, progress):
+        """ Inserts one batch of rows and returns the new running total """
+        db.session.execute(table.insert(), batch)
+        commit()
+        total += len(batch)
+        if progress is not None:
+            progress(table.name, total)
+        return total
+
+    @staticmethod
+    def _reset_sequences():
+        """ Moves the Postgres id sequences past the ids that were loaded """
+        if db.engine.dialect.name != "postgresql":
+            return
+        for table in TABLES:
+            db.session.execute(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "coalesce(max(id), 1), max(id) IS NOT NULL) FROM {0}".format(table.name)
+            )
+
+
+def _progress(name, total):
+    click.echo("{}: {} rows".format(name, total), err=True)
+
+
+@click.command("export-carts")
+@click.argument("output", type=click.File("w"), default="-")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default="ndjson")
+@click.option("--table", help="The one table to export, needed for CSV")
+def export_carts_command(output, fmt, table):
+    """ Writes every ShopCart and CartItem to a file, stdout by default """
+    start = time.perf_counter()
+    try:
+        counts = snapshot.export(output, fmt, table, _progress)
+    except DataValidationError as error:
+        raise click.UsageError(str(error))
+    _report("exported", counts, time.perf_counter() - start)
+
+
+@click.command("import-carts")
+@click.argument("source", type=click.File("rb"))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default="ndjson")
+@click.option("--table", help="The table of a CSV file")
+def import_carts_command(source, fmt, table):
+    """ Loads ShopCarts and CartItems from an export-carts file """
+    start = time.perf_counter()
+    try:
+        counts = snapshot.load(source, fmt, table, _progress)
+    except (DataValidationError, IntegrityError) as error:
+        db.session.rollback()
+        raise click.ClickException(str(error))
+    _report("imported", counts, time.perf_counter() - start)
+
+
+def _report(action, counts, seconds):
+    rows = sum(counts.values())
+    click.echo("{} {} rows ({}) in {:.1f}s, {:.0f} rows/s".format(
+        action, rows, ", ".join("{} {}".format(n, name) for name, n in counts.items()),
+        seconds, rows / seconds if seconds else 0
+    ), err=True)
+
+
+snapshot = Snapshot()
@@ -15,9 +15,10 @@
 """
 Test Factory to make fake objects for testing
 """
+import random
 import factory
 from datetime import datetime
-from factory.fuzzy import FuzzyChoice, FuzzyInteger, FuzzyFloat
+from factory.fuzzy import FuzzyChoice, FuzzyInteger
 from service.models import ShopCart, CartItem
 
 class CartItemFactory(factory.Factory):
@@ -29,9 +30,9 @@ class CartItemFactory(factory.Factory):
     id = factory.Sequence(lambda n: n)
     shopcart_id = factory.Sequence(lambda n: n)
     item_name = FuzzyChoice(choices=["pants", "shirt", "shoes"])
-    sku = FuzzyChoice(choices=["1A3B", "2A94", "4PT3", "4DW2", "00A2","0992", "112A", "APC1"])
+    sku = factory.Sequence(lambda n: "%04dA" % n)
     quantity = FuzzyInteger(0, 50, step=1)
-    price = FuzzyFloat(0.5, 100.5)
+    price = factory.LazyFunction(lambda: round(random.uniform(0.5, 100.5), 2))
 
 
 class ShopCartFactory(factory.Factory):
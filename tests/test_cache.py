@@ -0,0 +1,133 @@
+"""
+Test cases for the cart cache backends
+
+"""
+import unittest
+import fnmatch
+from service.cache import NullCache, LRUCache, RedisCache, make_cache
+
+
+class FakeClock():
+    """ A clock that only moves when told to """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis():
+    """ Local stand-in for a Redis client """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode("utf-8")
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match="*"):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestCartCache(unittest.TestCase):
+    """ Test Cases for the cart cache backends """
+
+    def test_null_cache(self):
+        """ The null cache never returns anything """
+        cache = NullCache()
+        cache.set(1, {"id": 1})
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_lru_hit_and_miss(self):
+        """ Count hits and misses in the LRU cache """
+        cache = LRUCache(size=2)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, {"id": 1})
+        self.assertEqual(cache.get(1), {"id": 1})
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["entries"], 1)
+
+    def test_lru_eviction(self):
+        """ Evict the least recently used entry """
+        cache = LRUCache(size=2)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.get(1)
+        cache.set(3, "three")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), "one")
+        self.assertEqual(cache.get(3), "three")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_lru_ttl(self):
+        """ Expire entries after their time to live """
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.set(1, "one")
+        clock.now = 9
+        self.assertEqual(cache.get(1), "one")
+        clock.now = 10
+        self.assertIsNone(cache.get(1))
+
+    def test_lru_delete_and_clear(self):
+        """ Invalidate entries in the LRU cache """
+        cache = LRUCache()
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.delete(1, 5)
+        self.assertIsNone(cache.get(1))
+        cache.clear()
+        self.assertIsNone(cache.get(2))
+
+    def test_redis_cache(self):
+        """ Cache serialized carts through a Redis client """
+        client = FakeRedis()
+        cache = RedisCache(client)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, {"id": 1, "items": []})
+        self.assertEqual(cache.get(1), {"id": 1, "items": []})
+        cache.set(2, {"id": 2})
+        cache.delete(1)
+        self.assertIsNone(cache.get(1))
+        client.data["other"] = b"kept"
+        cache.clear()
+        self.assertEqual(list(client.data), ["other"])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_redis_cache_errors(self):
+        """ A broken Redis connection is treated as a miss """
+        client = FakeRedis()
+        client.get = client.set = client.delete = client.scan_iter = self._fail
+        cache = RedisCache(client)
+        cache.set(1, {"id": 1})
+        self.assertIsNone(cache.get(1))
+        cache.delete(1)
+        cache.clear()
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_make_cache(self):
+        """ Create the cache backend from the settings """
+        self.assertIsInstance(make_cache({}), NullCache)
+        cache = make_cache({"CART_CACHE": "memory", "CART_CACHE_SIZE": 5})
+        self.assertIsInstance(cache, LRUCache)
+        self.assertEqual(cache.size, 5)
+        self.assertRaises(ValueError, make_cache, {"CART_CACHE": "disk"})
+
+    @staticmethod
+    def _fail(*args, **kwargs):
+        raise ConnectionError("connection refused")
@@ -0,0 +1,65 @@
+"""
+Test cases for response compression
+
+"""
+import gzip
+import unittest
+from flask import Flask, Response, make_response
+from service import compression
+from service.compression import Compressor, strip_encoding
+
+BODY = "x" * 2000
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestCompressor(unittest.TestCase):
+    """ Response compression tests """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(COMPRESS_MIN_SIZE=1000)
+        self.app.add_url_rule("/", "index", self.index)
+        self.app.add_url_rule("/small", "small", lambda: "small")
+        self.app.add_url_rule(
+            "/stream", "stream", lambda: Response(iter([BODY]), mimetype="text/plain")
+        )
+        Compressor().init_app(self.app)
+        self.client = self.app.test_client()
+
+    @staticmethod
+    def index():
+        response = make_response(BODY)
+        response.set_etag("1-2")
+        return response
+
+    def test_gzip(self):
+        """ Compress with gzip and tag the ETag with it """
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(resp.get_data()).decode(), BODY)
+        self.assertEqual(resp.headers["ETag"], '"1-2-gzip"')
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+
+    @unittest.skipIf(compression.brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        """ Prefer brotli when the client takes both """
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip, deflate, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(resp.get_data()).decode(), BODY)
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip, br;q=0.5"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+
+    def test_not_compressed(self):
+        """ Leave small, streamed and unwanted responses alone """
+        for path, accept in [("/small", "gzip"), ("/stream", "gzip"), ("/", "gzip;q=0"), ("/", "")]:
+            resp = self.client.get(path, headers={"Accept-Encoding": accept})
+            self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.headers["ETag"], '"1-2"')
+
+    def test_strip_encoding(self):
+        """ Take the content coding off an ETag """
+        self.assertEqual(strip_encoding("1-2-gzip"), "1-2")
+        self.assertEqual(strip_encoding("1-2-br"), "1-2")
+        self.assertEqual(strip_encoding("1-2"), "1-2")
@@ -0,0 +1,69 @@
+"""
+Test cases for the JSON encoders
+
+"""
+import json
+import unittest
+from decimal import Decimal
+from datetime import date
+from service import encoders
+from service.encoders import JSONEncoder, OrjsonEncoder, make_json_encoder
+from service.encoders import pack_msgpack, unpack_msgpack
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestJSONEncoders(unittest.TestCase):
+    """ JSON encoder tests """
+
+    def test_same_output(self):
+        """ Encode the same documents with both encoders """
+        documents = [
+            {"id": 1, "items": [{"price": Decimal("9.99"), "name": "café"}]},
+            [1, 2.5, None, True, "x"],
+            {"b": 1, "a": {"d": date(2020, 1, 2)}},
+        ]
+        for document in documents:
+            expected = json.loads(json.dumps(document, cls=JSONEncoder))
+            actual = json.loads(json.dumps(document, cls=OrjsonEncoder))
+            self.assertEqual(actual, expected)
+
+    def test_sort_keys_and_indent(self):
+        """ Honor sort_keys and indent like the stdlib """
+        text = json.dumps({"b": 1, "a": 2}, cls=OrjsonEncoder, sort_keys=True)
+        self.assertLess(text.index('"a"'), text.index('"b"'))
+        text = json.dumps({"a": [1]}, cls=OrjsonEncoder, indent=2)
+        self.assertIn("\n  ", text)
+
+    def test_unsupported_type(self):
+        """ Raise TypeError on an object neither encoder knows """
+        for encoder in [JSONEncoder, OrjsonEncoder]:
+            self.assertRaises(TypeError, json.dumps, {"a": object()}, cls=encoder)
+
+    def test_make_json_encoder(self):
+        """ Choose the encoder from the configuration """
+        self.assertIs(make_json_encoder({}), OrjsonEncoder)
+        self.assertIs(make_json_encoder({"JSON_ENCODER": "orjson"}), OrjsonEncoder)
+        self.assertIs(make_json_encoder({"JSON_ENCODER": "stdlib"}), JSONEncoder)
+        self.assertRaises(ValueError, make_json_encoder, {"JSON_ENCODER": "fast"})
+
+    def test_make_json_encoder_fallback(self):
+        """ Fall back to the stdlib encoder without orjson """
+        orjson, encoders.orjson = encoders.orjson, None
+        try:
+            self.assertIs(make_json_encoder({"JSON_ENCODER": "auto"}), JSONEncoder)
+            self.assertRaises(ValueError, make_json_encoder, {"JSON_ENCODER": "orjson"})
+        finally:
+            encoders.orjson = orjson
+
+    @unittest.skipIf(encoders.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        """ Encode MessagePack with the same values as JSON """
+        document = {"id": 1, "items": [{"price": Decimal("9.99"), "name": "café"}],
+                    "date": date(2020, 1, 2)}
+        expected = json.loads(json.dumps(document, cls=JSONEncoder))
+        self.assertEqual(unpack_msgpack(pack_msgpack(document)), expected)
+        self.assertRaises(TypeError, pack_msgpack, {"a": object()})
+        self.assertRaises(ValueError, unpack_msgpack, b"\xc1")
+        self.assertRaises(ValueError, unpack_msgpack, b"\x01\x02")
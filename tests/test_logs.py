@@ -0,0 +1,83 @@
+"""
+Test cases for the logging setup
+
+"""
+import json
+import logging
+import unittest
+from flask import Flask
+from service import app
+from service.logs import init_logging, stop_logging, log_payload, parse_levels
+
+
+class ListHandler(logging.Handler):
+    """ Keeps the formatted records """
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestLogging(unittest.TestCase):
+    """ Logging setup tests """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.handler = ListHandler()
+
+    def tearDown(self):
+        init_logging(app)
+        logging.getLogger("flask.app").setLevel(logging.CRITICAL)
+
+    def test_parse_levels(self):
+        """ Parse per logger levels """
+        self.assertEqual(
+            parse_levels("service.models=warning, flask.app=INFO"),
+            {"service.models": "WARNING", "flask.app": "INFO"},
+        )
+        self.assertEqual(parse_levels(""), {})
+        self.assertRaises(ValueError, parse_levels, "service.models")
+
+    def test_queue(self):
+        """ Write the records from the listener thread """
+        self.app.config.update(LOG_LEVEL="INFO", LOG_LEVELS="service.models=WARNING")
+        init_logging(self.app, [self.handler])
+        logging.getLogger("service.models").info("hidden")
+        logging.getLogger("service.models").warning("shown %s", "warning")
+        logging.getLogger("service.cache").info("shown %d", 1)
+        stop_logging()
+        self.assertEqual(len(self.handler.lines), 2)
+        self.assertIn("[WARNING] [test_logs] shown warning", self.handler.lines[0])
+        self.assertIn("shown 1", self.handler.lines[1])
+
+    def test_json_format(self):
+        """ Write one JSON object per record """
+        self.app.config.update(LOG_FORMAT="json", LOG_QUEUE=False)
+        init_logging(self.app, [self.handler])
+        logging.getLogger("flask.app").error("broken %s", "cart")
+        entry = json.loads(self.handler.lines[0])
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertEqual(entry["logger"], "flask.app")
+        self.assertEqual(entry["message"], "broken cart")
+
+    def test_log_payload(self):
+        """ Log request bodies for the sampled share only """
+        logger = logging.getLogger("flask.app")
+        self.app.config.update(LOG_QUEUE=False, LOG_PAYLOAD_SAMPLE_RATE=0.0)
+        init_logging(self.app, [self.handler])
+        log_payload(logger, "payload", {"customer_id": 1})
+        self.assertEqual(self.handler.lines, [])
+        self.app.config.update(LOG_PAYLOAD_SAMPLE_RATE=1.0)
+        init_logging(self.app, [self.handler])
+        log_payload(logger, "payload", {"customer_id": 1})
+        self.assertIn('payload: {"customer_id": 1}', self.handler.lines[0])
+        log_payload(logger, "payload", {"sku": b"ABC"})
+        self.assertIn('payload: {"sku": "b\'ABC\'"}', self.handler.lines[1])
+        log_payload(logger, "payload", {b"sku": 1})
+        self.assertIn("payload: {b'sku': 1}", self.handler.lines[2])
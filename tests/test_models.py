@@ -6,7 +6,8 @@ import logging
 import unittest
 import os
 from service import app
-from service.models import ShopCart, CartItem, DataValidationError, db
+from werkzeug.exceptions import NotFound
+from service.models import ShopCart, CartItem, DataValidationError, UnitOfWork, db, savepoint
 from tests.factories import ShopCartFactory, CartItemFactory
 
 #DATABASE_URI = os.getenv(
@@ -150,6 +151,162 @@ class TestShopCart(unittest.TestCase):
         shopcart = ShopCart.find(shopcart.id)
         self.assertEqual(len(shopcart.items), 0)
 
+    def test_items_loading_strategies(self):
+        """ Load ShopCart items with each loading strategy """
+        shopcart = self._create_shopcart(items=[self._create_item(), self._create_item()])
+        shopcart.create()
+        for loading in ["selectin", "joined", "lazy"]:
+            db.session.remove()
+            shopcarts = ShopCart.read_query(loading).all()
+            self.assertEqual(len(shopcarts), 1)
+            self.assertEqual(len(shopcarts[0].items), 2)
+
+    def test_items_loading_bad_strategy(self):
+        """ Load ShopCart items with an unknown loading strategy """
+        self.assertRaises(ValueError, ShopCart.read_query, "eager")
+
+    def test_read_rows(self):
+        """ Read ShopCarts and Items as plain rows """
+        shopcart = self._create_shopcart(items=[self._create_item(), self._create_item()])
+        shopcart.create()
+        expected = shopcart.serialize()
+        db.session.remove()
+        rows = ShopCart.read_rows(ShopCart.keyset_page()).fetchall()
+        self.assertEqual(ShopCart.serialize_rows(rows), [expected])
+        row = CartItem.find_row_or_404(expected["items"][1]["id"])
+        self.assertEqual(CartItem.serialize_rows([row]), expected["items"][1:])
+        # nothing was loaded into the session
+        self.assertEqual(len(db.session.identity_map), 0)
+        self.assertRaises(NotFound, CartItem.find_row_or_404, 0)
+
+    def test_find_by_customer(self):
+        """ Find ShopCarts by customer """
+        for customer_id in [1, 2, 2]:
+            ShopCart(customer_id=customer_id).create()
+        self.assertEqual(ShopCart.find_by_customer(2).count(), 2)
+        self.assertEqual(ShopCart.find_by_customer(3).count(), 0)
+
+    def test_find_by_item(self):
+        """ Find ShopCarts by item sku and name """
+        first = self._create_shopcart(items=[self._create_item(), self._create_item()])
+        first.items[0].sku, first.items[0].item_name = "SKU1", "hat"
+        first.items[1].sku, first.items[1].item_name = "SKU4", "hat"
+        first.create()
+        second = self._create_shopcart(items=[self._create_item()])
+        second.items[0].sku, second.items[0].item_name = "SKU2", "hat"
+        second.create()
+        self.assertEqual([s.id for s in ShopCart.find_by_sku("SKU1")], [first.id])
+        self.assertEqual(
+            sorted(s.id for s in ShopCart.find_by_item_name("hat")), [first.id, second.id]
+        )
+        self.assertEqual(ShopCart.find_by_sku("SKU3").all(), [])
+
+    def test_create_columns(self):
+        """ Add columns missing from an existing table """
+        db.session.remove()
+        db.engine.execute("ALTER TABLE shopcart DROP COLUMN unit_count")
+        ShopCart.create_columns()
+        names = [column["name"] for column in db.inspect(db.engine).get_columns("shopcart")]
+        self.assertIn("unit_count", names)
+
+    def test_create_indexes(self):
+        """ Create indexes missing from an existing table """
+        db.session.remove()
+        db.engine.execute("DROP INDEX ix_shopcart_customer_id")
+        ShopCart.create_indexes()
+        names = [index["name"] for index in db.inspect(db.engine).get_indexes("shopcart")]
+        self.assertIn("ix_shopcart_customer_id", names)
+        names = [index["name"] for index in db.inspect(db.engine).get_indexes("cart_item")]
+        self.assertIn("uq_cart_item_shopcart_id_sku", names)
+
+    def test_create_foreign_keys(self):
+        """ Report foreign keys made without their ON DELETE rule """
+        db.session.remove()
+        with self.assertRaises(AssertionError):
+            with self.assertLogs("service.models", logging.ERROR):
+                ShopCart.create_foreign_keys()
+        db.engine.execute("DROP TABLE cart_item")
+        db.engine.execute(
+            "CREATE TABLE cart_item (id INTEGER PRIMARY KEY, "
+            "shopcart_id INTEGER NOT NULL REFERENCES shopcart (id))"
+        )
+        with self.assertLogs("service.models", logging.ERROR) as logs:
+            ShopCart.create_foreign_keys()
+        self.assertIn("cart_item(shopcart_id) needs ON DELETE CASCADE", logs.output[0])
+
+    def test_convert_columns(self):
+        """ Report prices still made as FLOAT """
+        db.session.remove()
+        with self.assertRaises(AssertionError):
+            with self.assertLogs("service.models", logging.ERROR):
+                ShopCart.convert_columns()
+        db.engine.execute("DROP TABLE cart_item")
+        db.engine.execute(
+            "CREATE TABLE cart_item (id INTEGER PRIMARY KEY, shopcart_id INTEGER, price FLOAT)"
+        )
+        with self.assertLogs("service.models", logging.ERROR) as logs:
+            ShopCart.convert_columns()
+        self.assertIn("cart_item.price is FLOAT, not NUMERIC(10, 2)", logs.output[0])
+
+    def test_create_unique_index_merges(self):
+        """ Merge the lines of a SKU in a cart before indexing them as unique """
+        shopcart = self._create_shopcart(items=[self._create_item()])
+        shopcart.create()
+        item = shopcart.items[0]
+        shopcart_id, sku, quantity = shopcart.id, item.sku, item.quantity
+        db.session.remove()
+        db.engine.execute("DROP INDEX uq_cart_item_shopcart_id_sku")
+        for extra in [2, 3]:
+            db.engine.execute(
+                "INSERT INTO cart_item (shopcart_id, item_name, sku, quantity, price) "
+                "VALUES (?, 'copy', ?, ?, 1)", shopcart_id, sku, extra
+            )
+        ShopCart.create_indexes()
+        names = [index["name"] for index in db.inspect(db.engine).get_indexes("cart_item")]
+        self.assertIn("uq_cart_item_shopcart_id_sku", names)
+        shopcart = ShopCart.find(shopcart_id)
+        self.assertEqual([(i.sku, i.quantity) for i in shopcart.items], [(sku, quantity + 5)])
+        self.assertEqual((shopcart.item_count, shopcart.unit_count), (1, quantity + 5))
+
+    def test_unit_of_work_commits_once(self):
+        """ Writes in a request are committed once when it succeeds """
+        with app.test_request_context():
+            UnitOfWork.begin()
+            shopcart = self._create_shopcart(items=[self._create_item()])
+            shopcart.create()
+            ShopCart(customer_id=2).create()
+            self.assertTrue(UnitOfWork.current().dirty)
+            UnitOfWork.end(app.response_class(status=201))
+            self.assertIsNone(UnitOfWork.current())
+        db.session.remove()
+        self.assertEqual(ShopCart.query.count(), 2)
+
+    def test_unit_of_work_rolls_back(self):
+        """ Writes in a request that fails are rolled back """
+        with app.test_request_context():
+            UnitOfWork.begin()
+            self._create_shopcart(items=[self._create_item()]).create()
+            UnitOfWork.end(app.response_class(status=400))
+        self.assertEqual(ShopCart.query.count(), 0)
+        with app.test_request_context():
+            UnitOfWork.begin()
+            ShopCart(customer_id=1).create()
+            UnitOfWork.teardown(RuntimeError())
+        self.assertEqual(ShopCart.query.count(), 0)
+
+    def test_savepoint(self):
+        """ A failed savepoint only rolls back its own writes """
+        with app.test_request_context():
+            UnitOfWork.begin()
+            ShopCart(customer_id=1).create()
+            with self.assertRaises(RuntimeError):
+                with savepoint():
+                    ShopCart(customer_id=2).create()
+                    raise RuntimeError("undo customer 2")
+            UnitOfWork.end(app.response_class(status=201))
+        db.session.remove()
+        self.assertEqual([s.customer_id for s in ShopCart.query], [1])
+
 ######################################################################
 #  SERIALIZE/DESERIALIZE TEST CASES
 ######################################################################
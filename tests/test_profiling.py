@@ -0,0 +1,71 @@
+"""
+Test cases for the request profiler
+
+"""
+import cProfile
+import pstats
+import unittest
+from flask import Flask
+from service.profiling import Profiler, call_tree
+
+
+def leaf():
+    return sum(range(20000))
+
+
+def branch():
+    total = 0
+    for _ in range(5):
+        total += leaf()
+    return total
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestProfiler(unittest.TestCase):
+    """ Request profiler tests """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(PROFILING_ENABLED=True, PROFILE_BUFFER_SIZE=2)
+        self.app.add_url_rule("/", "index", lambda: "ok")
+        self.profiler = Profiler()
+        self.profiler.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def test_call_tree(self):
+        """ Build a call tree from profile stats """
+        profile = cProfile.Profile()
+        profile.enable()
+        branch()
+        profile.disable()
+        tree = call_tree(pstats.Stats(profile), 0.000001)
+        self.assertIn("branch", tree[0]["function"])
+        child = tree[0]["children"][0]
+        self.assertIn("leaf", child["function"])
+        self.assertEqual(child["calls"], 5)
+
+    def test_ring_buffer(self):
+        """ Keep only the last profiles """
+        ids = [
+            self.client.get("/", headers={"X-Profile": "1"}).headers["X-Profile-Id"]
+            for _ in range(3)
+        ]
+        self.assertEqual([p["id"] for p in self.profiler.profiles()], [3, 2])
+        self.assertIsNone(self.profiler.find(int(ids[0])))
+        self.assertEqual(self.profiler.find(3)["status"], 200)
+
+    def test_sampling(self):
+        """ Profile a sampled share of the requests """
+        self.profiler.sample_rate = 1.0
+        self.assertIn("X-Profile-Id", self.client.get("/").headers)
+        self.profiler.sample_rate = 0.0
+        self.assertNotIn("X-Profile-Id", self.client.get("/").headers)
+
+    def test_disabled(self):
+        """ Ignore the header while profiling is disabled """
+        self.profiler.enabled = False
+        resp = self.client.get("/", headers={"X-Profile": "1"})
+        self.assertNotIn("X-Profile-Id", resp.headers)
+        self.assertEqual(self.profiler.profiles(), [])
@@ -8,9 +8,14 @@ Test cases can be run with the following:
 import os
 import logging
 import json
-from unittest import TestCase
+from unittest import TestCase, skipIf
 from unittest.mock import MagicMock, patch
-from service.models import ShopCart, CartItem
+from sqlalchemy import event
+from service.models import ShopCart, CartItem, PersistentBase
+from service.cache import LRUCache
+from service.metrics import request_metrics
+from service.profiling import profiler
+from service.encoders import MSGPACK, MSGPACK_TYPES, pack_msgpack, unpack_msgpack
 from tests.factories import ShopCartFactory, CartItemFactory
 from flask_api import status  # HTTP Status Codes
 from service.models import db
@@ -74,6 +79,36 @@ class TestYourResourceServer(TestCase):
             shopcarts.append(shopcart)
         return shopcarts
 
+    def _create_items(self, shopcart_id, count):
+        """ Factory method to add CartItems to a ShopCart in bulk """
+        items = []
+        for _ in range(count):
+            item = CartItemFactory()
+            resp = self.app.post(
+                "/shopcarts/{}/items".format(shopcart_id),
+                json=item.serialize(),
+                content_type="application/json"
+            )
+            self.assertEqual(
+                resp.status_code, status.HTTP_201_CREATED, "Could not create test CartItem"
+            )
+            items.append(resp.get_json())
+        return items
+
+    def _count_queries(self, method, *args, **kwargs):
+        """ Calls a test client method and counts the SQL statements it issued """
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            resp = method(*args, **kwargs)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        return resp, len(statements)
+
 ######################################################################
 #  S H O P C A R T   T E S T   C A S E S   H E R E 
 ######################################################################
@@ -109,6 +144,41 @@ class TestYourResourceServer(TestCase):
         self.assertEqual(new_shopcart["items"], shopcart.items, "Names does not match")
         self.assertEqual(new_shopcart["customer_id"], shopcart.customer_id, "Customer ID does not match")
 
+    def test_create_shopcarts_batch(self):
+        """ Create a batch of ShopCarts with nested Items """
+        shopcarts = []
+        for count in [0, 1, 3]:
+            shopcart = ShopCartFactory().serialize()
+            shopcart["items"] = [item.serialize() for item in CartItemFactory.create_batch(count)]
+            shopcarts.append(shopcart)
+        resp = self.app.post(
+            "/shopcarts:batch", json=shopcarts, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data), 3)
+        for sent, created in zip(shopcarts, data):
+            self.assertEqual(created["customer_id"], sent["customer_id"])
+            self.assertEqual(len(created["items"]), len(sent["items"]))
+            resp = self.app.get("/shopcarts/{}".format(created["id"]))
+            self.assertEqual(resp.get_json(), created)
+
+    def test_create_shopcarts_batch_bad_element(self):
+        """ Create a batch of ShopCarts with an invalid element """
+        shopcarts = [ShopCartFactory().serialize(), {"items": []}, "bad"]
+        resp = self.app.post(
+            "/shopcarts:batch", json=shopcarts, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([e["index"] for e in resp.get_json()["errors"]], [1, 2])
+        resp = self.app.get("/shopcarts")
+        self.assertEqual(resp.get_json(), [])
+
+        resp = self.app.post(
+            "/shopcarts:batch", json={"customer_id": 1}, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_shopcart(self):
         """ Get a single ShopCart """
         # get the id of an shopcart
@@ -126,6 +196,111 @@ class TestYourResourceServer(TestCase):
         resp = self.app.get("/shopcarts/0")
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_get_shopcart_cached(self):
+        """ Get a ShopCart through the cart cache """
+        with patch.object(PersistentBase, "cache", LRUCache()):
+            shopcart = self._create_shopcarts(1)[0]
+            self._create_items(shopcart.id, 2)
+            url = "/shopcarts/{}".format(shopcart.id)
+            resp, count = self._count_queries(self.app.get, url)
+            self.assertGreater(count, 0)
+            resp, count = self._count_queries(self.app.get, url)
+            self.assertEqual(count, 0)
+            self.assertEqual(len(resp.get_json()["items"]), 2)
+
+            # adding an item must invalidate the cached cart
+            self._create_items(shopcart.id, 1)
+            resp = self.app.get("/shopcarts/{}/items".format(shopcart.id))
+            self.assertEqual(len(resp.get_json()), 3)
+            resp = self.app.put("/shopcarts/{}/clear".format(shopcart.id))
+            resp = self.app.get(url)
+            self.assertEqual(resp.get_json()["items"], [])
+
+            resp = self.app.get("/admin/cache")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            stats = resp.get_json()
+            self.assertEqual(stats["backend"], "memory")
+            self.assertEqual(stats["hits"], 1)
+            self.assertEqual(stats["misses"], 3)
+
+    def test_clear_shopcart_keeps_other_cached(self):
+        """ Clearing a ShopCart drops only that cart from the cache """
+        with patch.object(PersistentBase, "cache", LRUCache()):
+            first, second = self._create_shopcarts(2)
+            self._create_items(first.id, 2)
+            for shopcart in [first, second]:
+                self.app.get("/shopcarts/{}".format(shopcart.id))
+            self.app.put("/shopcarts/{}/clear".format(first.id))
+            resp, count = self._count_queries(self.app.get, "/shopcarts/{}".format(second.id))
+            self.assertEqual(count, 0)
+            resp = self.app.get("/shopcarts/{}".format(first.id))
+            self.assertEqual(resp.get_json()["items"], [])
+
+    def test_get_shopcart_not_modified(self):
+        """ Get a ShopCart with If-None-Match """
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, 2)
+        url = "/shopcarts/{}".format(shopcart.id)
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        resp, count = self._count_queries(
+            self.app.get, url, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(count, 1)
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        # every item change makes a new version
+        for url in [url, url + "/items"]:
+            self._create_items(shopcart.id, 1)
+            resp = self.app.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(resp.headers["ETag"], etag)
+            etag = resp.headers["ETag"]
+            resp = self.app.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.app.put(url.replace("items", "clear"))
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.get_json(), [])
+
+        resp = self.app.get("/shopcarts/0", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_update_shopcart_if_match(self):
+        """ Update a ShopCart with If-Match """
+        shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}".format(shopcart.id)
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+        data["customer_id"] = 42
+        resp = self.app.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        # a second writer holding the old ETag must not overwrite it
+        data["customer_id"] = 43
+        resp = self.app.put(url, json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.app.get(url).get_json()["customer_id"], 42)
+        resp = self.app.put(url, json=data, headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_failed_write_keeps_version(self):
+        """ A write failing after its If-Match claim leaves the version alone """
+        shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}".format(shopcart.id)
+        etag = self.app.get(url).headers["ETag"]
+        resp = self.app.put(url, json={"items": "bad"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.put(url + "/items/0", json={}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        # an unrelated write must not commit the abandoned claims
+        self.app.post("/shopcarts", json={"customer_id": 1})
+        self.assertEqual(self.app.get(url).headers["ETag"], etag)
+        resp = self.app.patch(url, json={"customer_id": 5}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
     def test_update_shopcart(self):
         """ Update an existing ShopCart """
         # create a ShopCart to update
@@ -149,7 +324,322 @@ class TestYourResourceServer(TestCase):
         updated_shopcart = resp.get_json()
         self.assertEqual(updated_shopcart["customer_id"],12345678)
 
+    def test_update_shopcart_replaces_items(self):
+        """ Update a ShopCart with items, replacing the ones it had """
+        shopcart = self._create_shopcarts(1)[0]
+        items = self._create_items(shopcart.id, 2)
+        url = "/shopcarts/{}".format(shopcart.id)
+        data = self.app.get(url).get_json()
+        data["items"] = [dict(items[1], quantity=7)]
+        resp = self.app.put(url, json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()["items"]), 1)
+        data = self.app.get(url).get_json()
+        self.assertEqual([(i["sku"], i["quantity"]) for i in data["items"]], [(items[1]["sku"], 7)])
+        summary = self.app.get(url + "/summary").get_json()
+        self.assertEqual(summary["unit_count"], 7)
+
+    def test_patch_shopcart(self):
+        """ Patch a ShopCart with a JSON Merge Patch """
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, 1)
+        url = "/shopcarts/{}".format(shopcart.id)
+        before = self.app.get(url).get_json()
+        resp, count = self._count_queries(
+            self.app.patch, url, data=json.dumps({"customer_id": 77}),
+            content_type="application/merge-patch+json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["customer_id"], 77)
+        self.assertEqual(data["version"], before["version"] + 1)
+        self.assertEqual(data["items"], before["items"])
+        self.assertEqual(resp.headers["ETag"], '"{}-{}"'.format(shopcart.id, data["version"]))
+        self.assertLessEqual(count, 3)
+        self.assertEqual(self.app.get(url).get_json(), data)
+        resp = self.app.patch(url, json={"customer_id": None})
+        self.assertIsNone(resp.get_json()["customer_id"])
+        for patch in [{"items": []}, {"version": 1}, {"customer_id": "7"}, [1]]:
+            resp = self.app.patch(url, json=patch)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.patch(url, data="{}", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        resp = self.app.patch("/shopcarts/0", json={"customer_id": 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_patch_item(self):
+        """ Patch only the quantity of an Item """
+        shopcart, other = self._create_shopcarts(2)
+        item = self._create_items(shopcart.id, 1)[0]
+        url = "/shopcarts/{}/items/{}".format(shopcart.id, item["id"])
+        etag = self.app.get(url).headers["ETag"]
+        resp, count = self._count_queries(
+            self.app.patch, url, data=json.dumps({"quantity": 3}),
+            content_type="application/merge-patch+json", headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), dict(item, quantity=3))
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertLessEqual(count, 5)
+        self.assertEqual(self.app.get(url).get_json()["quantity"], 3)
+        summary = self.app.get("/shopcarts/{}/summary".format(shopcart.id)).get_json()
+        self.assertEqual(summary["unit_count"], 3)
+        resp = self.app.patch(url, json={"quantity": 4}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.patch(url, json={"price": None, "item_name": "hat"})
+        self.assertEqual(resp.get_json(), dict(item, quantity=3, price=None, item_name="hat"))
+        for patch in [{"id": 1}, {"shopcart_id": other.id}, {"quantity": True}, {"sku": 5}]:
+            resp = self.app.patch(url, json=patch)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.patch(
+            "/shopcarts/{}/items/{}".format(other.id, item["id"]), json={"quantity": 1}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_shopcart_fields(self):
+        """ Get a sparse fieldset of a ShopCart """
+        shopcart = self._create_shopcarts(1)[0]
+        items = self._create_items(shopcart.id, 2)
+        url = "/shopcarts/{}".format(shopcart.id)
+        db.session.remove()
+        resp, count = self._count_queries(self.app.get, url + "?fields=id,customer_id")
+        self.assertEqual(resp.get_json(), {"id": shopcart.id, "customer_id": shopcart.customer_id})
+        self.assertEqual(count, 1)
+        resp = self.app.get(url + "?fields=id,items.sku,items.quantity")
+        self.assertEqual(resp.get_json(), {"id": shopcart.id, "items": [
+            {"sku": item["sku"], "quantity": item["quantity"]} for item in items
+        ]})
+        self.assertEqual(resp.headers["ETag"], self.app.get(url).headers["ETag"])
+        resp = self.app.get(url + "?fields=items")
+        self.assertEqual(resp.get_json(), {"items": items})
+        for fields in ["color", "items.color"]:
+            resp = self.app.get(url + "?fields=" + fields)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/shopcarts/0?fields=id")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_fields_cached(self):
+        """ Reject unknown fields of a cached ShopCart like an uncached one """
+        with patch.object(PersistentBase, "cache", LRUCache()):
+            shopcart = self._create_shopcarts(1)[0]
+            self._create_items(shopcart.id, 1)
+            url = "/shopcarts/{}".format(shopcart.id)
+            self.app.get(url)
+            for path in [url + "?fields=bogus", url + "?fields=items.bogus",
+                         url + "/items?fields=bogus"]:
+                resp = self.app.get(path)
+                self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            resp = self.app.get(url + "?fields=items.sku")
+            self.assertEqual(len(resp.get_json()["items"]), 1)
+
+    def test_list_fields(self):
+        """ List sparse fieldsets of ShopCarts and Items """
+        first, second = self._create_shopcarts(2)
+        items = self._create_items(first.id, 3)
+        resp = self.app.get("/shopcarts?fields=customer_id&limit=1")
+        self.assertEqual(resp.get_json(), [{"customer_id": first.customer_id}])
+        self.assertIn("fields=customer_id", resp.headers["Link"])
+        resp = self.app.get("/shopcarts?fields=id,items.price&stream=true")
+        self.assertEqual(json.loads(resp.get_data(as_text=True)), [
+            {"id": first.id, "items": [{"price": item["price"]} for item in items]},
+            {"id": second.id, "items": []},
+        ])
+        url = "/shopcarts/{}/items".format(first.id)
+        expected = [{"sku": item["sku"], "price": item["price"]} for item in items]
+        self.assertEqual(self.app.get(url + "?fields=sku,price").get_json(), expected)
+        resp = self.app.get(url + "?fields=sku,price&limit=2")
+        self.assertEqual(resp.get_json(), expected[:2])
+        self.assertEqual(resp.headers["X-Next-Cursor"], str(items[1]["id"]))
+        resp = self.app.get("{}/{}?fields=quantity".format(url, items[0]["id"]))
+        self.assertEqual(resp.get_json(), {"quantity": items[0]["quantity"]})
+        resp = self.app.get(url + "?fields=shopcart")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipIf(not MSGPACK_TYPES, "msgpack is not installed")
+    def test_msgpack(self):
+        """ Read and write ShopCarts and Items as MessagePack """
+        body = {"customer_id": 7, "items": [
+            {"shopcart_id": 0, "item_name": "hat", "sku": "HAT-1", "quantity": 2, "price": 9.5}
+        ]}
+        resp = self.app.post(
+            "/shopcarts", data=pack_msgpack(body), content_type=MSGPACK,
+            headers={"Accept": MSGPACK}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.mimetype, MSGPACK)
+        self.assertIn("Accept", resp.headers["Vary"])
+        shopcart = unpack_msgpack(resp.get_data())
+        self.assertEqual(shopcart["items"][0]["sku"], "HAT-1")
+        url = "/shopcarts/{}".format(shopcart["id"])
+        resp = self.app.get(url, headers={"Accept": "application/json;q=0.5, " + MSGPACK})
+        self.assertEqual(unpack_msgpack(resp.get_data()), shopcart)
+        resp = self.app.get(url, headers={"Accept": "*/*"})
+        self.assertEqual(resp.get_json(), shopcart)
+        resp = self.app.patch(url, data=pack_msgpack({"customer_id": 8}), content_type=MSGPACK)
+        self.assertEqual(resp.get_json()["customer_id"], 8)
+        resp = self.app.get("/shopcarts?stream=true", headers={"Accept": MSGPACK})
+        self.assertEqual(unpack_msgpack(resp.get_data())[0]["id"], shopcart["id"])
+        resp = self.app.get(url + "/items/0", headers={"Accept": MSGPACK})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(unpack_msgpack(resp.get_data())["error"], "Not Found")
+
+    @skipIf(not MSGPACK_TYPES, "msgpack is not installed")
+    def test_msgpack_etag(self):
+        """ Tag the ETag of a MessagePack body with its format """
+        shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}".format(shopcart.id)
+        json_etag = self.app.get(url).headers["ETag"]
+        resp = self.app.get(url, headers={"Accept": MSGPACK})
+        etag = resp.headers["ETag"]
+        self.assertEqual(etag, json_etag[:-1] + '-msgpack"')
+        resp = self.app.get(url, headers={"Accept": MSGPACK, "If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        for accept, tag in [(MSGPACK, json_etag), ("application/json", etag)]:
+            resp = self.app.get(url, headers={"Accept": accept, "If-None-Match": tag})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.patch(url, json={"customer_id": 5}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    @skipIf(not MSGPACK_TYPES, "msgpack is not installed")
+    def test_msgpack_bad_request(self):
+        """ Reject a body that is not MessagePack """
+        resp = self.app.post("/shopcarts", data=b"\xc1", content_type=MSGPACK)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post("/shopcarts", data=pack_msgpack([1]), content_type=MSGPACK)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_snapshot(self):
+        """ Export every cart over HTTP and import it back """
+        shopcarts = self._create_shopcarts(2)
+        self._create_items(shopcarts[0].id, 3)
+        resp = self.app.get("/admin/snapshot")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        data = resp.get_data()
+        self.assertEqual(len(data.splitlines()), 5)
+        resp = self.app.get("/admin/snapshot?format=csv&table=shopcart")
+        self.assertEqual(resp.mimetype, "text/csv")
+        self.assertEqual(len(resp.get_data().splitlines()), 3)
+        expected = [self.app.get("/shopcarts/{}".format(s.id)).get_json() for s in shopcarts]
+        self.app.get("/shopcarts/clear")
+        resp = self.app.post("/admin/snapshot", data=data, content_type="application/x-ndjson")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["rows"], {"shopcart": 2, "cart_item": 3})
+        self.assertEqual(
+            [self.app.get("/shopcarts/{}".format(s.id)).get_json() for s in shopcarts], expected
+        )
+        resp = self.app.post("/admin/snapshot", data=data, content_type="application/x-ndjson")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.post("/admin/snapshot", data=data, content_type="application/json")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        resp = self.app.get("/admin/snapshot?format=xml")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_compressed_etag(self):
+        """ Revalidate and update with the ETag of a compressed response """
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, 20)
+        url = "/shopcarts/{}".format(shopcart.id)
+        resp = self.app.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.endswith('-gzip"'))
+        resp = self.app.get(url, headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        resp = self.app.get(url, headers={"If-None-Match": "W/" + etag})
+        self.assertEqual(resp.headers["ETag"], "W/" + etag)
+        resp = self.app.patch(url, json={"customer_id": 5}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
 #### Delete 
+    def test_get_shopcart_summary(self):
+        """ Get the totals of a ShopCart as its items change """
+        shopcart = ShopCartFactory().serialize()
+        shopcart["items"] = [
+            {"shopcart_id": 0, "item_name": "a", "sku": "A", "quantity": 3, "price": 0.1},
+            {"shopcart_id": 0, "item_name": "b", "sku": "B", "quantity": 1, "price": 0.2},
+        ]
+        resp = self.app.post("/shopcarts", json=shopcart, content_type="application/json")
+        shopcart = resp.get_json()
+        url = "/shopcarts/{}/summary".format(shopcart["id"])
+        resp, count = self._count_queries(self.app.get, url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(count, 1)
+        self.assertEqual(
+            resp.get_json(),
+            {"shopcart_id": shopcart["id"], "item_count": 2, "unit_count": 4, "subtotal": 0.5},
+        )
+        etag = resp.headers["ETag"]
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        item = shopcart["items"][0]
+        item["quantity"] = 5
+        self.app.put("/shopcarts/{}/items/{}".format(shopcart["id"], item["id"]), json=item)
+        self.assertEqual(self.app.get(url).get_json()["subtotal"], 0.7)
+        self.app.post("/shopcarts/{}/items/C:increment".format(shopcart["id"]),
+                      json={"quantity": 2, "price": 1.05})
+        self.assertEqual(self.app.get(url).get_json()["subtotal"], 2.8)
+        self.app.delete("/shopcarts/{}/items/{}".format(shopcart["id"], item["id"]))
+        data = self.app.get(url).get_json()
+        self.assertEqual((data["item_count"], data["unit_count"], data["subtotal"]), (2, 3, 2.3))
+        self.app.put("/shopcarts/{}/clear".format(shopcart["id"]))
+        data = self.app.get(url).get_json()
+        self.assertEqual((data["item_count"], data["unit_count"], data["subtotal"]), (0, 0, 0))
+        resp = self.app.get("/shopcarts/0/summary")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_shopcart_summary_batch(self):
+        """ Get the totals of ShopCarts and Items created in batches """
+        shopcart = self._create_shopcarts(1)[0]
+        items = [item.serialize() for item in CartItemFactory.create_batch(3)]
+        self.app.post("/shopcarts/{}/items:batch".format(shopcart.id), json=items)
+        shopcarts = [ShopCartFactory().serialize() for _ in range(2)]
+        shopcarts[0]["items"] = items
+        data = self.app.post("/shopcarts:batch", json=shopcarts).get_json()
+        for cart_id, count in [(shopcart.id, 3), (data[0]["id"], 3), (data[1]["id"], 0)]:
+            summary = self.app.get("/shopcarts/{}/summary".format(cart_id)).get_json()
+            self.assertEqual(summary["item_count"], count)
+            self.assertEqual(summary["unit_count"], sum(i["quantity"] for i in items[:count]))
+            subtotal = sum(i["quantity"] * i["price"] for i in items[:count])
+            self.assertAlmostEqual(summary["subtotal"], subtotal, places=2)
+
+    def _assert_totals(self, shopcart_id):
+        """ Checks the totals of a ShopCart against a recount of its items """
+        items = self.app.get("/shopcarts/{}/items".format(shopcart_id)).get_json()
+        summary = self.app.get("/shopcarts/{}/summary".format(shopcart_id)).get_json()
+        self.assertEqual(summary["item_count"], len(items))
+        self.assertEqual(summary["unit_count"], sum(i["quantity"] for i in items))
+        # a line without a price adds nothing, as in SUM()
+        subtotal = sum(i["quantity"] * (i["price"] or 0) for i in items)
+        self.assertAlmostEqual(summary["subtotal"], subtotal, places=2)
+
+    def test_totals_follow_writes(self):
+        """ Move the totals by every kind of write without recounting them """
+        shopcart, other = self._create_shopcarts(2)
+        base = "/shopcarts/{}".format(shopcart.id)
+        items = self._create_items(shopcart.id, 2)
+        writes = [
+            (self.app.post, base + "/items:batch", [CartItemFactory().serialize()]),
+            (self.app.put, base + "/items/{}".format(items[0]["id"]), dict(items[0], quantity=7)),
+            (self.app.patch, base + "/items/{}".format(items[1]["id"]), {"price": 2.25}),
+            (self.app.patch, base + "/items/{}".format(items[1]["id"]), {"quantity": 4}),
+            (self.app.post, base + "/items/HAT:increment", {"quantity": 3, "price": 1.1}),
+            (self.app.post, base + "/items/HAT:increment", {"quantity": 2}),
+            (self.app.post, base + "/items/HAT:decrement", {"quantity": 1}),
+            (self.app.post, base + "/items/HAT:decrement", {"quantity": 9}),
+            (self.app.delete, base + "/items/{}".format(items[0]["id"]), None),
+            (self.app.post, "/shopcarts/{}/items/HAT:increment".format(other.id), {"quantity": 2}),
+            (self.app.post, base + "/merge?from={}".format(other.id), None),
+            (self.app.put, base, {"customer_id": 1, "items": [CartItemFactory().serialize()]}),
+        ]
+        for method, url, body in writes:
+            resp = method(url, json=body)
+            self.assertLess(resp.status_code, 300, url)
+            self._assert_totals(shopcart.id)
+
     def test_delete_shopcart(self):
         """ Delete a ShopCart """
         # get the id of an shopcart
@@ -169,6 +659,185 @@ class TestYourResourceServer(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_list_shopcarts_query_count(self):
+        """ Listing ShopCarts issues the same number of queries for any count """
+        for shopcart in self._create_shopcarts(2):
+            self._create_items(shopcart.id, 2)
+        db.session.remove()
+        resp, small_count = self._count_queries(self.app.get, "/shopcarts")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+
+        for shopcart in self._create_shopcarts(8):
+            self._create_items(shopcart.id, 2)
+        db.session.remove()
+        resp, large_count = self._count_queries(self.app.get, "/shopcarts")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 10)
+        self.assertEqual(len(data[-1]["items"]), 2)
+        self.assertEqual(small_count, large_count)
+
+    def test_get_shopcart_query_count(self):
+        """ Get a ShopCart with its items in a fixed number of queries """
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, 5)
+        db.session.remove()
+        resp, count = self._count_queries(
+            self.app.get, "/shopcarts/{}".format(shopcart.id)
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()["items"]), 5)
+        self.assertLessEqual(count, 2)
+
+    def test_get_shopcart_list_paged(self):
+        """ Page through the list of ShopCarts """
+        shopcarts = self._create_shopcarts(5)
+        resp = self.app.get("/shopcarts?limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([s["id"] for s in data], [s.id for s in shopcarts[:2]])
+        self.assertEqual(resp.headers["X-Next-Cursor"], str(shopcarts[1].id))
+        self.assertIn('rel="next"', resp.headers["Link"])
+
+        # follow the cursor to the last page
+        resp = self.app.get(
+            "/shopcarts?limit=3&after_id={}".format(resp.headers["X-Next-Cursor"])
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([s["id"] for s in data], [s.id for s in shopcarts[2:]])
+        self.assertIn("X-Next-Cursor", resp.headers)
+
+        resp = self.app.get("/shopcarts?limit=3&after_id={}".format(shopcarts[-1].id))
+        self.assertEqual(resp.get_json(), [])
+        self.assertNotIn("Link", resp.headers)
+
+    def test_query_shopcarts(self):
+        """ Query ShopCarts by customer and item """
+        shopcarts = self._create_shopcarts(3)
+        items = self._create_items(shopcarts[1].id, 2)
+        resp = self.app.get("/shopcarts?customer_id={}".format(shopcarts[0].customer_id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertTrue(data)
+        self.assertTrue(all(s["customer_id"] == shopcarts[0].customer_id for s in data))
+        resp = self.app.get("/shopcarts?customer_id=abc")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        resp = self.app.get("/shopcarts?sku={}".format(items[0]["sku"]))
+        self.assertEqual([s["id"] for s in resp.get_json()], [shopcarts[1].id])
+        resp = self.app.get("/shopcarts?item_name={}".format(items[1]["item_name"]))
+        self.assertEqual([s["id"] for s in resp.get_json()], [shopcarts[1].id])
+        resp = self.app.get("/shopcarts?sku=NONE")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_get_shopcart_list_bad_page(self):
+        """ Get list of ShopCarts with bad paging arguments """
+        resp = self.app.get("/shopcarts?limit=zero")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/shopcarts?limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_shopcart_list_streamed(self):
+        """ Stream the list of ShopCarts """
+        for shopcart in self._create_shopcarts(3):
+            self._create_items(shopcart.id, 2)
+        expected = self.app.get("/shopcarts").get_json()
+        resp = self.app.get("/shopcarts?stream=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(json.loads(resp.get_data(as_text=True)), expected)
+
+        resp = self.app.get("/shopcarts?stream=true&limit=2")
+        self.assertEqual(json.loads(resp.get_data(as_text=True)), expected[:2])
+        self.assertEqual(resp.headers["X-Next-Cursor"], str(expected[1]["id"]))
+
+    def test_get_shopcart_list_rows(self):
+        """ List ShopCarts from plain rows the same as from ORM objects """
+        for shopcart in self._create_shopcarts(3):
+            self._create_items(shopcart.id, 3)
+        expected = [shopcart.serialize() for shopcart in ShopCart.all()]
+        self.assertEqual(self.app.get("/shopcarts").get_json(), expected)
+        batch_size = app.config["STREAM_BATCH_SIZE"]
+        app.config["STREAM_BATCH_SIZE"] = 2
+        try:
+            resp = self.app.get("/shopcarts?stream=true")
+            self.assertEqual(json.loads(resp.get_data(as_text=True)), expected)
+        finally:
+            app.config["STREAM_BATCH_SIZE"] = batch_size
+        resp = self.app.get("/shopcarts/{}/items?limit=2".format(expected[0]["id"]))
+        self.assertEqual(resp.get_json(), expected[0]["items"][:2])
+
+    def test_get_metrics(self):
+        """ Get the Prometheus metrics """
+        self._create_shopcarts(1)
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        self.assertIn("shopcarts_db_pool_checkouts_total", resp.get_data(as_text=True))
+
+    def test_get_metrics_requests(self):
+        """ Get the latency and SQL metrics of requests """
+        shopcart = self._create_shopcarts(1)[0]
+        for histogram in request_metrics.histograms:
+            histogram.series.clear()
+        self.app.get("/shopcarts/{}".format(shopcart.id))
+        self.app.get("/shopcarts/0")
+        text = self.app.get("/metrics").get_data(as_text=True)
+        route = 'method="GET",route="/shopcarts/<int:shopcart_id>"'
+        self.assertIn(
+            'shopcarts_http_request_duration_seconds_count{%s,status="200"} 1' % route, text
+        )
+        self.assertIn(
+            'shopcarts_http_request_duration_seconds_count{%s,status="404"} 1' % route, text
+        )
+        # one query for the cart and one for its items, one for the missing cart
+        self.assertIn('shopcarts_db_queries_per_request_sum{%s} 3' % route, text)
+        self.assertIn('shopcarts_db_queries_per_request_count{%s} 2' % route, text)
+
+    def test_slow_request_log(self):
+        """ Log the SQL of requests over the slow request threshold """
+        shopcart = self._create_shopcarts(1)[0]
+        threshold = request_metrics.slow_request_seconds
+        request_metrics.slow_request_seconds = 0.000001
+        try:
+            with self.assertLogs("service.metrics", level="WARNING") as logs:
+                self.app.get("/shopcarts/{}".format(shopcart.id))
+        finally:
+            request_metrics.slow_request_seconds = threshold
+        self.assertIn("Slow request GET /shopcarts/{}".format(shopcart.id), logs.output[0])
+        self.assertIn("2 SQL statements", logs.output[0])
+        self.assertIn("FROM shopcart", logs.output[0])
+
+    def test_profile_request(self):
+        """ Profile requests that ask for it and read the profiles back """
+        shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}".format(shopcart.id)
+        resp = self.app.get("/admin/profiles")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        profiler.enabled = True
+        try:
+            resp = self.app.get(url)
+            self.assertNotIn("X-Profile-Id", resp.headers)
+            resp = self.app.get(url, headers={"X-Profile": "1"})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            profile_id = resp.headers["X-Profile-Id"]
+            resp = self.app.get("/admin/profiles")
+            self.assertEqual(resp.get_json()[0]["id"], int(profile_id))
+            self.assertEqual(resp.get_json()[0]["path"], url)
+            resp = self.app.get("/admin/profiles/{}".format(profile_id))
+            data = resp.get_json()
+            self.assertEqual(data["db_queries"], 2)
+            self.assertIn("FROM shopcart", data["sql"][0]["statement"])
+            self.assertTrue(data["calls"])
+            functions = json.dumps(data["calls"])
+            self.assertIn("get_shopcarts", functions)
+            resp = self.app.get("/admin/profiles/0")
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        finally:
+            profiler.enabled = False
+
     def test_bad_request(self):
         """ Send wrong media type """
         shopcart = ShopCartFactory()
@@ -221,6 +890,208 @@ class TestYourResourceServer(TestCase):
         self.assertEqual(data["quantity"], item.quantity)
         self.assertEqual(data["price"], item.price)
 
+    def test_add_items_batch(self):
+        """ Add a batch of Items to a ShopCart """
+        shopcart = self._create_shopcarts(1)[0]
+        items = [item.serialize() for item in CartItemFactory.create_batch(5)]
+        resp = self.app.post(
+            "/shopcarts/{}/items:batch".format(shopcart.id),
+            json=items,
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data), 5)
+        self.assertTrue(all(item["shopcart_id"] == shopcart.id for item in data))
+        self.assertEqual(len(set(item["id"] for item in data)), 5)
+        resp = self.app.get("/shopcarts/{}/items".format(shopcart.id))
+        self.assertEqual(resp.get_json(), data)
+
+        items[2].pop("sku")
+        resp = self.app.post(
+            "/shopcarts/{}/items:batch".format(shopcart.id),
+            json=items,
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["errors"][0]["index"], 2)
+
+        resp = self.app.post(
+            "/shopcarts/0/items:batch", json=[], content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_add_item_duplicate_sku(self):
+        """ Add an item with a sku already in the ShopCart """
+        shopcart = self._create_shopcarts(1)[0]
+        item = self._create_items(shopcart.id, 1)[0]
+        resp = self.app.post(
+            "/shopcarts/{}/items".format(shopcart.id), json=item, content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            resp.get_json()["message"], "The request conflicts with existing data"
+        )
+        resp = self.app.get("/shopcarts/{}/items".format(shopcart.id))
+        self.assertEqual(len(resp.get_json()), 1)
+
+    def test_increment_item(self):
+        """ Increment the quantity of an item in a ShopCart """
+        shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}/items/ABC1:increment".format(shopcart.id)
+        resp = self.app.post(url, json={"item_name": "hat", "price": 9.5})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["sku"], "ABC1")
+        self.assertEqual(data["quantity"], 1)
+        self.assertEqual(data["item_name"], "hat")
+        resp, count = self._count_queries(self.app.post, url, json={"quantity": 4})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["id"], data["id"])
+        self.assertEqual(resp.get_json()["quantity"], 5)
+        self.assertEqual(resp.get_json()["price"], 9.5)
+        self.assertLessEqual(count, 3)
+        resp = self.app.get("/shopcarts/{}".format(shopcart.id))
+        self.assertEqual(len(resp.get_json()["items"]), 1)
+        self.assertEqual(resp.get_json()["items"][0]["quantity"], 5)
+
+    def test_one_commit_per_request(self):
+        """ A request commits its writes once, and not at all when it fails """
+        commits = []
+
+        def on_commit(conn):
+            commits.append(conn)
+
+        shopcart = self._create_shopcarts(1)[0]
+        item = CartItemFactory(shopcart_id=shopcart.id)
+        event.listen(db.engine, "commit", on_commit)
+        try:
+            resp = self.app.post(
+                "/shopcarts", json={"customer_id": 1, "items": [item.serialize()]}
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(commits), 1)
+            resp = self.app.post("/shopcarts/0/items/ABC1:increment", json={})
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(len(commits), 1)
+            resp = self.app.get("/shopcarts/{}".format(shopcart.id))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(commits), 1)
+        finally:
+            event.remove(db.engine, "commit", on_commit)
+
+    def test_failed_commit_rolls_back(self):
+        """ A request whose commit fails leaves nothing behind for the next one """
+        failures = [RuntimeError("commit failed")]
+
+        def before_commit(session):
+            if failures:
+                raise failures.pop()
+
+        event.listen(db.session, "before_commit", before_commit)
+        try:
+            with self.assertRaises(RuntimeError):
+                self.app.post("/shopcarts", json={"customer_id": 1})
+            resp = self.app.post("/shopcarts", json={"customer_id": 2})
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        finally:
+            event.remove(db.session, "before_commit", before_commit)
+        db.session.remove()
+        self.assertEqual([s.customer_id for s in ShopCart.all()], [2])
+
+    def test_read_ends_transaction(self):
+        """ A read-only request, streamed or not, gives its connection back """
+        shopcart = self._create_shopcarts(1)[0]
+        db.session.remove()
+        for url in ["/shopcarts/%d" % shopcart.id, "/shopcarts"]:
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp.get_data()
+            self.assertFalse(db.session.registry.has())
+
+    def test_merge_shopcarts(self):
+        """ Merge a guest ShopCart into a customer ShopCart """
+        for policy, merged in [("sum", 5), ("max", 3), ("target", 2), ("source", 3), (None, 5)]:
+            target, source = self._create_shopcarts(2)
+            for shopcart_id, sku, quantity in [
+                (target.id, "HAT", 2), (source.id, "HAT", 3), (source.id, "SOCK", 1)
+            ]:
+                self.app.post(
+                    "/shopcarts/{}/items/{}:increment".format(shopcart_id, sku),
+                    json={"quantity": quantity, "item_name": sku.lower(), "price": 1.5},
+                )
+            url = "/shopcarts/{}/merge?from={}".format(target.id, source.id)
+            if policy:
+                url += "&policy=" + policy
+            resp, count = self._count_queries(self.app.post, url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.get_json()
+            quantities = {item["sku"]: item["quantity"] for item in data["items"]}
+            self.assertEqual(quantities, {"HAT": merged, "SOCK": 1})
+            self.assertEqual(resp.headers["ETag"], '"{}-{}"'.format(target.id, data["version"]))
+            self.assertLessEqual(count, 7)
+            resp = self.app.get("/shopcarts/{}".format(source.id))
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+            resp = self.app.get("/shopcarts/{}/summary".format(target.id))
+            self.assertEqual(resp.get_json()["unit_count"], merged + 1)
+
+    def test_merge_shopcarts_bad_request(self):
+        """ Merge ShopCarts that are missing or with bad arguments """
+        target, source = self._create_shopcarts(2)
+        url = "/shopcarts/{}/merge".format(target.id)
+        for query in ["", "?from=x", "?from={}".format(target.id),
+                      "?from={}&policy=min".format(source.id)]:
+            resp = self.app.post(url + query)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(url + "?from=0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.post("/shopcarts/0/merge?from={}".format(source.id))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get("/shopcarts/{}".format(source.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_increment_item_bad_request(self):
+        """ Increment an item by a bad quantity or in a missing ShopCart """
+        shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}/items/ABC1:increment".format(shopcart.id)
+        for quantity in [0, -1, "2", True]:
+            resp = self.app.post(url, json={"quantity": quantity})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        for body in [{"price": "abc"}, {"price": True}, {"item_name": 5}]:
+            resp = self.app.post(url, json=dict(body, quantity=1))
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(url, data="quantity=2", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        resp = self.app.post("/shopcarts/0/items/ABC1:increment")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_decrement_item(self):
+        """ Decrement the quantity of an item until it is removed """
+        shopcart = self._create_shopcarts(1)[0]
+        self.app.post(
+            "/shopcarts/{}/items/ABC1:increment".format(shopcart.id), json={"quantity": 3}
+        )
+        url = "/shopcarts/{}/items/ABC1:decrement".format(shopcart.id)
+        resp = self.app.post(url, json={"quantity": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 1)
+        resp = self.app.post(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.post(url)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get("/shopcarts/{}/items".format(shopcart.id))
+        self.assertEqual(resp.get_json(), [])
+
+    def test_increment_item_bumps_etag(self):
+        """ Increment an item and get a new ETag for the ShopCart """
+        shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}".format(shopcart.id)
+        etag = self.app.get(url).headers["ETag"]
+        self.app.post("{}/items/ABC1:increment".format(url))
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
     def test_get_item(self):
         """ Get an item from a ShopCart """
         # create a known address
@@ -251,6 +1122,8 @@ class TestYourResourceServer(TestCase):
         self.assertEqual(data["sku"], item.sku)
         self.assertEqual(data["quantity"], item.quantity)
         self.assertEqual(data["price"], item.price)
+        resp = self.app.get("/shopcarts/{}/items/0".format(shopcart.id))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_update_item(self):
         """ Update an item in a ShopCart """
@@ -290,6 +1163,61 @@ class TestYourResourceServer(TestCase):
         self.assertEqual(data["shopcart_id"], shopcart.id)
         self.assertEqual(data["item_name"], "item_name")
 
+    def test_update_item_if_match(self):
+        """ Update an item in a ShopCart with If-Match """
+        shopcart = self._create_shopcarts(1)[0]
+        item = self._create_items(shopcart.id, 1)[0]
+        url = "/shopcarts/{}/items/{}".format(shopcart.id, item["id"])
+        resp = self.app.get(url)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        item["quantity"] = 7
+        resp = self.app.put(url, json=item, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        new_etag = resp.headers["ETag"]
+        self.assertNotEqual(new_etag, etag)
+        resp = self.app.put(url, json=item, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.get(url, headers={"If-None-Match": new_etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_item_routes_scoped_to_cart(self):
+        """ Items are only found through the ShopCart they are in """
+        shopcart, other = self._create_shopcarts(2)
+        item = self._create_items(shopcart.id, 1)[0]
+        url = "/shopcarts/{}/items/{}".format(other.id, item["id"])
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.put(url, json=dict(item, quantity=9))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        # the item is still there, unchanged
+        url = "/shopcarts/{}/items/{}".format(shopcart.id, item["id"])
+        resp, count = self._count_queries(self.app.get, url)
+        self.assertEqual(resp.get_json(), item)
+        self.assertEqual(count, 1)
+        # and a PUT through its own cart cannot move it to another
+        resp = self.app.put(url, json=dict(item, shopcart_id=other.id, quantity=9))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["shopcart_id"], shopcart.id)
+
+    def test_list_items_query_count(self):
+        """ List the Items of a ShopCart with one query """
+        shopcart, empty = self._create_shopcarts(2)
+        self._create_items(shopcart.id, 3)
+        db.session.remove()
+        resp, count = self._count_queries(self.app.get, "/shopcarts/{}/items".format(shopcart.id))
+        self.assertEqual(len(resp.get_json()), 3)
+        self.assertEqual(count, 1)
+        resp = self.app.get("/shopcarts/{}/items".format(empty.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+        resp = self.app.get("/shopcarts/0/items")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
 ##### Listing Test Case ## 
     def test_get_shopcart_items_list(self):
         """ Get a list of Items in a ShopCart """
@@ -323,6 +1251,20 @@ class TestYourResourceServer(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 2)
 
+    def test_get_shopcart_items_list_paged(self):
+        """ Page through the Items in a ShopCart """
+        shopcart = self._create_shopcarts(1)[0]
+        items = self._create_items(shopcart.id, 3)
+        resp = self.app.get("/shopcarts/{}/items?limit=2".format(shopcart.id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), items[:2])
+        resp = self.app.get("/shopcarts/{}/items?stream=1&after_id={}".format(
+            shopcart.id, resp.headers["X-Next-Cursor"]
+        ))
+        self.assertEqual(json.loads(resp.get_data(as_text=True)), items[2:])
+        resp = self.app.get("/shopcarts/0/items?limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_delete_item(self):
         """ Delete an Item """
         shopcart = self._create_shopcarts(1)[0]
@@ -380,6 +1322,25 @@ class TestYourResourceServer(TestCase):
             content_type="application/json"
         )
         self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(resp.headers["X-Deleted-Count"], "2")
+        resp = self.app.get("/shopcarts/{}/items".format(shopcart.id))
+        self.assertEqual(resp.get_json(), [])
+
+    def test_clear_shopcart_query_count(self):
+        """ Clear a ShopCart with a fixed number of queries """
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, 2)
+        resp, small_count = self._count_queries(
+            self.app.put, "/shopcarts/{}/clear".format(shopcart.id)
+        )
+        self._create_items(shopcart.id, 10)
+        resp, large_count = self._count_queries(
+            self.app.put, "/shopcarts/{}/clear".format(shopcart.id)
+        )
+        self.assertEqual(resp.headers["X-Deleted-Count"], "10")
+        self.assertEqual(small_count, large_count)
+        resp = self.app.put("/shopcarts/0/clear")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
 
 #### Delete All Shopcarts
@@ -395,3 +1356,21 @@ class TestYourResourceServer(TestCase):
             content_type="application/json"
         )
         self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(resp.headers["X-Deleted-Count"], "5")
+        resp = self.app.get("/shopcarts")
+        self.assertEqual(resp.get_json(), [])
+
+    def test_delete_all_shopcarts_cascades(self):
+        """ Delete All ShopCarts and their Items with a fixed number of queries """
+        shopcarts = self._create_shopcarts(3)
+        for shopcart in shopcarts:
+            self._create_items(shopcart.id, 2)
+        resp, count = self._count_queries(
+            self.app.get, "/shopcarts/clear?id={}".format(shopcarts[0].id)
+        )
+        self.assertEqual(resp.headers["X-Deleted-Count"], "1")
+        self.assertEqual(CartItem.query.count(), 4)
+        resp, count_all = self._count_queries(self.app.get, "/shopcarts/clear")
+        self.assertEqual(resp.headers["X-Deleted-Count"], "2")
+        self.assertEqual(CartItem.query.count(), 0)
+        self.assertEqual(count, count_all)